@@ -0,0 +1,295 @@
+'''Benchmarks of the routing hot paths on synthetic networks.
+Synthetic networks are grids of lines in the JSON format used by load_data:
+half of the lines are rows and half columns of a grid of n_stations x
+n_stations positions, the station at a position is named 'R{row}C{col}' and
+the positions where a row and a column cross are the station nodes. Distances
+between consecutive stations are random (seeded) multiples of 100 m.
+Results JSON Format: {
+    "python": version, "network": {"lines", "stations", "nodes", ...},
+    "benchmarks": {name -> {"calls", "min", "median", "mean", "max",
+                            "peakMemory", ...}}
+}
+    Times are in seconds per call and peakMemory in bytes, measured with
+tracemalloc in a separate run so it doesn't slow down the timed one.
+    python benchmark.py --lines 8 --stations 40 --output bench.json
+    With --clicks, the station lookup of main.py is timed for maps of the
+given numbers of stations instead, with the density of the Athens map, as a
+scan of all the stations ("scan") and with spatial_index.GridIndex ("grid").
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from min_route import MetAtenas, load_data
+from spatial_index import GridIndex
+
+# Stations of the Athens map, in pixels^2 per station, and the distance to
+# a station to click it (see main.py)
+MAP_AREA_PER_STATION = 710*778/60
+STATION_R = 10
+
+# Departures the min_cam scenarios are run at, (day, hour, minute)
+DEPARTURES = (("Monday", 8, 0), ("Wednesday", 13, 30), ("Friday", 21, 0),
+              ("Saturday", 1, 30))
+
+
+def synthetic_network(n_lines=6, n_stations=30, seed=0):
+    '''
+    synthetic_network
+    -----------------
+    Returns a grid network of n_lines lines of n_stations stations in the
+    JSON format used by load_data (see the module description).'''
+    rng = random.Random(seed)
+    n_rows = n_lines//2
+    n_cols = n_lines - n_rows
+    rows = [(2*pos + 1)*n_stations//(2*n_rows) for pos in range(n_rows)]
+    cols = [(2*pos + 1)*n_stations//(2*n_cols) for pos in range(n_cols)]
+    lineas = []
+    for row in rows:
+        lineas.append([f"R{row}C{col}" for col in range(n_stations)])
+    for col in cols:
+        lineas.append([f"R{row}C{col}" for row in range(n_stations)])
+    for pos, st_names in enumerate(lineas):
+        distance, line = 0, []
+        for st_name in st_names:
+            line.append([st_name, distance])
+            distance += rng.randint(5, 20)*100
+        lineas[pos] = line
+    return {'__lineasMetro__': True, 'lineas': lineas,
+            'stNodes': [f"R{row}C{col}" for row in rows for col in cols]}
+
+
+def time_call(func, repeat=5):
+    '''
+    time_call
+    ---------
+    Calls func repeat times and returns the statistics of the time of each
+    call, in seconds.'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return time_stats(times)
+
+
+def time_stats(times):
+    '''
+    time_stats
+    ----------
+    Returns the number of calls and the min, median, mean and max of
+    times.'''
+    return {'calls': len(times), 'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.fmean(times), 'max': max(times)}
+
+
+def peak_memory(func):
+    '''
+    peak_memory
+    -----------
+    Returns the peak of memory allocated, in bytes, while func runs.'''
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def query_pairs(st_names, n_queries, rng):
+    '''
+    query_pairs
+    -----------
+    Returns n_queries random pairs of different stations of st_names.'''
+    return [tuple(rng.sample(st_names, 2)) for _ in range(n_queries)]
+
+
+def fault_lines(metro, n_faults, rng):
+    '''
+    fault_lines
+    -----------
+    Returns n_faults random pairs of adyacent station nodes of metro, the
+    lines broken by the fault scenario.'''
+    edges = sorted({tuple(sorted((st_name, ady[0])))
+                    for st_name, adys in metro.st_nodes.items()
+                    for ady in adys})
+    return rng.sample(edges, min(n_faults, len(edges)))
+
+
+def bench_queries(metro, pairs):
+    '''
+    bench_queries
+    -------------
+    Times min_cam for every pair at every departure of DEPARTURES. Returns
+    the statistics of the time per query, with the peak of memory of the
+    queries and the number of routes found.'''
+    def run(times=None):
+        found = 0
+        for day, hour, minute in DEPARTURES:
+            metro.set_hour(day, hour, minute)
+            for st_from, st_to in pairs:
+                start = time.perf_counter()
+                route = metro.min_cam(st_from, st_to)
+                if times is not None:
+                    times.append(time.perf_counter() - start)
+                found += route is not None
+        return found
+    times = []
+    found = run(times)
+    metro.clear_heuristics()
+    stats = time_stats(times)
+    stats['peakMemory'] = peak_memory(run)
+    stats['routes'] = found
+    return stats
+
+
+def run_benchmarks(file_name, n_queries=200, n_faults=3, repeat=5, seed=0):
+    '''
+    run_benchmarks
+    --------------
+    Runs the benchmarks on the network stored at file_name and returns
+    their results (see the module description).'''
+    rng = random.Random(seed)
+    results = {}
+    results['load_data'] = time_call(lambda: load_data(file_name), repeat)
+    results['load_data']['peakMemory'] = peak_memory(
+        lambda: load_data(file_name))
+    results['init'] = time_call(lambda: MetAtenas(file_name), repeat)
+    results['init']['peakMemory'] = peak_memory(lambda: MetAtenas(file_name))
+    metro = MetAtenas(file_name)
+    results['init']['steps'] = metro.init_times
+    nodes = list(metro.st_nodes)
+    others = [st_name for st_name in metro.st_lin
+              if st_name not in metro.st_nodes]
+
+    # heuristic_costs doesn't keep the tables, heuristic_table does
+    results['heuristic_costs'] = time_stats([
+        time_call(lambda st_name=st_name: metro.heuristic_costs(st_name),
+                  1)['min']
+        for st_name in rng.sample(nodes, min(len(nodes), 10))
+        for _ in range(repeat)])
+    node_pairs = query_pairs(nodes, n_queries, rng)
+    results['min_cam_nodes'] = bench_queries(metro, node_pairs)
+    if len(others) > 1:
+        results['min_cam_stations'] = bench_queries(
+            metro, query_pairs(others, n_queries, rng))
+    faults = fault_lines(metro, n_faults, rng)
+    for st_from, st_to in faults:
+        metro.break_line(st_from, st_to)
+    results['min_cam_faults'] = bench_queries(metro, node_pairs)
+    results['min_cam_faults']['faults'] = len(faults)
+    for st_from, st_to in faults:
+        metro.restore_line(st_from, st_to)
+    return results
+
+
+def bench_clicks(sizes, n_clicks=1000, seed=0):
+    '''
+    bench_clicks
+    ------------
+    Times the station lookup of a click on random maps of each number of
+    stations of sizes. Returns {size -> {'scan', 'grid', 'build'}}.'''
+    rng = random.Random(seed)
+    results = {}
+    for size in sizes:
+        side = int((size*MAP_AREA_PER_STATION)**0.5)
+        points = [(pos, rng.randint(0, side), rng.randint(0, side))
+                  for pos in range(size)]
+        clicks = [(rng.randint(0, side), rng.randint(0, side))
+                  for _ in range(n_clicks)]
+
+        def scan(x, y):
+            for key, point_x, point_y in points:
+                if abs(x - point_x) <= STATION_R and \
+                        abs(y - point_y) <= STATION_R:
+                    return key
+            return None
+        start = time.perf_counter()
+        index = GridIndex.from_points(points, 2*STATION_R)
+        build = time.perf_counter() - start
+        results[size] = {'build': build}
+        for name, find in (('scan', scan), ('grid', lambda x, y:
+                                            index.nearest(x, y, STATION_R))):
+            times = []
+            for x, y in clicks:
+                start = time.perf_counter()
+                find(x, y)
+                times.append(time.perf_counter() - start)
+            results[size][name] = time_stats(times)
+    return results
+
+
+def main(argv=None):
+    '''
+    main
+    ----
+    Command line entry point, writes the results as JSON.'''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--network', help="lineasMetro json file to use "
+                        "instead of a synthetic network")
+    parser.add_argument('--lines', type=int, default=6)
+    parser.add_argument('--stations', type=int, default=30)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--faults', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="file for the results, stdout if "
+                        "not given")
+    parser.add_argument('--clicks', type=int, nargs='+', metavar='STATIONS',
+                        help="time the clicks on maps of these sizes")
+    args = parser.parse_args(argv)
+    if args.clicks is not None:
+        results = {'python': platform.python_version(),
+                   'clicks': bench_clicks(args.clicks, seed=args.seed)}
+        write_results(results, args.output)
+        return
+    file_name, network = args.network, {'file': args.network}
+    if file_name is None:
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False,
+                                         encoding="utf-8") as file:
+            json.dump(synthetic_network(args.lines, args.stations,
+                                        args.seed), file)
+            file_name = file.name
+        network = {'lines': args.lines, 'stations': args.stations,
+                   'seed': args.seed}
+    try:
+        data = load_data(file_name)
+        network.update({'lines': len(data['stNm']),
+                        'totalStations': len(data['lin']),
+                        'nodes': len(data['stNodes'])})
+        results = {'python': platform.python_version(), 'network': network,
+                   'queries': args.queries, 'departures': DEPARTURES,
+                   'benchmarks': run_benchmarks(file_name, args.queries,
+                                                args.faults, args.repeat,
+                                                args.seed)}
+    finally:
+        if args.network is None:
+            os.remove(file_name)
+    write_results(results, args.output)
+
+
+def write_results(results, output=None):
+    '''
+    write_results
+    -------------
+    Writes results as JSON at the file output, or at stdout if it is
+    None.'''
+    if output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(output, 'w', encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import json
+import os
+
+import pytest
+
+from min_route import MetAtenas, lineas_metro_hook
+
+LINEAS_METRO = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'lineasMetro.json')
+
+
+def metro_with_nodes(*nodes):
+    # lineasMetro.json with nodes added to its stNodes
+    with open(LINEAS_METRO) as file:
+        data = json.load(file)
+    data['stNodes'] += list(nodes)
+    return MetAtenas(lineas_metro_hook(data))
+
+
+@pytest.fixture(scope='module')
+def middle_metro():
+    # Nodes in the middle of the lines, so that some intervals are between
+    # two nodes (middle intervals)
+    return metro_with_nodes('Kato Patissia', 'Neratziotissa', 'Evangelismos',
+                            'Holargos')
+
+
+@pytest.fixture(scope='module')
+def extended_metro():
+    # More nodes, so that there are several paths with transfers between
+    # the same stations
+    return metro_with_nodes('Faliro', 'Thissio', 'Akropoli', 'Dafni',
+                            'Eleonas', 'Katehaki')
+
+
+@pytest.fixture(scope='module')
+def athens_metro():
+    return MetAtenas(LINEAS_METRO)
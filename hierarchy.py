@@ -0,0 +1,312 @@
+'''Contraction hierarchy of the station node graph expanded with its lines,
+for a train speed and a time bucket of the week.
+Hierarchy JSON Format: {
+    "__contractionHierarchy__": true,
+    "names": [stNode1, stNode2, ...],
+    "states": [[st_id, st_lin], ...],
+    "speed": train_speed, "bucket": bucket, "bucketMinutes": bucket_minutes,
+    "fingerprint": CompiledGraph.fingerprint(),
+    "rank": [state -> order in which it was contracted],
+    "up": [state -> [[nxt_state, cost, middle], ...]]
+}
+    Every state (st_id, st_lin) is a node of the graph reached through one of
+its lines. The states are joined by the lines between two nodes (distance /
+train speed) and by the transfers between two lines of a node (transfer time
+at the start of the bucket), so the transfers are edges of the graph. "up"
+stores the edges of each state to the states contracted after it, middle
+being the state a shortcut skips (-1 if it is an edge of the graph).
+'''
+
+import json
+from collections import defaultdict
+
+from metro_graph import week_time
+from min_route import HeapFrontier
+
+# Nodes a witness search settles before it gives up and adds the shortcut
+WITNESS_LIMIT = 64
+
+
+class ContractionHierarchy:
+    '''
+    ContractionHierarchy
+    --------------------
+    Contraction hierarchy of the states (node, line), queried with a
+    bidirectional search that only follows the edges to states contracted
+    later. The path found is the one of the transfer times of the start of
+    the bucket, its costs are calculated again for the actual departure time
+    with route_costs, as in route_table.RouteTable.'''
+    def __init__(self, names, states, speed, bucket, bucket_minutes,
+                 fingerprint, rank, up):
+        self.names = tuple(names)
+        self.ids = {st_name: st_id for st_id, st_name in enumerate(self.names)}
+        self.states = tuple(tuple(state) for state in states)
+        self.state_ids = {state: pos for pos, state in enumerate(self.states)}
+        # st_id -> [state, ...] of its lines
+        self.node_states = defaultdict(list)
+        for pos, (st_id, _) in enumerate(self.states):
+            self.node_states[st_id].append(pos)
+        self.speed = speed
+        self.bucket = bucket
+        self.bucket_minutes = bucket_minutes
+        self.fingerprint = fingerprint
+        self.rank = list(rank)
+        # up = [state -> {nxt_state -> (cost, middle)}]
+        self.up = [{nxt: (cost, middle) for nxt, cost, middle in edges}
+                   for edges in up]
+        # False while the network of metro differs from the one it was built
+        # for (see MetAtenas.edge_changed)
+        self.active = True
+
+    @classmethod
+    def build(cls, metro, bucket_minutes=30):
+        '''
+        build
+        -----
+        Builds the hierarchy of metro for its current train speed and the time
+        bucket of bucket_minutes its start_travel_time belongs to.'''
+        states, speed = metro.state_graph, metro.train_speed
+        graph = states.graph
+        bucket = metro.time_bucket(bucket_minutes)
+        # adyacencies = [state -> {nxt_state -> (cost, middle)}]
+        adyacencies = [{} for _ in range(len(states))]
+
+        def add_edge(state_1, state_2, cost, middle=-1):
+            old = adyacencies[state_1].get(state_2)
+            if old is None or cost < old[0]:
+                adyacencies[state_1][state_2] = (cost, middle)
+                adyacencies[state_2][state_1] = (cost, middle)
+        for state in range(len(states)):
+            for edge in states.travels(state):
+                add_edge(state, states.travel_targets[edge],
+                         states.travel_distances[edge]/speed)
+        day, hour, minute = week_time(bucket*bucket_minutes)
+        tm_trans = metro.transfer_time_at(day, hour, minute)
+        if tm_trans > 0:  # The metro is open at the start of the bucket
+            for state in range(len(states)):
+                for other in states.transfers(state):
+                    add_edge(state, other, tm_trans)
+        rank, up = contract(adyacencies)
+        return cls(graph.names, zip(states.nodes, states.lines), speed,
+                   bucket, bucket_minutes, graph.fingerprint(), rank,
+                   [[[nxt, cost, middle]
+                     for nxt, (cost, middle) in edges.items()]
+                    for edges in up])
+
+    def matches(self, metro):
+        '''
+        matches
+        -------
+        Returns True if the hierarchy can answer the queries of metro with
+        its current network, speed and departure time.'''
+        return (self.active and self.speed == metro.train_speed
+                and self.bucket == metro.time_bucket(self.bucket_minutes))
+
+    def search(self, sources, targets):
+        '''
+        search
+        ------
+        Bidirectional search over the upward edges between the states
+        sources and targets. Returns (cost, meeting state, labels, expanded),
+        labels being {state -> (cost, state_prev)} of each direction, or None
+        if they are not connected.'''
+        labels = ({}, {})
+        open_stcks = (HeapFrontier(), HeapFrontier())
+        for side, starts in enumerate((sources, targets)):
+            for state in starts:
+                open_stcks[side].push(0, (state, 0, -1))
+        best, meet, expanded = float('inf'), None, 0
+        while True:
+            tops = [open_stck.peek()[1] if len(open_stck) != 0
+                    else float('inf') for open_stck in open_stcks]
+            # No path left through a state of cost lower than best
+            if min(tops) >= best:
+                break
+            side = 0 if tops[0] <= tops[1] else 1
+            state, cost, state_prev = open_stcks[side].pop()
+            if state in labels[side]:
+                continue
+            labels[side][state] = (cost, state_prev)
+            expanded += 1
+            other = labels[1 - side].get(state)
+            if other is not None and cost + other[0] < best:
+                best, meet = cost + other[0], state
+            for nxt, (edge_cost, _) in self.up[state].items():
+                if nxt not in labels[side]:
+                    open_stcks[side].push(cost + edge_cost,
+                                          (nxt, cost + edge_cost, state))
+        if meet is None:
+            return None
+        return best, meet, labels, expanded
+
+    def unpack(self, state_1, state_2):
+        '''
+        unpack
+        ------
+        Returns the states of the graph the edge between state_1 and state_2
+        goes through, without state_1.'''
+        low, high = (state_1, state_2) \
+            if self.rank[state_1] < self.rank[state_2] else (state_2, state_1)
+        middle = self.up[low][high][1]
+        if middle == -1:
+            return [state_2]
+        return self.unpack(state_1, middle) + self.unpack(middle, state_2)
+
+    def path(self, st_from, st_to, lin_from=0, lin_to=0):
+        '''
+        path
+        ----
+        Returns the node names of the shortest path between st_from and st_to
+        and the lines used to reach each of them after st_from, and the
+        number of states expanded. Returns None if st_to can't be reached.'''
+        id_from, id_to = self.ids[st_from], self.ids[st_to]
+        sources = [state for state in self.node_states[id_from]
+                   if lin_from in {0, self.states[state][1]}]
+        targets = [state for state in self.node_states[id_to]
+                   if lin_to in {0, self.states[state][1]}]
+        found = self.search(sources, targets)
+        if found is None:
+            return None
+        _, meet, labels, expanded = found
+        states, state = [meet], meet
+        while labels[0][state][1] != -1:
+            state = labels[0][state][1]
+            states.append(state)
+        states.reverse()
+        state = meet
+        while labels[1][state][1] != -1:
+            states.append(labels[1][state][1])
+            state = labels[1][state][1]
+        full_states = [states[0]]
+        for state_1, state_2 in zip(states, states[1:]):
+            full_states += self.unpack(state_1, state_2)
+        path, path_lines = [self.names[self.states[full_states[0]][0]]], []
+        for state in full_states[1:]:
+            st_id, lin = self.states[state]
+            if self.names[st_id] != path[-1]:  # Transfers stay at the node
+                path.append(self.names[st_id])
+                path_lines.append(lin)
+        return tuple(path), tuple(path_lines), expanded
+
+    def route(self, metro, st_from, st_to, lin_from=0, lin_to=0, tm_used=0):
+        '''
+        route
+        -----
+        Answers min_cam from the hierarchy. The costs of the path are the ones
+        obtained at metro.route_costs for its departure time.'''
+        found = self.path(st_from, st_to, lin_from, lin_to)
+        if found is None:
+            return None
+        path, path_lines, expanded = found
+        metro.count_search('hierarchy', expanded)
+        costs = metro.route_costs(path, path_lines, lin_from, lin_to, tm_used)
+        if costs is None:
+            return None
+        return {'path': path, 'dist': costs[0], 'tmTrans': costs[1]}
+
+    def save(self, file_name):
+        '''
+        save
+        ----
+        Stores the hierarchy at file_name in the Hierarchy JSON format.'''
+        data = {'__contractionHierarchy__': True, 'names': self.names,
+                'states': self.states, 'speed': self.speed,
+                'bucket': self.bucket, 'bucketMinutes': self.bucket_minutes,
+                'fingerprint': self.fingerprint, 'rank': self.rank,
+                'up': [[[nxt, cost, middle]
+                        for nxt, (cost, middle) in edges.items()]
+                       for edges in self.up]}
+        with open(file_name, 'w', encoding="utf-8") as file:
+            json.dump(data, file)
+
+    @classmethod
+    def load(cls, file_name):
+        '''
+        load
+        ----
+        Loads a hierarchy stored with save.'''
+        with open(file_name, 'r', encoding="utf-8") as file:
+            data = json.load(file)
+        if '__contractionHierarchy__' not in data:
+            raise ValueError(f"{file_name} is not a contraction hierarchy")
+        return cls(data['names'], data['states'], data['speed'],
+                   data['bucket'], data['bucketMinutes'], data['fingerprint'],
+                   data['rank'], data['up'])
+
+
+def shortcuts(adyacencies, state):
+    '''
+    shortcuts
+    ---------
+    Returns the shortcuts (state_1, state_2, cost) needed to contract state,
+    those between two of its adyacents that have no path as short as the
+    one through state without it (witness search).'''
+    edges = adyacencies[state]
+    needed = []
+    for state_1, (cost_1, _) in edges.items():
+        # Limited Dijkstra from state_1 that avoids state
+        max_cost = cost_1 + max(cost for cost, _ in edges.values())
+        dists, open_stck, settled = {}, HeapFrontier(), 0
+        open_stck.push(0, (state_1, 0))
+        while len(open_stck) != 0 and settled < WITNESS_LIMIT:
+            st_at, cost = open_stck.pop()
+            if st_at in dists:
+                continue
+            dists[st_at] = cost
+            settled += 1
+            if cost > max_cost:
+                break
+            for nxt, (edge_cost, _) in adyacencies[st_at].items():
+                if nxt != state and nxt not in dists:
+                    open_stck.push(cost + edge_cost, (nxt, cost + edge_cost))
+        for state_2, (cost_2, _) in edges.items():
+            # Each pair once, the graph is undirected
+            if state_2 <= state_1:
+                continue
+            witness = dists.get(state_2)
+            if witness is None or witness > cost_1 + cost_2 + 1e-9:
+                needed.append((state_1, state_2, cost_1 + cost_2))
+    return needed
+
+
+def contract(adyacencies):
+    '''
+    contract
+    --------
+    Contracts the states of adyacencies, [state -> {nxt_state -> (cost,
+    middle)}], in the order of their edge difference (shortcuts added minus
+    edges removed) plus the number of adyacents already contracted, updated
+    lazily. Modifies adyacencies and returns (rank, up).'''
+    n_states = len(adyacencies)
+    rank, up = [0]*n_states, [None]*n_states
+    contracted_nbrs = [0]*n_states
+
+    def priority(state):
+        return (len(shortcuts(adyacencies, state)) - len(adyacencies[state])
+                + contracted_nbrs[state])
+    # queue items = (priority, state)
+    queue = HeapFrontier()
+    for state in range(n_states):
+        prio = priority(state)
+        queue.push(prio, (prio, state))
+    order = 0
+    while len(queue) != 0:
+        state = queue.pop()[1]
+        if up[state] is not None:
+            continue
+        # Lazy update, contract it only if it is still the lowest one
+        new_priority = priority(state)
+        if len(queue) != 0 and new_priority > queue.peek()[0]:
+            queue.push(new_priority, (new_priority, state))
+            continue
+        for state_1, state_2, cost in shortcuts(adyacencies, state):
+            old = adyacencies[state_1].get(state_2)
+            if old is None or cost < old[0]:
+                adyacencies[state_1][state_2] = (cost, state)
+                adyacencies[state_2][state_1] = (cost, state)
+        rank[state], order = order, order + 1
+        up[state] = adyacencies[state]
+        for nxt in up[state]:
+            del adyacencies[nxt][state]
+            contracted_nbrs[nxt] += 1
+    return rank, up
@@ -0,0 +1,218 @@
+'''Per query instrumentation of MetAtenas.min_cam, enabled with
+MetAtenas.use_instrumentation. While it is not enabled the searches only check
+that MetAtenas.instrumentation is None once per query, search and heuristic
+table.
+Query Stats Format: {
+    'from': st_from, 'to': st_to, 'departure': start_travel_time,
+    'found': a route was found, 'cacheHit': it came from the result cache,
+    'time': seconds of the query, 'heuristicTime': seconds spent calculating
+        heuristic tables, 'searchTime': time - heuristicTime,
+    'searches': {mode -> searches}, 'expanded': {mode -> nodes expanded},
+    'pushes', 'pops': operations on the open sets of MetAtenas.frontier,
+    'stalePops': pops that expanded no node, other than the pop of the goal
+        that ends a search,
+    'transferCalls': calls to transfer_line_time and transfer_at,
+    'heuristicHits', 'heuristicMisses': tables found or not at the h_cache
+}
+    Hooks are called as hook(event, data) with the events:
+    'query_start': (st_from, st_to)
+    'search': (mode, expanded), at the end of every search
+    'query_end': the stats of the query
+'''
+
+import time
+from collections import deque
+
+# Counters of a query, set to 0 when it starts
+COUNTERS = ('pushes', 'pops', 'transferCalls', 'heuristicHits',
+            'heuristicMisses')
+# Methods of MetAtenas replaced by the ones that count their calls
+TRANSFER_METHODS = ('transfer_line_time', 'transfer_at')
+
+
+def counting_frontier(frontier, instrumentation):
+    '''
+    counting_frontier
+    -----------------
+    Returns a subclass of the open set class frontier that counts its pushes
+    and pops at instrumentation.'''
+    class CountingFrontier(frontier):
+        def push(self, cost, item):
+            instrumentation.counters['pushes'] += 1
+            super().push(cost, item)
+
+        def pop(self):
+            instrumentation.counters['pops'] += 1
+            return super().pop()
+    CountingFrontier.__name__ = 'Counting' + frontier.__name__
+    # Orders as frontier, used by the keys of result_cache
+    CountingFrontier.base = frontier
+    return CountingFrontier
+
+
+class Instrumentation:
+    '''
+    Instrumentation
+    ---------------
+    Collects the stats of the queries of the MetAtenas it is attached to and
+    calls the hooks added with add_hook. The stats of the last keep queries
+    are stored at queries, totals has the sum of all of them. clock is the
+    timer used, in seconds.'''
+    def __init__(self, keep=100, clock=time.perf_counter):
+        self.clock = clock
+        self.queries = deque(maxlen=keep)
+        self.totals = {'queries': 0, 'cacheHits': 0, 'time': 0.0,
+                       'heuristicTime': 0.0, 'expanded': 0}
+        self.totals.update(dict.fromkeys(COUNTERS, 0))
+        # event -> [hook, ...]
+        self.hooks = {'query_start': [], 'search': [], 'query_end': []}
+        self.counters = self.new_counters()
+        self.query = None
+        # Attributes of the MetAtenas replaced at attach
+        self.saved = {}
+
+    def new_counters(self):
+        '''
+        new_counters
+        ------------
+        Returns the counters of a query before it starts.'''
+        counters = dict.fromkeys(COUNTERS, 0)
+        counters.update({'searches': {}, 'expanded': {}, 'goalPops': 0,
+                         'heuristicTime': 0.0, 'cacheHit': False})
+        return counters
+
+    def add_hook(self, event, hook):
+        '''
+        add_hook
+        --------
+        Calls hook(event, data) every time event happens (see the module
+        description).'''
+        if event not in self.hooks:
+            raise ValueError(f"Unknown event {event}")
+        self.hooks[event].append(hook)
+
+    def remove_hook(self, event, hook):
+        '''
+        remove_hook
+        -----------
+        Stops calling a hook added with add_hook.'''
+        self.hooks[event].remove(hook)
+
+    def emit(self, event, data):
+        '''
+        emit
+        ----
+        Calls the hooks of event with data.'''
+        for hook in self.hooks[event]:
+            hook(event, data)
+
+    def attach(self, metro):
+        '''
+        attach
+        ------
+        Replaces the frontier, transfer_line_time and transfer_at of metro
+        with the ones that count their calls. Called by
+        MetAtenas.use_instrumentation.'''
+        self.saved = {name: metro.__dict__[name]
+                      for name in ('frontier', ) + TRANSFER_METHODS
+                      if name in metro.__dict__}
+        metro.frontier = counting_frontier(metro.frontier, self)
+        for name in TRANSFER_METHODS:
+            setattr(metro, name, self.counted(getattr(metro, name)))
+
+    def counted(self, transfer_method):
+        '''
+        counted
+        -------
+        Returns transfer_method counting its calls at transferCalls.'''
+        def counted_transfer(*args):
+            self.counters['transferCalls'] += 1
+            return transfer_method(*args)
+        return counted_transfer
+
+    def detach(self, metro):
+        '''
+        detach
+        ------
+        Restores the attributes of metro replaced at attach.'''
+        for name in ('frontier', ) + TRANSFER_METHODS:
+            metro.__dict__.pop(name, None)
+        metro.__dict__.update(self.saved)
+        self.saved = {}
+
+    def start_query(self, metro, st_from, st_to):
+        '''
+        start_query
+        -----------
+        Starts counting the query min_cam(st_from, st_to).'''
+        self.counters = self.new_counters()
+        self.query = {'from': st_from, 'to': st_to,
+                      'departure': metro.start_travel_time,
+                      'start': self.clock()}
+        self.emit('query_start', (st_from, st_to))
+
+    def cache_hit(self):
+        '''
+        cache_hit
+        ---------
+        Marks the query as answered from the result cache.'''
+        self.counters['cacheHit'] = True
+
+    def search(self, mode, expanded, goal_pops=0):
+        '''
+        search
+        ------
+        Counts a search of mode that expanded expanded nodes and ended with
+        goal_pops pops of the goal.'''
+        searches, nodes = self.counters['searches'], self.counters['expanded']
+        searches[mode] = searches.get(mode, 0) + 1
+        nodes[mode] = nodes.get(mode, 0) + expanded
+        self.counters['goalPops'] += goal_pops
+        self.emit('search', (mode, expanded))
+
+    def heuristic(self, hit, seconds=0.0):
+        '''
+        heuristic
+        ---------
+        Counts a heuristic table found at the h_cache (hit) or calculated in
+        seconds.'''
+        self.counters['heuristicHits' if hit else 'heuristicMisses'] += 1
+        self.counters['heuristicTime'] += seconds
+
+    def end_query(self, route):
+        '''
+        end_query
+        ---------
+        Ends the query started at start_query, that returned route. Returns
+        its stats.'''
+        if self.query is None:
+            return None
+        stats, counters = self.query, self.counters
+        elapsed = self.clock() - stats.pop('start')
+        expanded = sum(counters['expanded'].values())
+        stats.update({
+            'found': route is not None, 'cacheHit': counters['cacheHit'],
+            'time': elapsed, 'heuristicTime': counters['heuristicTime'],
+            'searchTime': elapsed - counters['heuristicTime'],
+            'searches': counters['searches'], 'expanded': counters['expanded'],
+            'stalePops': max(counters['pops'] - expanded
+                             - counters['goalPops'], 0)})
+        for name in COUNTERS:
+            stats[name] = counters[name]
+            self.totals[name] += counters[name]
+        self.totals['queries'] += 1
+        self.totals['cacheHits'] += counters['cacheHit']
+        self.totals['time'] += elapsed
+        self.totals['heuristicTime'] += counters['heuristicTime']
+        self.totals['expanded'] += expanded
+        self.queries.append(stats)
+        self.query, self.counters = None, self.new_counters()
+        self.emit('query_end', stats)
+        return stats
+
+    def last(self):
+        '''
+        last
+        ----
+        Returns the stats of the last query, None if there is none.'''
+        return self.queries[-1] if self.queries else None
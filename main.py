@@ -1,6 +1,13 @@
+import sys
+import time
 import tkinter as tk
-from PIL import ImageTk, Image
-from min_route import MetAtenas
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import Instrumentation
+from spatial_index import GridIndex
+
+# min_route and map_tiles (with PIL) are imported by the loaders, after the
+# window is shown
+start_time = time.perf_counter()
 
 
 class Point:
@@ -93,7 +100,27 @@ edges = [
     Edge(Point(241, 476), "Panepistimio", "Syntagma"),
 ]
 
-metroAt = MetAtenas('lineasMetro.json')
+# Set by finish_startup once it is loaded
+metroAt = None
+# python main.py --stats shows the search stats of every route
+query_stats = None
+# python main.py --startup prints the time of every step of the startup
+# (see report_startup)
+startup_times = {}
+
+# Routes are searched in a background thread. Every call to metroAt goes
+# through it, so they run in order and never at the same time as a search.
+# The result is polled from the window with window.after
+ROUTE_POLL_MS = 50
+route_worker = ThreadPoolExecutor(max_workers=1)
+# The network is loaded in route_worker and the map in map_loader while the
+# window is shown, the controls are enabled when both are ready
+STARTUP_POLL_MS = 20
+map_loader = ThreadPoolExecutor(max_workers=1)
+route_future = None
+# Incremented every time the origin, destination, time, speed or faults
+# change, the searches of older requests are not shown
+route_request = 0
 
 # Canvas dimensions and colors
 CANVAS_WIDTH = 710
@@ -107,9 +134,126 @@ FAULT_COLOR_OUTLINE = "#000000"
 PATH_COLOR = '#E0A21B'
 OUTPUT_BG_COLOR = '#8C8F86'
 STATION_R = 10
+# Distance to a fault point to select it
+EDGE_R = 8
 POINT_RADIUS = 7
 PATH_POINT_RADIUS = 5
+PATH_LINE_WIDTH = 3
 FAULT_POINT_RADIUS = 6
+# Scale change of a step of the mouse wheel
+ZOOM_STEP = 1.25
+
+# Indexes of the stations and the fault points, so that a click only checks
+# the points near it
+station_index = GridIndex.from_points(
+    ((name, point.x, point.y) for name, point in stations.items()),
+    2*STATION_R)
+edge_index = GridIndex.from_points(
+    ((edge, edge.point.x, edge.point.y) for edge in edges), 2*EDGE_R)
+
+
+class CanvasLayers:
+    '''
+    CanvasLayers
+    ------------
+    Items drawn over the map, from bottom to top: the segments and points of
+    the path ("path_line", "path_point"), the fault points ("fault_point")
+    and the selected stations ("selection"). They are created once, hidden,
+    and only the ones that change are shown, hidden or moved, so the cost of
+    a redraw is proportional to what changed.
+    Items are placed at the viewport (map_tiles.Viewport) and all of them
+    have the tag "overlay" too. Their radius and width are canvas pixels,
+    they keep their size when the map is zoomed.'''
+    def __init__(self, canvas, viewport):
+        self.canvas = canvas
+        self.viewport = viewport
+        # item -> (points, radius), where it is placed at the viewport
+        self.anchors = {}
+        self.path_points = {
+            name: self.oval(point, PATH_POINT_RADIUS, fill=PATH_COLOR,
+                            tags="path_point")
+            for name, point in stations.items()}
+        # (st_1, st_2) -> line, created the first time it is shown
+        self.path_lines = {}
+        self.fault_points = {
+            edge: self.oval(edge.point, FAULT_POINT_RADIUS, fill=FAULT_COLOR,
+                            outline=FAULT_COLOR_OUTLINE, width=2,
+                            tags="fault_point")
+            for edge in edges}
+        self.selection = {
+            'origin': self.oval(Point(0, 0), POINT_RADIUS, fill=ORIGIN_COLOR,
+                                tags="selection"),
+            'destination': self.oval(Point(0, 0), POINT_RADIUS,
+                                     fill=DEST_COLOR, tags="selection")}
+        # Items shown of the path and of the faults
+        self.shown_path, self.shown_faults = set(), set()
+
+    def oval(self, point, radius, tags, **options):
+        item = self.canvas.create_oval(0, 0, 0, 0, state=tk.HIDDEN,
+                                       tags=(tags, "overlay"), **options)
+        self.anchors[item] = ((point, ), radius)
+        self.place(item)
+        return item
+
+    def place(self, item):
+        points, radius = self.anchors[item]
+        coords = [coord for point in points
+                  for coord in self.viewport.to_canvas(point.x, point.y)]
+        if radius:
+            x, y = coords
+            coords = (x - radius, y - radius, x + radius, y + radius)
+        self.canvas.coords(item, *coords)
+
+    def relayout(self):
+        # Places all the items again after the viewport has been zoomed
+        for item in self.anchors:
+            self.place(item)
+
+    def pan(self, d_x, d_y):
+        self.canvas.move("overlay", d_x, d_y)
+
+    def show(self, shown, items):
+        # Shows items and hides the ones of shown that are not in items.
+        # Returns the items shown now
+        items = set(items)
+        for item in shown - items:
+            self.canvas.itemconfigure(item, state=tk.HIDDEN)
+        for item in items - shown:
+            self.canvas.itemconfigure(item, state=tk.NORMAL)
+        return items
+
+    def path_line(self, st_1, st_2):
+        key = (st_1, st_2) if st_1 <= st_2 else (st_2, st_1)
+        if key not in self.path_lines:
+            item = self.canvas.create_line(
+                0, 0, 0, 0, fill=PATH_COLOR, width=PATH_LINE_WIDTH,
+                state=tk.HIDDEN, tags=("path_line", "overlay"))
+            self.anchors[item] = ((stations[st_1], stations[st_2]), 0)
+            self.place(item)
+            self.canvas.tag_lower(item, "path_point")
+            self.path_lines[key] = item
+        return self.path_lines[key]
+
+    def show_path(self, path):
+        items = [self.path_points[name] for name in path]
+        items += [self.path_line(st_1, st_2)
+                  for st_1, st_2 in zip(path, path[1:])]
+        self.shown_path = self.show(self.shown_path, items)
+
+    def show_faults(self, fault_edges):
+        self.shown_faults = self.show(
+            self.shown_faults,
+            (self.fault_points[edge] for edge in fault_edges))
+
+    def select(self, kind, name):
+        # Marks name as the selected 'origin' or 'destination', None hides it
+        item = self.selection[kind]
+        if name is None:
+            self.canvas.itemconfigure(item, state=tk.HIDDEN)
+            return
+        self.anchors[item] = ((stations[name], ), POINT_RADIUS)
+        self.place(item)
+        self.canvas.itemconfigure(item, state=tk.NORMAL)
 
 
 def reset_buttons(button_id):  # 0 Origin, 1 Destination and 2 sim fault
@@ -152,24 +296,18 @@ def toggle_simulate_fault():
     global is_fault_selected
     if is_fault_selected:
         simulate_fault_button.config(text="Simulate fault")
-        canvas.delete("fault_point")
-        # Resetting adyacencies
-        metroAt.get_adyacencies(tuple(metroAt.st_nodes.keys()))
+        layers.show_faults(())
+        # Restoring the broken lines
+        route_worker.submit(restore_faults)
+        request_route()
         is_fault_selected = False
     else:
         reset_buttons(2)
         if is_selecting_fault:
-            canvas.delete("fault_point")
+            layers.show_faults(())
             simulate_fault_button.config(text="Simulate fault")
         else:
-            for edge in edges:
-                canvas.create_oval(edge.point.x - FAULT_POINT_RADIUS,
-                                   edge.point.y - FAULT_POINT_RADIUS,
-                                   edge.point.x + FAULT_POINT_RADIUS,
-                                   edge.point.y + FAULT_POINT_RADIUS,
-                                   fill=FAULT_COLOR,
-                                   outline=FAULT_COLOR_OUTLINE,
-                                   width=2, tags="fault_point")
+            layers.show_faults(edges)
             simulate_fault_button.config(text="Cancel")
         is_selecting_fault = not is_selecting_fault
 
@@ -191,54 +329,35 @@ def callback(event):
     global calculate_path_button
 
     if is_selecting_origin:
-        canvas.delete("origin_station")
         origin_station_name = get_station_name(event.x, event.y)
+        layers.select('origin', origin_station_name)
         if origin_station_name is None:
             is_origin_selected = False
             origin_label.config(text="-----")
         else:
-            station_point = stations[origin_station_name]
-            canvas.create_oval(station_point.x - POINT_RADIUS,
-                               station_point.y - POINT_RADIUS,
-                               station_point.x + POINT_RADIUS,
-                               station_point.y + POINT_RADIUS,
-                               fill=ORIGIN_COLOR, tags="origin_station")
             origin_label.config(text=origin_station_name)
             is_origin_selected = True
 
         origin_button.config(text="Select origin")
         is_selecting_origin = False
     elif is_selecting_destination:
-        canvas.delete("destination_station")
         destination_station_name = get_station_name(event.x, event.y)
+        layers.select('destination', destination_station_name)
         if destination_station_name is None:
             is_destination_selected = False
             destination_label.config(text="-----")
         else:
-            station_point = stations[destination_station_name]
-            canvas.create_oval(station_point.x - POINT_RADIUS,
-                               station_point.y - POINT_RADIUS,
-                               station_point.x + POINT_RADIUS,
-                               station_point.y + POINT_RADIUS,
-                               fill=DEST_COLOR, tags="destination_station")
             destination_label.config(text=destination_station_name)
             is_destination_selected = True
 
         destination_button.config(text="Select destination")
         is_selecting_destination = False
     elif is_selecting_fault:
-        canvas.delete("fault_point")
         simulate_fault_button.config(text="Remove fault")
-        for edge in edges:
-            if abs(event.x - edge.point.x) <= 8 and abs(event.y - edge.point.y) <= 8:
-                metroAt.break_line(edge.v1, edge.v2)
-                canvas.create_oval(edge.point.x - FAULT_POINT_RADIUS,
-                                   edge.point.y - FAULT_POINT_RADIUS,
-                                   edge.point.x + FAULT_POINT_RADIUS,
-                                   edge.point.y + FAULT_POINT_RADIUS,
-                                   fill=FAULT_COLOR,
-                                   outline=FAULT_COLOR_OUTLINE, 
-                                   width=2, tags="fault_point")
+        broken = get_edges(event.x, event.y)
+        for edge in broken:
+            route_worker.submit(metroAt.break_line, edge.v1, edge.v2)
+        layers.show_faults(broken)
         is_selecting_fault = False
         is_fault_selected = True
 
@@ -246,13 +365,119 @@ def callback(event):
         calculate_path_button.config(state=tk.NORMAL)
     else:
         calculate_path_button.config(state=tk.DISABLED)
+    request_route()
 
 
 def get_station_name(x: int, y: int) -> str:
-    for name, point in stations.items():
-        if abs(x - point.x) <= STATION_R and abs(y - point.y) <= STATION_R:
-            return name
-    return None
+    # x and y are canvas coordinates, the index has map ones
+    map_x, map_y = viewport.to_map(x, y)
+    return station_index.nearest(map_x, map_y, STATION_R/viewport.scale)
+
+
+def get_edges(x: int, y: int) -> list:
+    map_x, map_y = viewport.to_map(x, y)
+    return [edge for edge, _ in edge_index.within(map_x, map_y,
+                                                  EDGE_R/viewport.scale)]
+
+
+def hover(event):
+    # Hand cursor over the points that can be selected
+    over = None
+    if is_selecting_origin or is_selecting_destination:
+        over = get_station_name(event.x, event.y)
+    elif is_selecting_fault:
+        over = get_edges(event.x, event.y) or None
+    cursor = "" if over is None else "hand2"
+    if canvas.cget("cursor") != cursor:
+        canvas.config(cursor=cursor)
+
+
+def start_pan(event):
+    global pan_from
+    pan_from = (event.x, event.y)
+
+
+def pan(event):
+    # Drag with the right or middle button
+    global pan_from
+    d_x, d_y = event.x - pan_from[0], event.y - pan_from[1]
+    pan_from = (event.x, event.y)
+    viewport.pan(d_x, d_y)
+    background.redraw()
+    layers.pan(d_x, d_y)
+
+
+def zoom(event):
+    # Mouse wheel, event.delta on Windows and macOS and buttons 4 and 5 on X11
+    zoom_in = event.num == 4 or getattr(event, 'delta', 0) > 0
+    if viewport.zoom(ZOOM_STEP if zoom_in else 1/ZOOM_STEP, event.x, event.y):
+        background.redraw()
+        layers.relayout()
+
+
+def restore_faults():
+    for fault in list(metroAt.faults):
+        metroAt.restore_line(*fault)
+
+
+def find_route(day, hour, minute, speed, st_from, st_to):
+    # Runs in route_worker
+    metroAt.set_hour(day, hour, minute)
+    metroAt.set_speed(speed)
+    return metroAt.min_cam(st_from, st_to)
+
+
+def request_route(*_):
+    # Starts searching the route as soon as both stations are selected, so
+    # it is usually ready when "Calculate path" is clicked. Only a search of
+    # the previous inputs that has not started is cancelled, one that is
+    # running finishes in route_worker and show_route ignores its result
+    global route_future
+    global route_request
+    route_request += 1
+    if route_future is not None:
+        route_future.cancel()
+        route_future = None
+    if is_origin_selected and is_destination_selected:
+        route_future = route_worker.submit(
+            find_route, day_var.get(), hour_var.get(), minute_var.get(),
+            speed_var.get(), origin_station_name, destination_station_name)
+
+
+def show_route(request):
+    # Shows the route of request once its search has finished
+    if request != route_request or not is_path_calculated or \
+            route_future is None:
+        return
+    if not route_future.done():
+        output_label.config(text="Calculating path...", fg=PATH_COLOR,
+                            bg=OUTPUT_BG_COLOR)
+        window.after(ROUTE_POLL_MS, show_route, request)
+        return
+    result = route_future.result()
+    if result is None:
+        output_label.config(text="Metro is closed or closes during journey",
+                            fg='red',
+                            bg=OUTPUT_BG_COLOR)
+        return
+    output_text = "Journey Complete:\n"
+    output_text += f"Total Duration: {result['time']} mins\n"
+    output_text += f"Waiting time for all line exchanges: {result['tmTrans']} mins\n"
+    arr_tm = (int(i) for i in metroAt.get_time(result['time']))
+    output_text += f"Arrival time: {day_options[next(arr_tm)]}, "
+    output_text += f"{next(arr_tm)}h and {next(arr_tm)}min\n"
+    output_text += f"Total Distance Travelled: {result['dist']} meters"
+    if query_stats is not None:
+        stats = query_stats.last()
+        output_text += (f"\nSearch: {stats['time']*1000:.2f} ms "
+                        f"(heuristic {stats['heuristicTime']*1000:.2f} ms), "
+                        f"{sum(stats['expanded'].values())} expanded, "
+                        f"{stats['pushes']} pushes, "
+                        f"{stats['transferCalls']} transfer calls")
+
+    output_label.config(text=output_text, fg=PATH_COLOR,
+                        bg=OUTPUT_BG_COLOR)
+    layers.show_path(result['path'])
 
 
 def calculate_path():
@@ -272,7 +497,7 @@ def calculate_path():
 
     if is_path_calculated:
         is_path_calculated = False
-        canvas.delete("path")
+        layers.show_path(())
 
         origin_button.config(state=tk.NORMAL)
         destination_button.config(state=tk.NORMAL)
@@ -295,31 +520,92 @@ def calculate_path():
         speed_menu.config(state=tk.DISABLED)
 
         calculate_path_button.config(text="Change settings")
-        metroAt.set_hour(day_var.get(), hour_var.get(), minute_var.get())
-        metroAt.set_speed(speed_var.get())
-        result = metroAt.min_cam(origin_station_name, destination_station_name)
-        if result is None:
-            output_label.config(text="Metro is closed or closes during journey",
-                                fg='red',
-                                bg=OUTPUT_BG_COLOR)
+        show_route(route_request)
+
+
+def load_network():
+    # Runs in route_worker, before any route is searched
+    start = time.perf_counter()
+    from min_route import MetAtenas
+    times = {'import': time.perf_counter() - start}
+    metro = MetAtenas('lineasMetro.json')
+    times.update(metro.init_times)
+    return metro, times
+
+
+def load_map():
+    # Runs in map_loader. The background is drawn from the tiles of the image
+    # (see map_tiles.py), the whole image fits in the canvas at the lowest
+    # zoom. The first tiles are decoded here, finish_startup only creates
+    # their photos
+    start = time.perf_counter()
+    from map_tiles import TiledBackground, TilePyramid, Viewport
+    times = {'import': time.perf_counter() - start}
+    start = time.perf_counter()
+    pyramid = TilePyramid.open("metro_background.jpg")
+    map_view = Viewport(CANVAS_WIDTH, CANVAS_HEIGHT,
+                        min_scale=min(1.0, CANVAS_WIDTH/pyramid.width,
+                                      CANVAS_HEIGHT/pyramid.height))
+    tiles = TiledBackground(canvas, pyramid, map_view)
+    tiles.prefetch()
+    times['image decode'] = time.perf_counter() - start
+    return tiles, times
+
+
+def finish_startup():
+    # Polled from the window until the network and the map are loaded, then
+    # draws the map and enables the controls
+    global metroAt
+    global query_stats
+    global background
+    global viewport
+    global layers
+    startup_times.setdefault('window', time.perf_counter() - start_time)
+    if not (network_future.done() and map_future.done()):
+        window.after(STARTUP_POLL_MS, finish_startup)
+        return
+    map_loader.shutdown(wait=False)
+    for future, loaded in ((network_future, "metro network"),
+                           (map_future, "map")):
+        if future.exception() is not None:
+            print(f"Error loading the {loaded}: {future.exception()}")
+            output_label.config(text=f"The {loaded} could not be loaded",
+                                fg='red', bg=OUTPUT_BG_COLOR)
             return
-        output_text = "Journey Complete:\n"
-        output_text += f"Total Duration: {result['time']} mins\n"
-        output_text += f"Waiting time for all line exchanges: {result['tmTrans']} mins\n"
-        arr_tm = (int(i) for i in metroAt.get_time(result['time']))
-        output_text += f"Arrival time: {day_options[next(arr_tm)]}, "
-        output_text += f"{next(arr_tm)}h and {next(arr_tm)}min\n"
-        output_text += f"Total Distance Travelled: {result['dist']} meters"
-
-        output_label.config(text=output_text, fg=PATH_COLOR,
-                            bg=OUTPUT_BG_COLOR)
-        for name in result['path']:
-            point = stations[name]
-            canvas.create_oval(point.x - PATH_POINT_RADIUS,
-                               point.y - PATH_POINT_RADIUS,
-                               point.x + PATH_POINT_RADIUS,
-                               point.y + PATH_POINT_RADIUS,
-                               fill=PATH_COLOR, tags="path")
+    metroAt, network_times = network_future.result()
+    background, map_times = map_future.result()
+    startup_times['import'] = network_times.pop('import') + \
+        map_times.pop('import')
+    startup_times.update(network_times)
+    startup_times.update(map_times)
+    if '--stats' in sys.argv:
+        query_stats = metroAt.use_instrumentation(Instrumentation())
+
+    start = time.perf_counter()
+    viewport = background.viewport
+    background.redraw()
+    layers = CanvasLayers(canvas, viewport)
+    canvas.bind("<Button-1>", callback)
+    canvas.bind("<Motion>", hover)
+    for button in (2, 3):
+        canvas.bind(f"<ButtonPress-{button}>", start_pan)
+        canvas.bind(f"<B{button}-Motion>", pan)
+    for wheel_event in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+        canvas.bind(wheel_event, zoom)
+    for button in (origin_button, destination_button, simulate_fault_button):
+        button.config(state=tk.NORMAL)
+    output_label.config(text="", bg='white')
+    startup_times['draw'] = time.perf_counter() - start
+    startup_times['ready'] = time.perf_counter() - start_time
+    if '--startup' in sys.argv:
+        report_startup()
+
+
+def report_startup():
+    # import: min_route and map_tiles, window: until the window is shown,
+    # ready: until the controls are enabled, the rest are their steps
+    print("Startup: " + ", ".join(f"{step} {seconds*1000:.1f} ms"
+                                  for step, seconds in startup_times.items()))
 
 
 window = tk.Tk()
@@ -347,7 +633,8 @@ origin_button = tk.Button(
     width=25,
     height=2,
     highlightbackground=ORIGIN_COLOR,
-    command=toggle_select_origin
+    command=toggle_select_origin,
+    state=tk.DISABLED
 )
 
 # Destination button
@@ -359,7 +646,8 @@ destination_button = tk.Button(
     width=25,
     height=2,
     highlightbackground=DEST_COLOR,
-    command=toggle_select_destination
+    command=toggle_select_destination,
+    state=tk.DISABLED
 )
 
 # Fault Selection button
@@ -369,7 +657,8 @@ simulate_fault_button = tk.Button(
     width=25,
     height=2,
     highlightbackground=FAULT_COLOR,
-    command=toggle_simulate_fault
+    command=toggle_simulate_fault,
+    state=tk.DISABLED
 )
 
 # Calculate Path button
@@ -428,9 +717,12 @@ speed_menu = tk.OptionMenu(speed_panel,
                            *("{:3d}".format(i*10) for i in range(1, 11)))
 speed_label.pack(side=tk.LEFT)
 speed_menu.pack(side=tk.LEFT)
+for variable in (day_var, hour_var, minute_var, speed_var):
+    variable.trace_add('write', request_route)
 
 # Distance and time used output
-output_label = tk.Label(master=button_panel, text="", bg='white')
+output_label = tk.Label(master=button_panel, text="Loading...",
+                        fg=PATH_COLOR, bg=OUTPUT_BG_COLOR)
 
 
 origin_label.pack(side=tk.TOP)
@@ -447,8 +739,14 @@ output_label.pack(side=tk.BOTTOM)
 
 button_panel.pack(side=tk.LEFT, fill=tk.Y)
 canvas = tk.Canvas(window, width=CANVAS_WIDTH, height=CANVAS_HEIGHT)
-canvas.bind("<Button-1>", callback)
 canvas.pack(side=tk.RIGHT)
-img = ImageTk.PhotoImage(Image.open("metro_background.jpg"))
-canvas.create_image(0, 0, anchor=tk.NW, image=img)
+# Set by finish_startup, the canvas events are bound once they exist
+pan_from = (0, 0)
+background = None
+viewport = None
+layers = None
+network_future = route_worker.submit(load_network)
+map_future = map_loader.submit(load_map)
+window.after(0, finish_startup)
 window.mainloop()
+route_worker.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,262 @@
+'''Tiled background map of main.py, so that the image of the network is never
+decoded whole while the window is open.
+Pyramid Format (directory next to the image, '<image>.tiles'):
+    pyramid.json: {"width", "height": size of the image, "tileSize",
+                   "levels", "source": [file size, mtime_ns]}
+    <level>/<col>_<row>.png: tiles of tileSize x tileSize pixels (smaller at
+                             the right and bottom borders)
+    Level 0 is the image, and every level halves the size of the previous
+one, until it fits in a single tile. A tile of level l covers
+tileSize*2**l pixels of the image. The pyramid is built again when the image
+changes.
+    Coordinates of the map are pixels of the image, the Viewport translates
+them to the canvas.
+    python map_tiles.py metro_background.jpg
+'''
+
+import json
+import math
+import os
+import sys
+from collections import OrderedDict
+
+from PIL import Image, ImageTk
+
+PYRAMID_FILE = 'pyramid.json'
+TILE_SIZE = 256
+
+
+class Viewport:
+    '''
+    Viewport
+    --------
+    Part of the map shown at a canvas of width x height pixels: the map point
+    (x, y) is at the top left corner of the canvas and one map pixel is
+    scale canvas pixels.'''
+    def __init__(self, width, height, scale=1.0, x=0.0, y=0.0,
+                 min_scale=0.1, max_scale=8.0):
+        self.width, self.height = width, height
+        self.scale, self.x, self.y = scale, x, y
+        self.min_scale, self.max_scale = min_scale, max_scale
+
+    def to_canvas(self, map_x, map_y):
+        return ((map_x - self.x)*self.scale, (map_y - self.y)*self.scale)
+
+    def to_map(self, canvas_x, canvas_y):
+        return (canvas_x/self.scale + self.x, canvas_y/self.scale + self.y)
+
+    def pan(self, d_x, d_y):
+        '''
+        pan
+        ---
+        Moves the map d_x, d_y canvas pixels.'''
+        self.x -= d_x/self.scale
+        self.y -= d_y/self.scale
+
+    def zoom(self, factor, canvas_x, canvas_y):
+        '''
+        zoom
+        ----
+        Multiplies the scale by factor, keeping the map point at canvas_x,
+        canvas_y in place. Returns False if the scale was already at its
+        limit.'''
+        scale = min(max(self.scale*factor, self.min_scale), self.max_scale)
+        if scale == self.scale:
+            return False
+        map_x, map_y = self.to_map(canvas_x, canvas_y)
+        self.scale = scale
+        self.x, self.y = map_x - canvas_x/scale, map_y - canvas_y/scale
+        return True
+
+
+def source_stamp(image_file):
+    stat = os.stat(image_file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class TilePyramid:
+    '''
+    TilePyramid
+    -----------
+    Tiles of an image stored at directory (see the module description).'''
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, PYRAMID_FILE), 'r',
+                  encoding="utf-8") as file:
+            data = json.load(file)
+        self.width, self.height = data['width'], data['height']
+        self.tile_size, self.levels = data['tileSize'], data['levels']
+        self.source = data['source']
+
+    @classmethod
+    def open(cls, image_file, directory=None, tile_size=TILE_SIZE):
+        '''
+        open
+        ----
+        Returns the pyramid of image_file, built (see build) if it doesn't
+        exist or the image has changed.'''
+        directory = directory or image_file + '.tiles'
+        try:
+            pyramid = cls(directory)
+            if pyramid.source == source_stamp(image_file) and \
+                    pyramid.tile_size == tile_size:
+                return pyramid
+        except (OSError, ValueError, KeyError):
+            pass
+        return cls.build(image_file, directory, tile_size)
+
+    @classmethod
+    def build(cls, image_file, directory=None, tile_size=TILE_SIZE):
+        '''
+        build
+        -----
+        Cuts image_file into the tiles of every level and stores them at
+        directory. The image is only decoded whole here.'''
+        directory = directory or image_file + '.tiles'
+        # Network maps are far larger than the decompression bomb limit
+        max_pixels, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+        try:
+            with Image.open(image_file) as source:
+                image = source.convert('RGB')
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+        width, height = image.size
+        level = 0
+        while True:
+            level_dir = os.path.join(directory, str(level))
+            os.makedirs(level_dir, exist_ok=True)
+            for row in range(math.ceil(image.height/tile_size)):
+                for col in range(math.ceil(image.width/tile_size)):
+                    box = (col*tile_size, row*tile_size,
+                           min((col + 1)*tile_size, image.width),
+                           min((row + 1)*tile_size, image.height))
+                    image.crop(box).save(
+                        os.path.join(level_dir, f"{col}_{row}.png"))
+            level += 1
+            if image.width <= tile_size and image.height <= tile_size:
+                break
+            image = image.resize((math.ceil(image.width/2),
+                                  math.ceil(image.height/2)), Image.LANCZOS)
+        with open(os.path.join(directory, PYRAMID_FILE), 'w',
+                  encoding="utf-8") as file:
+            json.dump({'width': width, 'height': height,
+                       'tileSize': tile_size, 'levels': level,
+                       'source': source_stamp(image_file)}, file)
+        return cls(directory)
+
+    def level_for(self, scale):
+        '''
+        level_for
+        ---------
+        Returns the level whose tiles are shown at scale, the smallest one
+        that doesn't need to be enlarged more than at level 0.'''
+        if scale >= 1:
+            return 0
+        return min(int(math.log2(1/scale)), self.levels - 1)
+
+    def tile_file(self, level, col, row):
+        return os.path.join(self.directory, str(level), f"{col}_{row}.png")
+
+    def visible(self, viewport):
+        '''
+        visible
+        -------
+        Yields (level, col, row) of the tiles of the level of viewport.scale
+        that are at the viewport, with the canvas coordinates of their top
+        left corner and the factor their pixels are scaled by.'''
+        level = self.level_for(viewport.scale)
+        span = self.tile_size*2**level  # Map pixels of a tile
+        factor = viewport.scale*2**level
+        map_x, map_y = viewport.to_map(0, 0)
+        end_x, end_y = viewport.to_map(viewport.width, viewport.height)
+        cols = math.ceil(self.width/span)
+        rows = math.ceil(self.height/span)
+        for row in range(max(int(map_y//span), 0),
+                         min(int(end_y//span) + 1, rows)):
+            for col in range(max(int(map_x//span), 0),
+                             min(int(end_x//span) + 1, cols)):
+                yield ((level, col, row),
+                       viewport.to_canvas(col*span, row*span), factor)
+
+
+class TiledBackground:
+    '''
+    TiledBackground
+    ---------------
+    Draws the tiles of pyramid visible at viewport on canvas, below all the
+    other items (tag "tile"). Tiles are decoded when they become visible and
+    at most max_tiles decoded tiles are kept, so the memory used doesn't
+    depend on the size of the image.'''
+    def __init__(self, canvas, pyramid, viewport, max_tiles=128):
+        self.canvas = canvas
+        self.pyramid = pyramid
+        self.viewport = viewport
+        self.max_tiles = max_tiles
+        # (level, col, row) -> (item, photo) of the tiles drawn
+        self.items = {}
+        # (level, col, row, factor) -> photo, least recently used first
+        self.photos = OrderedDict()
+        # (level, col, row, factor) -> image decoded at prefetch
+        self.decoded = {}
+
+    def decode(self, key, factor):
+        # Tile key scaled by factor, as a PIL image
+        tile = Image.open(self.pyramid.tile_file(*key))
+        tile.load()  # Reads the tile and closes the file
+        if factor != 1:
+            tile = tile.resize((max(round(tile.width*factor), 1),
+                                max(round(tile.height*factor), 1)),
+                               Image.BILINEAR)
+        return tile
+
+    def prefetch(self):
+        '''
+        prefetch
+        --------
+        Decodes the tiles visible at the viewport, so that the next redraw
+        only creates their photos. It doesn't use the canvas, so it can run
+        in another thread than the window.'''
+        for key, _, factor in self.pyramid.visible(self.viewport):
+            self.decoded[key + (factor, )] = self.decode(key, factor)
+
+    def photo(self, key, factor):
+        photo_key = key + (factor, )
+        photo = self.photos.get(photo_key)
+        if photo is not None:
+            self.photos.move_to_end(photo_key)
+            return photo
+        tile = self.decoded.pop(photo_key, None)
+        if tile is None:
+            tile = self.decode(key, factor)
+        photo = ImageTk.PhotoImage(tile)
+        self.photos[photo_key] = photo
+        if len(self.photos) > self.max_tiles:
+            self.photos.popitem(last=False)
+        return photo
+
+    def redraw(self):
+        '''
+        redraw
+        ------
+        Draws the tiles visible at the viewport and deletes the others.'''
+        drawn = {}
+        for key, (x, y), factor in self.pyramid.visible(self.viewport):
+            photo = self.photo(key, factor)
+            item = self.items.pop(key, (None, ))[0]
+            if item is None:
+                item = self.canvas.create_image(x, y, anchor='nw', image=photo,
+                                                tags="tile")
+                self.canvas.tag_lower(item)
+            else:
+                self.canvas.coords(item, x, y)
+                self.canvas.itemconfigure(item, image=photo)
+            drawn[key] = (item, photo)
+        for item, _ in self.items.values():
+            self.canvas.delete(item)
+        self.items = drawn
+
+
+if __name__ == '__main__':
+    # python map_tiles.py metro_background.jpg [tile_size]
+    TilePyramid.build(sys.argv[1], tile_size=int(sys.argv[2]) if
+                      len(sys.argv) > 2 else TILE_SIZE)
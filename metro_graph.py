@@ -0,0 +1,185 @@
+'''Compiled representations of the station node graph used by the searches.
+CompiledGraph Format:
+{'names': [id -> stName], 'ids': [stName -> id],
+ 'offsets': [id -> first edge of id, ..., n_edges]
+ 'neighbors': [edge -> nxt_id], 'lines': [edge -> lnNum],
+ 'distances': [edge -> nxt_dist]}
+    The edges of the node id are the ones between offsets[id] and
+    offsets[id + 1], in the same order as in st_nodes.
+StateGraph Format:
+{'nodes': [state -> id], 'lines': [state -> lnNum],
+ 'node_offsets': [id -> first state of id, ..., n_states],
+ 'travel_offsets', 'travel_targets', 'travel_distances': CSR of the edges
+    between states of the same line,
+ 'transfer_offsets', 'transfer_targets': CSR of the transfers between the
+    states of the same node}
+TransferProfile Format:
+{'times': [step -> transfer time at the minute step/resolution of the week]}
+'''
+
+import hashlib
+from array import array
+
+# Minutes in a week, Monday 0:00 is minute 0
+WEEK_MINUTES = 7*24*60
+
+
+def week_time(week_minute):
+    '''
+    week_time
+    ---------
+    Returns (day, hour, minute) of the minute of the week week_minute, in
+    the format returned by MetAtenas.get_time.'''
+    week_minute %= WEEK_MINUTES
+    n_min = week_minute % 60
+    hours = (week_minute - n_min)//60
+    return (hours//24, hours % 24, n_min)
+
+
+class CompiledGraph:
+    '''
+    CompiledGraph
+    -------------
+    Compressed sparse row version of st_nodes. Station nodes are interned to
+    integer ids and their adyacencies are stored in flat arrays, so the
+    searches only index lists and arrays instead of hashing station names.
+    Names are only translated at the API boundary with names and ids.'''
+    def __init__(self, st_nodes):
+        self.names = tuple(st_nodes.keys())
+        self.ids = {st_name: st_id for st_id, st_name in enumerate(self.names)}
+        distances = [ady[2] for st_name in self.names
+                     for ady in st_nodes[st_name]]
+        is_int = all(isinstance(distance, int) for distance in distances)
+        self.offsets = array('q', [0])
+        self.neighbors, self.lines = array('q'), array('q')
+        self.distances = array('q' if is_int else 'd', distances)
+        for st_name in self.names:
+            for nxt_st_nm, through_ln, _ in st_nodes[st_name]:
+                self.neighbors.append(self.ids[nxt_st_nm])
+                self.lines.append(through_ln)
+            self.offsets.append(len(self.neighbors))
+
+    @classmethod
+    def from_arrays(cls, names, offsets, neighbors, lines, distances):
+        '''
+        from_arrays
+        -----------
+        Creates a CompiledGraph from arrays already compiled, they can be any
+        indexable buffers, like memoryviews of a mapped file.'''
+        graph = cls.__new__(cls)
+        graph.names = tuple(names)
+        graph.ids = {st_name: st_id for st_id, st_name in enumerate(graph.names)}
+        graph.offsets, graph.neighbors = offsets, neighbors
+        graph.lines, graph.distances = lines, distances
+        return graph
+
+    def __len__(self):
+        return len(self.names)
+
+    def edges(self, st_id):
+        '''
+        edges
+        -----
+        Returns the range of edge positions of the node st_id.'''
+        return range(self.offsets[st_id], self.offsets[st_id + 1])
+
+    def fingerprint(self):
+        '''
+        fingerprint
+        -----------
+        Returns a hex digest of the names and adyacencies of the graph, used
+        to check that stored results were built from the same network.'''
+        digest = hashlib.sha1('\n'.join(self.names).encode('utf-8'))
+        for values in (self.offsets, self.neighbors, self.lines,
+                       self.distances):
+            typecode = getattr(values, 'typecode', None) or values.format
+            digest.update(typecode.encode('ascii'))
+            digest.update(values.tobytes())
+        return digest.hexdigest()
+
+
+class StateGraph:
+    '''
+    StateGraph
+    ----------
+    Line expanded version of a CompiledGraph. Every state is a node reached
+    through one of its lines, (id, lnNum), so that the searches can label
+    each line of a node on its own. Travelling between two nodes keeps the
+    line and changing lines is an explicit transfer edge between two states
+    of the same node, its cost is the transfer time when it is used.
+    node_lines gives the lines of each node id.'''
+    def __init__(self, graph, node_lines):
+        self.graph = graph
+        self.nodes, self.lines = array('q'), array('q')
+        self.node_offsets = array('q', [0])
+        for st_id, lines in enumerate(node_lines):
+            for lin in lines:
+                self.nodes.append(st_id)
+                self.lines.append(lin)
+            self.node_offsets.append(len(self.nodes))
+        self.ids = {(st_id, lin): state for state, (st_id, lin)
+                    in enumerate(zip(self.nodes, self.lines))}
+        self.travel_offsets = array('q', [0])
+        self.travel_targets = array('q')
+        self.travel_distances = array(
+            getattr(graph.distances, 'typecode', None) or graph.distances.format)
+        self.transfer_offsets = array('q', [0])
+        self.transfer_targets = array('q')
+        for state, (st_id, lin) in enumerate(zip(self.nodes, self.lines)):
+            for edge in graph.edges(st_id):
+                if graph.lines[edge] == lin:
+                    self.travel_targets.append(
+                        self.ids[(graph.neighbors[edge], lin)])
+                    self.travel_distances.append(graph.distances[edge])
+            self.travel_offsets.append(len(self.travel_targets))
+            self.transfer_targets.extend(
+                other for other in self.states(st_id) if other != state)
+            self.transfer_offsets.append(len(self.transfer_targets))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def states(self, st_id):
+        '''
+        states
+        ------
+        Returns the range of states of the node st_id.'''
+        return range(self.node_offsets[st_id], self.node_offsets[st_id + 1])
+
+    def travels(self, state):
+        '''
+        travels
+        -------
+        Returns the range of travel edge positions of state.'''
+        return range(self.travel_offsets[state],
+                     self.travel_offsets[state + 1])
+
+    def transfers(self, state):
+        '''
+        transfers
+        ---------
+        Returns the states of the same node state can transfer to.'''
+        return self.transfer_targets[self.transfer_offsets[state]:
+                                     self.transfer_offsets[state + 1]]
+
+
+class TransferProfile:
+    '''
+    TransferProfile
+    ---------------
+    Transfer times of the whole week stored in a list, resolution values
+    per minute, so that they can be read in O(1) instead of evaluating the
+    transfer time function. A list is used instead of an array so the values
+    keep the type the function returned.
+    transfer_time_at(day, hour, minute) is the function compiled.'''
+    def __init__(self, transfer_time_at, resolution=10):
+        self.resolution = resolution
+        self.times = [transfer_time_at(*week_time(step/resolution))
+                      for step in range(WEEK_MINUTES*resolution)]
+
+    def at(self, week_minute):
+        '''
+        at
+        --
+        Returns the transfer time at the minute of the week week_minute.'''
+        return self.times[round(week_minute*self.resolution) % len(self.times)]
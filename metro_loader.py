@@ -0,0 +1,237 @@
+'''Incremental loaders of the metro lines, they read the stations one at a time
+and store them straight into the lineasMetro format (see min_route.py), so the
+'lineas' document is never held in memory as nested lists.
+Two inputs are accepted:
+    - The JSON format used by load_data, read in chunks of the file.
+    - Newline delimited JSON files (.ndjson or .jsonl), where every row is
+    one of:
+        {"__lineasMetro__": true}               (optional header)
+        [[st1_ofln, 0], [st2_ofln, dist], ...]  (a line, numbered in order)
+        {"stNodes": [StNode1, stNode2, ...]}
+'''
+
+import json
+import sys
+from collections import defaultdict
+
+NDJSON_SUFFIXES = ('.ndjson', '.jsonl')
+
+
+class LineasMetroBuilder:
+    '''
+    LineasMetroBuilder
+    ------------------
+    Builds the lineasMetro data from the lines and their stations, given in
+    order. Station names are interned so every name is stored only once.'''
+    def __init__(self):
+        self.dict_lin = defaultdict(lambda: None)
+        self.dict_st_nm, self.dict_st_dist = {}, {}
+        self.st_nodes = defaultdict(None)
+        self.n_lin, self.st_names, self.distances = 0, None, None
+
+    def start_line(self):
+        '''
+        start_line
+        ----------
+        Ends the line being built and starts the next one. Returns its
+        number.'''
+        self.end_line()
+        self.n_lin += 1
+        self.st_names, self.distances = [], []
+        return self.n_lin
+
+    def add_station(self, st_name, distance):
+        '''
+        add_station
+        -----------
+        Adds the station st_name at the end of the line being built.'''
+        st_name = sys.intern(st_name)
+        position = (self.n_lin, len(self.st_names))
+        self.st_names.append(st_name)
+        self.distances.append(distance)
+        if self.dict_lin[st_name] is None:
+            self.dict_lin[st_name] = position
+        else:
+            self.dict_lin[st_name] += position
+
+    def add_node(self, st_name):
+        '''
+        add_node
+        --------
+        Adds st_name to the station nodes.'''
+        self.st_nodes[sys.intern(st_name)] = ()
+
+    def end_line(self):
+        '''
+        end_line
+        --------
+        Stores the line being built, if any.'''
+        if self.st_names is not None:
+            self.dict_st_nm[self.n_lin] = tuple(self.st_names)
+            self.dict_st_dist[self.n_lin] = tuple(self.distances)
+            self.st_names, self.distances = None, None
+
+    def data(self):
+        '''
+        data
+        ----
+        Returns the data built in the lineasMetro format.'''
+        self.end_line()
+        return {'lin': self.dict_lin, 'stNm': self.dict_st_nm,
+                'stDist': self.dict_st_dist, 'stNodes': self.st_nodes}
+
+
+class JsonStream:
+    '''
+    JsonStream
+    ----------
+    Reads JSON values one by one from a text file, keeping in memory only the
+    chunk of the file being read.'''
+    def __init__(self, file, chunk_size=1 << 16):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer, self.pos, self.eof = '', 0, False
+        self.decoder = json.JSONDecoder()
+
+    def read_more(self):
+        '''
+        read_more
+        ---------
+        Drops the part of the buffer already read and reads the next chunk.
+        Returns False at the end of the file.'''
+        chunk = self.file.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return not self.eof
+
+    def peek(self):
+        '''
+        peek
+        ----
+        Skips the whitespace and returns the next character ('' at the end of
+        the file).'''
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in \
+                    ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.read_more():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        '''
+        expect
+        ------
+        Reads the next character, that has to be one of chars, and returns
+        it.'''
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} at "
+                             f"{self.buffer[self.pos:self.pos + 20]!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        '''
+        value
+        -----
+        Reads the next JSON value. A value ending at the end of the buffer is
+        read again with the next chunk, as a number could continue there.'''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof or not self.read_more():
+                    raise
+                continue
+            if end < len(self.buffer) or self.eof or not self.read_more():
+                self.pos = end
+                return value
+
+    def items(self):
+        '''
+        items
+        -----
+        Iterates over the items of the array that starts at the next
+        character, the caller reads each item before the next one is
+        requested.'''
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(',]') == ']':
+                return
+
+
+def stream_lineas(file, builder=None, chunk_size=1 << 16):
+    '''
+    stream_lineas
+    -------------
+    Reads a file in the JSON format used by load_data station by station and
+    returns its data in the lineasMetro format.'''
+    builder = builder or LineasMetroBuilder()
+    stream, is_metro = JsonStream(file, chunk_size), False
+    stream.expect('{')
+    if stream.peek() != '}':
+        while True:
+            key = stream.value()
+            stream.expect(':')
+            if key == 'lineas':
+                for _ in stream.items():
+                    builder.start_line()
+                    for _ in stream.items():
+                        builder.add_station(*stream.value())
+                builder.end_line()
+            elif key == 'stNodes':
+                for _ in stream.items():
+                    builder.add_node(stream.value())
+            else:
+                # The value is always read, even if the key is not used
+                value = stream.value()
+                is_metro |= key == '__lineasMetro__' and bool(value)
+            if stream.expect(',}') == '}':
+                break
+    if not is_metro:
+        raise ValueError("The file is not in the lineasMetro format")
+    return builder.data()
+
+
+def stream_ndjson(file, builder=None):
+    '''
+    stream_ndjson
+    -------------
+    Reads a newline delimited file of lines (see the module description) row
+    by row and returns its data in the lineasMetro format.'''
+    builder = builder or LineasMetroBuilder()
+    for row in file:
+        if not row.strip():
+            continue
+        record = json.loads(row)
+        if isinstance(record, list):
+            builder.start_line()
+            for st_name, distance in record:
+                builder.add_station(st_name, distance)
+        else:
+            for st_name in record.get('stNodes', ()):
+                builder.add_node(st_name)
+    return builder.data()
+
+
+def stream_data(source, ndjson=None, chunk_size=1 << 16):
+    '''
+    stream_data
+    -----------
+    Loads the lines of source, a file name or an open text file, with
+    stream_ndjson or stream_lineas. If ndjson is None, the format is chosen
+    by the suffix of the file name.'''
+    if isinstance(source, str):
+        if ndjson is None:
+            ndjson = source.endswith(NDJSON_SUFFIXES)
+        with open(source, 'r', encoding="utf-8") as file:
+            return stream_data(file, ndjson, chunk_size)
+    if ndjson:
+        return stream_ndjson(source)
+    return stream_lineas(source, chunk_size=chunk_size)
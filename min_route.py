@@ -16,9 +16,16 @@ lineasMetro Format:
  }
 '''
 
-import json
-from collections import defaultdict
+import heapq
+import time
+from collections import OrderedDict, defaultdict
 from functools import wraps
+from itertools import count, islice, repeat
+
+from metro_graph import (WEEK_MINUTES, CompiledGraph, StateGraph,
+                         TransferProfile, week_time)
+from metro_loader import LineasMetroBuilder, stream_data
+from result_cache import NO_ROUTE
 
 
 def lineas_metro_hook(obj):
@@ -40,22 +47,14 @@ def lineas_metro_hook(obj):
                             "Metaxourghio"  - - - l2 - - - "Larissa Station"
     '''
     if '__lineasMetro__' in obj:
-        dict_lin, dict_st_nm, dict_st_dist = defaultdict(lambda: None), {}, {}
-        for n_lin, line in enumerate(obj['lineas'], 1):
-            st_names = []
-            distances = []
-            for st_pos, st_data in enumerate(line):
-                st_names.append(st_data[0])
-                distances.append(st_data[1])
-                if dict_lin[st_data[0]] is None:
-                    dict_lin[st_data[0]] = (n_lin, st_pos)
-                else:
-                    dict_lin[st_data[0]] += (n_lin, st_pos)
-            dict_st_nm[n_lin] = tuple(st_names)
-            dict_st_dist[n_lin] = tuple(distances)
-        st_nodes = defaultdict(None, {node: () for node in obj['stNodes']})
-        return {'lin': dict_lin, 'stNm': dict_st_nm, 'stDist': dict_st_dist,
-                'stNodes': st_nodes}
+        builder = LineasMetroBuilder()
+        for line in obj['lineas']:
+            builder.start_line()
+            for st_name, distance in line:
+                builder.add_station(st_name, distance)
+        for node in obj['stNodes']:
+            builder.add_node(node)
+        return builder.data()
     return obj
 
 
@@ -64,9 +63,10 @@ def load_data(file_name):
     load_data
     ---------
     Loads the json file passed at the fileName path and stores
-    it in the used format, described at lineas_metro_hook.'''
-    with open(file_name, 'r', encoding="utf-8") as file:
-        return json.load(file, object_hook=lineas_metro_hook)
+    it in the used format, described at lineas_metro_hook. The file is read
+    station by station (see metro_loader.py), newline delimited files
+    (.ndjson, .jsonl) are also accepted.'''
+    return stream_data(file_name)
 
 
 def dist(distances, st_pos_1, st_pos_2):
@@ -122,6 +122,163 @@ def insert_sorted(list_val, val, comp):
     list_val.insert(pos, val)
 
 
+class SortedFrontier:
+    '''
+    SortedFrontier
+    --------------
+    Open set kept as a list sorted with insert_sorted, the lowest cost at the
+    end of the list. Every push costs O(n), it is kept to compare results
+    with HeapFrontier on identical inputs.'''
+    def __init__(self):
+        self.items = []
+
+    @staticmethod
+    def comp(val_1, val_2):
+        return val_1[0] - val_2[0]  # cost_1 >= cost_2
+
+    def push(self, cost, item):
+        insert_sorted(self.items, (cost, item), self.comp)
+
+    def pop(self):
+        return self.items.pop()[1]
+
+    def peek(self):
+        return self.items[-1][1]
+
+    def __len__(self):
+        return len(self.items)
+
+
+class HeapFrontier:
+    '''
+    HeapFrontier
+    ------------
+    Open set kept as a binary heap (heapq). Pushes and pops cost O(log n).
+    Items are extracted in the same cost order as in SortedFrontier, and the
+    ones with the same cost in insertion order (SortedFrontier leaves them
+    where its binary search stops), so a search can choose another path of
+    the same cost. Outdated entries are not removed, the searches skip them
+    when they are popped.'''
+    def __init__(self):
+        self.items = []
+        self.counter = count()
+
+    def push(self, cost, item):
+        heapq.heappush(self.items, (cost, next(self.counter), item))
+
+    def pop(self):
+        return heapq.heappop(self.items)[2]
+
+    def peek(self):
+        return self.items[0][2]
+
+    def __len__(self):
+        return len(self.items)
+
+
+# Index entry of a station node, (line, position, interval, walks)
+NODE_ENTRY = ((0, 0, -1, (((), 0, None), )), )
+
+
+def expand_path(metro, path):
+    '''
+    expand_path
+    -----------
+    Adds to a path of station nodes the stations that are not nodes between
+    two consecutive ones (middle intervals). The line between them is the
+    shortest one of their adyacencies. Other stations of the path are kept
+    as they are.'''
+    if len(metro.st_between) == 0:
+        return path
+    full_path = [path[0]]
+    for st_at, nxt_st in zip(path, path[1:]):
+        lines = [(ady_dist, ady_ln) for ady_nm, ady_ln, ady_dist
+                 in metro.st_nodes.get(st_at, ()) if ady_nm == nxt_st]
+        if lines:
+            full_path += metro.st_between.get((st_at, nxt_st, min(lines)[1]),
+                                              ())
+        full_path.append(nxt_st)
+    return tuple(full_path)
+
+
+def route_through_nodes(metro, st_from, st_to, search):
+    '''
+    route_through_nodes
+    -------------------
+    Moves st_from and st_to to the station nodes as described at
+    move_to_graph and calls search(metro, node_from, node_to, ln_from, ln_to,
+    tm_used) to find the path between the nodes. Returns the full route.
+    If a station can leave the interval through several nodes (middle
+    intervals, or stations that are not nodes in several lines), all of them
+    are searched at once with metro.min_cam_exits instead.'''
+    entries_from = metro.st_index.get(st_from, NODE_ENTRY)
+    entries_to = metro.st_index.get(st_to, NODE_ENTRY)
+    # If both stations are not nodes and in the same interval
+    for ln_from, pos_from, int_from, _ in entries_from:
+        for ln_to, pos_to, int_to, _ in entries_to:
+            if ln_from == ln_to and ln_from != 0 and int_from == int_to:
+                # Calculate the step and the path (without end station)
+                step = 1 if pos_from < pos_to else -1
+                path = metro.st_names[ln_from][pos_from:pos_to:step]
+                distance = dist(metro.st_dist[ln_from], pos_from, pos_to)
+                return {'path': path + (metro.st_names[ln_from][pos_to],),
+                        'dist': distance,
+                        'time': round(distance/metro.train_speed, 1),
+                        'tmTrans': 0}
+    # exits = [(line, walk, st_node_nm)]
+    exits_from = [(entry[0], walk, walk[2] or st_from)
+                  for entry in entries_from for walk in entry[3]]
+    exits_to = [(entry[0], walk, walk[2] or st_to)
+                for entry in entries_to for walk in entry[3]]
+    if len(exits_from) == 0 or len(exits_to) == 0:  # Lines without nodes
+        return None
+    if len(exits_from) > 1 or len(exits_to) > 1:
+        return metro.min_cam_exits(exits_from, exits_to)
+    return route_exits(metro, st_from, st_to, exits_from[0], exits_to[0],
+                       search)
+
+
+def route_exits(metro, st_from, st_to, exit_from, exit_to, search):
+    '''
+    route_exits
+    -----------
+    Returns the route of route_through_nodes between st_from and st_to
+    leaving their intervals through exit_from and exit_to, (line, walk,
+    st_node_nm).'''
+    ln_from, begin = exit_from[:2]
+    ln_to, end = exit_to[:2]
+    # begin / end = (st_nm_path, dist_travelled, st_node_nm)
+    tm_used = 0  # TODO
+    if begin[2] is not None:  # If it has moved
+        st_from = begin[2]
+        tm_used = round(begin[1]/metro.train_speed, 1)
+    if end[2] is not None:
+        st_to = end[2]
+    if st_from == st_to:  # If both nodes are the same
+        tm_transfer = 0
+        # If they have come from different lines
+        if ln_from != 0 and ln_to != 0 and ln_from != ln_to:
+            tm_transfer = metro.transfer_line_time(tm_used)
+            if tm_transfer < 0:
+                return None
+        return {
+            'path': begin[0] + (st_from, ) + end[0][::-1],
+            'dist': begin[1] + end[1],
+            'time': round((begin[1] + end[1])/metro.train_speed + tm_transfer, 1),
+            'tmTrans': tm_transfer}
+    path_in_graph = search(metro, st_from, st_to, ln_from, ln_to, tm_used)
+    if path_in_graph is None:
+        return None
+    tm_used = round(
+        (begin[1] + path_in_graph['dist'] + end[1])/metro.train_speed, 1)
+    tm_used += path_in_graph['tmTrans']
+    return {'path': (begin[0] + expand_path(metro, path_in_graph['path'])
+                     + end[0][::-1]),
+            'dist': begin[1] + path_in_graph['dist'] + end[1],
+            'time': tm_used,
+            'tmTrans': path_in_graph['tmTrans']}
+
+
 def move_to_graph(func):
     '''
     move_to_graph
@@ -138,66 +295,47 @@ def move_to_graph(func):
     - If one or both are not nodes, call move_to_node to move to the
         nearest node. If the node they are at now is the same, then
         returns the travel path obtained, else, obtains the sum of the path
-        with the start and the end.'''
+        with the start and the end.
+    - If a station can move to several nodes (middle intervals or several
+        lines), all of them are searched at once with min_cam_exits.
+    If the metro has a result cache (see use_result_cache), it is checked
+    before anything else. If it has instrumentation (see
+    use_instrumentation), every call is a query of it (see routed_query).'''
     @wraps(func)
     def wrapper(*args, **kwargs):
-        metro, st_from, st_to = args[0], args[1], args[2]
-        if metro.transfer_line_time(0) < 0:  # Metro is closed
-            return None
-        ln_from, pos_from = 0, 0
-        ln_to, pos_to = 0, 0
-        if metro.st_nodes.get(st_from) is None:  # Checks if they are a nodes
-            ln_from, pos_from = metro.st_lin[st_from]
-        if metro.st_nodes.get(st_to) is None:
-            ln_to, pos_to = metro.st_lin[st_to]
-
-        # If both stations are not nodes and in the same line
-        if ln_from == ln_to and ln_from != 0:
-            if belongs_to(metro.st_intervals[ln_from], pos_from, pos_to) != -1:
-                # Calculate the step and the path (without end station)
-                step = 1 if pos_from < pos_to else -1
-                path = metro.st_names[ln_from][pos_from:pos_to:step]
-                distance = dist(metro.st_dist[ln_from], pos_from, pos_to)
-                return {'path': path + (metro.st_names[ln_from][pos_to],),
-                        'dist': distance,
-                        'time': round(distance/metro.train_speed, 1),
-                        'tmTrans': 0}
-        # begin / end = (st_nm_path, dist_travelled, st_node_nm)
-        begin = metro.move_to_node(ln_from, pos_from)
-        tm_used = 0  # TODO
-        if begin[2] is not None:  # If it has moved
-            st_from = begin[2]
-            tm_used = round(begin[1]/metro.train_speed, 1)
-        end = metro.move_to_node(ln_to, pos_to)
-        if end[2] is not None:
-            st_to = end[2]
-        if st_from == st_to:  # If both nodes are the same
-            tm_transfer = 0
-            # If they have come from different lines
-            if ln_from != 0 and ln_to != 0 and ln_from != ln_to:
-                tm_transfer = metro.transfer_line_time(tm_used)
-                if tm_transfer < 0:
-                    return None
-            return {
-                'path': begin[0] + (st_from, ) + end[0][::-1],
-                'dist': begin[1] + end[1],
-                'time': round((begin[1] + end[1])/metro.train_speed + tm_transfer, 1),
-                'tmTrans': tm_transfer}
-        # Intro modified args
-        args = (metro, st_from, st_to, ln_from, ln_to, tm_used)
-        path_in_graph = func(*args, **kwargs)
-        if path_in_graph is None:
-            return None
-        tm_used = round(
-            (begin[1] + path_in_graph['dist'] + end[1])/metro.train_speed, 1)
-        tm_used += path_in_graph['tmTrans']
-        return {'path': begin[0] + path_in_graph['path'] + end[0][::-1],
-                'dist': begin[1] + path_in_graph['dist'] + end[1],
-                'time': tm_used,
-                'tmTrans': path_in_graph['tmTrans']}
+        return routed_query(args[0], args[1], args[2], args[3:], kwargs,
+                            lambda *node_args: func(*node_args, **kwargs))
     return wrapper
 
 
+def routed_query(metro, st_from, st_to, args, kwargs, search):
+    '''
+    routed_query
+    ------------
+    Answers min_cam(st_from, st_to, *args, **kwargs) of metro, searching
+    between the nodes with search as in route_through_nodes. The result
+    cache of metro is checked first and the query is counted at its
+    instrumentation, if it has them.'''
+    stats, cache = metro.instrumentation, metro.result_cache
+    if stats is not None:
+        stats.start_query(metro, st_from, st_to)
+    route = NO_ROUTE
+    if cache is not None:
+        key = cache.key(metro, st_from, st_to, args, kwargs)
+        route = cache.get(key)
+        if stats is not None and route is not NO_ROUTE:
+            stats.cache_hit()
+    if route is NO_ROUTE:
+        route = None
+        if metro.transfer_line_time(0) >= 0:  # Metro is open
+            route = route_through_nodes(metro, st_from, st_to, search)
+        if cache is not None:
+            cache.put(key, route)
+    if stats is not None:
+        stats.end_query(route)
+    return route
+
+
 class MetAtenas:
     '''
     MetAtenas
@@ -207,24 +345,158 @@ class MetAtenas:
     stations.'''
     day_val = {"Monday": 0, "Tuesday": 1, "Wednesday": 2, "Thursday": 3,
                "Friday": 4, "Saturday": 5, "Sunday": 6}
+    # Open set used by min_cam and heuristic_costs, can be replaced by
+    # SortedFrontier, per instance or per call (frontier=SortedFrontier)
+    frontier = HeapFrontier
+    # Search used by min_cam between the nodes, 'astar', 'bidirectional' or
+    # 'states', per instance or per call (mode='bidirectional')
+    search_mode = 'astar'
 
-    def __init__(self, met_data):
-        lineas_metro_data = load_data(met_data)
+    def __init__(self, met_data, heuristic_cache_size=64,
+                 precompute_heuristics=False):
+        # met_data is the path of the json file or its data already loaded
+        # in the lineasMetro format. The data can also include 'adyacencies'
+        # with 'minNodeDist', 'intervals' and a CompiledGraph 'graph' (see
+        # snapshot.py) so that they are not calculated again
+        # Seconds spent at each step of the initialization, step -> seconds
+        # ('load_data', 'get_adyacencies', 'get_intervals'), only the ones
+        # that were not already done
+        self.init_times = {}
+        start = time.perf_counter()
+        lineas_metro_data = met_data if isinstance(met_data, dict) \
+            else load_data(met_data)
+        if not isinstance(met_data, dict):
+            self.init_times['load_data'] = time.perf_counter() - start
         self.st_lin = lineas_metro_data['lin']
         self.st_names = lineas_metro_data['stNm']
         self.st_dist = lineas_metro_data['stDist']
         # Average train speed is 80 km/h, we store the speed in m/min
         self.train_speed = round(80*1000/60, 2)
         self.start_travel_time = (0, 12, 0)
+        # TransferProfile set at compile_transfer_profile
+        self.transfer_profile = None
+        self._max_transfer_time = None
+        self._min_transfer_time = None
+        # Searches done and nodes expanded, mode -> {'searches', 'expanded'}
+        # ('heuristic' for the tables of heuristic_ids, 'exits' for
+        # min_cam_exits)
+        self.search_stats = {}
         # Heuristic values for line_travel_cost and line_transfer_cost
         # set at get_adyacencies
         # By default we set, 1, if minimum_travel_time is lower than one
         # we change these values
         self.min_node_dist = 1
+        # Heuristic tables of heuristic_costs, (st_name, st_lin) -> h_vals
+        # Least recently used first, emptied when st_nodes or speed change
+        self.h_cache = OrderedDict()
+        self.h_cache_size = heuristic_cache_size
+        # CompiledGraph of st_nodes, compiled again when st_nodes changes
+        self._graph = None
+        # StateGraph of the graph, built again when the graph is compiled
+        self._state_graph = None
+        # Lines broken with break_line, {frozenset((st_from, st_to))}
+        self.faults = set()
+        # Cache of the results of min_cam (result_cache.ResultCache), set at
+        # use_result_cache
+        self.result_cache = None
+        # instrumentation.Instrumentation of the queries, set at
+        # use_instrumentation
+        self.instrumentation = None
+        # Route tables (route_table.RouteTable) used by min_cam instead of
+        # searching when they match the speed and the departure time
+        self.route_tables = []
+        # Contraction hierarchies (hierarchy.ContractionHierarchy) used in the
+        # same way, while break_line has not changed the network
+        self.hierarchies = []
         # We load the station nodes, and then we introduce their adyacencies
         self.st_nodes = lineas_metro_data['stNodes']
-        self.st_nodes = self.get_adyacencies(tuple(self.st_nodes.keys()))
-        self.st_intervals = self.get_intervals()
+        if 'adyacencies' in lineas_metro_data:  # Already calculated
+            self.st_nodes = lineas_metro_data['adyacencies']
+            self.min_node_dist = lineas_metro_data['minNodeDist']
+            self._graph = lineas_metro_data.get('graph')
+        else:
+            start = time.perf_counter()
+            self.st_nodes = self.get_adyacencies(tuple(self.st_nodes.keys()))
+            self.init_times['get_adyacencies'] = time.perf_counter() - start
+        self.st_intervals = lineas_metro_data.get('intervals')
+        if self.st_intervals is None:
+            start = time.perf_counter()
+            self.st_intervals = self.get_intervals()
+            self.init_times['get_intervals'] = time.perf_counter() - start
+        else:
+            self.st_index, self.st_between = \
+                self.station_index(self.st_intervals)
+        if precompute_heuristics:
+            self.precompute_heuristics()
+
+    @classmethod
+    def from_state(cls, state, **kwargs):
+        '''
+        from_state
+        ----------
+        Creates a MetAtenas from the dictionary returned by network_state,
+        with the same adyacencies, faults, speed and departure time.'''
+        metro = cls(state['lineasMetro'], **kwargs)
+        metro.st_nodes = dict(state['adyacencies'])
+        metro.faults = {frozenset(fault) for fault in state['faults']}
+        metro.train_speed = state['trainSpeed']
+        metro.start_travel_time = state['startTravelTime']
+        return metro
+
+    def network_state(self):
+        '''
+        network_state
+        -------------
+        Returns a picklable dictionary with the lineasMetro data, the current
+        adyacencies and faults, the train speed and the departure time.'''
+        return {'lineasMetro': {'lin': dict(self.st_lin),
+                                'stNm': self.st_names,
+                                'stDist': self.st_dist,
+                                'stNodes': {st_name: ()
+                                            for st_name in self.st_nodes}},
+                'adyacencies': dict(self.st_nodes),
+                'faults': [tuple(fault) for fault in self.faults],
+                'trainSpeed': self.train_speed,
+                'startTravelTime': self.start_travel_time}
+
+    @property
+    def st_nodes(self):
+        return self._st_nodes
+
+    @st_nodes.setter
+    def st_nodes(self, st_nodes):
+        self._st_nodes = st_nodes
+        self._graph = None
+        self.clear_heuristics()
+        self.route_tables.clear()
+        self.hierarchies.clear()
+        self.clear_results()
+        self.faults = set()
+
+    @property
+    def graph(self):
+        '''
+        graph
+        -----
+        CompiledGraph of st_nodes used by the searches, it is compiled the
+        first time it is needed after st_nodes has changed.'''
+        if self._graph is None:
+            self._graph = CompiledGraph(self.st_nodes)
+        return self._graph
+
+    @property
+    def state_graph(self):
+        '''
+        state_graph
+        -----------
+        StateGraph of graph, the nodes expanded with their lines, built the
+        first time it is needed after graph has been compiled.'''
+        graph = self.graph
+        if self._state_graph is None or self._state_graph.graph is not graph:
+            self._state_graph = StateGraph(graph, (
+                tuple(dict.fromkeys(self.st_lin[st_name][::2]))
+                for st_name in graph.names))
+        return self._state_graph
 
     def get_adyacencies(self, node_names) -> dict:
         '''
@@ -233,43 +505,62 @@ class MetAtenas:
         Returns a dictionary with all the adyacencies each node_name has. We
         only consider adyacencies between nodes.
         '''
-        # Declare the dictionaries we will be using
-        st_nodes = self.st_nodes
         # We use as min_dist start value the distance travelled in 1 minute
         min_dist = self.train_speed
         # The dictionary we will return
         adyacencies = {}
+        self.clear_heuristics()
+        self._graph = None
+        self.route_tables.clear()
+        self.hierarchies.clear()
+        self.clear_results()
         for st_name in node_names:
-            st_data = self.st_lin[st_name]
-            ady = []
-            distance = 0
-            for i in range(0, len(st_data), 2):
-                # Line of the station and pos in the line
-                lin, pos = st_data[i: i + 2]
-                # Names and distances as st_lin
-                ln_nm, ln_dist = self.st_names[lin], self.st_dist[lin]
-                lenln = len(ln_nm)
-                # If the prevSt is a node then append
-                if pos != 0 and st_nodes.get(ln_nm[pos - 1]) is not None:
-                    distance = dist(ln_dist, pos - 1, pos)
-                    min_dist = min(min_dist, distance/self.train_speed)
-                    ady.append((ln_nm[pos - 1], lin, distance))
-                # If the nextSt is a node then append
-                if pos < lenln and st_nodes.get(ln_nm[pos + 1]) is not None:
-                    distance = dist(ln_dist, pos + 1, pos)
-                    min_dist = min(min_dist, distance/self.train_speed)
-                    ady.append((ln_nm[pos + 1], lin, distance))
-            adyacencies[st_name] = tuple(ady)
+            adyacencies[st_name] = self.line_adyacencies(st_name)
+            for _, _, distance in adyacencies[st_name]:
+                min_dist = min(min_dist, distance/self.train_speed)
             self.min_node_dist = min_dist
         return adyacencies
 
+    def line_adyacencies(self, st_name):
+        '''
+        line_adyacencies
+        ----------------
+        Returns the adyacencies (nxt_st_name, through_line, nxt_st_dist) of
+        the node st_name in all its lines, ignoring the faults.'''
+        # Declare the dictionaries we will be using
+        st_nodes = self.st_nodes
+        st_data = self.st_lin[st_name]
+        ady = []
+        for i in range(0, len(st_data), 2):
+            # Line of the station and pos in the line
+            lin, pos = st_data[i: i + 2]
+            # Names and distances as st_lin
+            ln_nm, ln_dist = self.st_names[lin], self.st_dist[lin]
+            lenln = len(ln_nm)
+            # The prev and next nodes, skipping the stations of middle
+            # intervals
+            prev_pos, nxt_pos = pos - 1, pos + 1
+            while prev_pos >= 0 and st_nodes.get(ln_nm[prev_pos]) is None:
+                prev_pos -= 1
+            while nxt_pos < lenln and st_nodes.get(ln_nm[nxt_pos]) is None:
+                nxt_pos += 1
+            # If there is a prevSt node then append
+            if prev_pos >= 0:
+                ady.append((ln_nm[prev_pos], lin,
+                            dist(ln_dist, prev_pos, pos)))
+            # If there is a nextSt node then append
+            if nxt_pos < lenln:
+                ady.append((ln_nm[nxt_pos], lin, dist(ln_dist, nxt_pos, pos)))
+        return tuple(ady)
+
     def get_intervals(self) -> dict:
         '''
         get_intervals
         -------------
         All the stations that are not nodes are put into intervals, associated
         to their lines. In the case of the Athenas Metro, the only intervals
-        we can find are at the start of the line or the end.'''
+        we can find are at the start of the line or the end.
+        The station index of the intervals, st_index, is also built.'''
         st_intervals = {}
         # Read all metro lines
         for num_ln in self.st_names.keys():
@@ -281,18 +572,51 @@ class MetAtenas:
                 if start == -1 and not is_a_node:
                     start = pos
                     step = 1 if not read_a_node else -1
-                elif start != -1 and (is_a_node or pos == len_lin - 1):
+                elif start != -1 and is_a_node:
                     # If it was an interval between a two nodes
-                    step = 0 if read_a_node and is_a_node else step
-                    # If station is not last, then the previous one is the last
-                    last_st = pos - 1 if pos < len_lin - 1 else pos
-                    line_intervals.append((start, last_st, step))
-                    read_a_node, start = False, -1
-                else:
-                    read_a_node = is_a_node or read_a_node
+                    step = 0 if read_a_node else step
+                    # The previous station is the last of the interval
+                    line_intervals.append((start, pos - 1, step))
+                    start = -1
+                read_a_node = is_a_node or read_a_node
+            if start != -1:  # The interval reaches the end of the line
+                line_intervals.append((start, len_lin - 1, step))
             st_intervals[num_ln] = tuple(line_intervals)
+        self.st_index, self.st_between = self.station_index(st_intervals)
         return st_intervals
 
+    def station_index(self, st_intervals):
+        '''
+        station_index
+        -------------
+        Returns (st_index, st_between). st_index is the index of the stations
+        that are not nodes, stName -> ((line, position, interval, walks), ...)
+        with an entry for every line of the station. walks are the ways of
+        moving to the nodes at the ends of the interval, (st_nm_path,
+        dist_travelled, st_node_nm), two for middle intervals (step 0).
+        st_between gives the stations of the middle intervals,
+        (st_node_1, st_node_2, line) -> (stName, ...) from st_node_1.'''
+        st_index, st_between = defaultdict(tuple), {}
+        for num_ln, line_intervals in st_intervals.items():
+            st_nm, st_dist = self.st_names[num_ln], self.st_dist[num_ln]
+            for int_id, (start, last, step) in enumerate(line_intervals):
+                # (position of the node, step to reach it)
+                ends = [(pos_nd, walk_step) for pos_nd, walk_step
+                        in ((start - 1, -1), (last + 1, 1))
+                        if step in {0, walk_step} and 0 <= pos_nd < len(st_nm)]
+                for pos in range(start, last + 1):
+                    walks = tuple((st_nm[pos:pos_nd:walk_step],
+                                   dist(st_dist, pos, pos_nd), st_nm[pos_nd])
+                                  for pos_nd, walk_step in ends)
+                    st_index[st_nm[pos]] += ((num_ln, pos, int_id, walks), )
+                if len(ends) == 2:
+                    between = st_nm[start:last + 1]
+                    st_between[(st_nm[start - 1], st_nm[last + 1], num_ln)] = \
+                        between
+                    st_between[(st_nm[last + 1], st_nm[start - 1], num_ln)] = \
+                        between[::-1]
+        return dict(st_index), st_between
+
     def move_to_node(self, st_line, st_pos):
         '''
         move_to_node
@@ -301,27 +625,24 @@ class MetAtenas:
         and the end of the interval.
         The way it covers the interval is codified in the step. If step is 1,
         then it's a start interval, if it's a -1 an end interval.
-        Step cannot be 0 for the Athenas metro, as we haven't defined
-        any middle intervals, which would need to be covered both ways
-        and added both to the calculations.
-        If it's a node, return ((), 0, None)'''
+        If step is 0, a middle interval, the walk to the previous node is
+        returned, route_through_nodes uses both of them (see st_index).
+        If it's a node, return ((), 0, None). The walks are read from
+        st_index.'''
         if st_line != 0:
-            st_nm, st_dist = self.st_names[st_line], self.st_dist[st_line]
-            st_from_int = belongs_to(self.st_intervals[st_line], st_pos)
-            st_interval = self.st_intervals[st_line][st_from_int]
-            step = st_interval[2]
-            pos_nd = st_interval[1] + 1 if step == 1 else st_interval[0] - 1
-            return(st_nm[st_pos:pos_nd:step], dist(st_dist, st_pos, pos_nd),
-                   st_nm[pos_nd])
+            for num_ln, pos, _, walks in \
+                    self.st_index[self.st_names[st_line][st_pos]]:
+                if (num_ln, pos) == (st_line, st_pos):
+                    return walks[0]
         return ((), 0, None)
 
     def break_line(self, st_from, st_to):
         '''
         break_line
         ----------
-        Breaks the line between two station nodes. To fix the line either call
-        get_adyacencies(tuple(st_nodes.keys())) and assign it to st_nodes and
-        fix all the lines.'''
+        Breaks the line between two station nodes. To fix the line call
+        restore_line, or get_adyacencies(tuple(st_nodes.keys())) and assign
+        it to st_nodes to fix all the lines.'''
         if any(self.st_nodes.get(st) is None for st in (st_from, st_to)):
             print("Invalid stations")
             return
@@ -331,14 +652,82 @@ class MetAtenas:
         self.st_nodes[st_to] = tuple(ady_vals
                                      for ady_vals in self.st_nodes[st_to]
                                      if ady_vals[0] != st_from)
+        self.faults.add(frozenset((st_from, st_to)))
+        self.edge_changed(st_from, st_to, restored=False)
+
+    def restore_line(self, st_from, st_to):
+        '''
+        restore_line
+        ------------
+        Fixes the line between two station nodes broken with break_line. The
+        other faults of both stations are kept.'''
+        fault = frozenset((st_from, st_to))
+        if fault not in self.faults:
+            print("The line is not broken")
+            return
+        self.faults.remove(fault)
+        for st_name in (st_from, st_to):
+            self.st_nodes[st_name] = tuple(
+                ady_vals for ady_vals in self.line_adyacencies(st_name)
+                if frozenset((st_name, ady_vals[0])) not in self.faults)
+        self.edge_changed(st_from, st_to, restored=True)
+
+    def edge_changed(self, st_from, st_to, restored):
+        '''
+        edge_changed
+        ------------
+        Updates what depends on the line between st_from and st_to after it
+        has been broken or restored: the compiled graph, the heuristic tables
+        the change can modify (see heuristic_affected), the rows of the
+        route tables that used the line or may use it now, the hierarchies,
+        only used while the network is the one they were built for, and the
+        result cache.'''
+        self._graph = None
+        self.clear_results()
+        graph = self.graph
+        id_from, id_to = graph.ids[st_from], graph.ids[st_to]
+        for key, h_vals in list(self.h_cache.items()):
+            if self.heuristic_affected(h_vals, id_from, id_to, restored):
+                del self.h_cache[key]
+        for table in self.route_tables:
+            if restored:
+                table.restore_edge(self, st_from, st_to)
+            else:
+                table.remove_edge(self, st_from, st_to)
+        if self.hierarchies:
+            fingerprint = graph.fingerprint()
+            for hierarchy in self.hierarchies:
+                hierarchy.active = hierarchy.fingerprint == fingerprint
 
-    def get_time(self, time_used):
+    def heuristic_affected(self, h_vals, id_1, id_2, restored):
+        '''
+        heuristic_affected
+        ------------------
+        Returns True if breaking (or restoring) the line between the nodes
+        id_1 and id_2 can change the heuristic table h_vals. Breaking a line
+        only matters if it can be on a min cost path of the table, that is
+        if the costs of its nodes differ in one travel or exchange cost.
+        Restoring it only if the costs differ in a travel cost or more, a
+        node reached at the same cost through another line can save an
+        exchange cost to the next ones.'''
+        h_1, h_2 = h_vals[id_1], h_vals[id_2]
+        if h_1 is None or h_2 is None:
+            return restored and (h_1 is not None or h_2 is not None)
+        travel_cost = self.min_node_dist/self.train_speed
+        cost_gap = abs(h_1 - h_2)
+        if restored:
+            return cost_gap >= travel_cost*(1 - 1e-9)
+        return any(abs(cost_gap - cost) <= cost*1e-9
+                   for cost in (travel_cost, travel_cost*3))
+
+    def get_time(self, time_used, start=None):
         '''
         get_time
         --------
         Returns day, hours and minutes from the timeAt if time_used had passed.
-        time_used is in minutes.'''
-        day, hour, minutes = self.start_travel_time
+        time_used is in minutes. start is the (day, hour, minute) used instead
+        of start_travel_time.'''
+        day, hour, minutes = self.start_travel_time if start is None else start
         minutes += time_used
         n_min = minutes % 60
         hour += (minutes - n_min)/60
@@ -351,8 +740,30 @@ class MetAtenas:
         transfer_line_time
         ------------------
         Default function to obtain the average time spent in transfer in a
-        transfer station. If the metro is closed at that time, returns -1.'''
-        day, hour, mint = self.get_time(time_used)
+        transfer station. If the metro is closed at that time, returns -1.
+        If a transfer profile has been compiled, it is read from it.'''
+        if self.transfer_profile is not None:
+            return self.transfer_profile.at(self.start_minute() + time_used)
+        return self.transfer_time_at(*self.get_time(time_used))
+
+    def transfer_at(self, start_minute, time_used):
+        '''
+        transfer_at
+        -----------
+        transfer_line_time for a trip that started at the minute of the week
+        start_minute (Monday 0:00 is 0) instead of at start_travel_time.'''
+        if self.transfer_profile is not None:
+            return self.transfer_profile.at(start_minute + time_used)
+        return self.transfer_time_at(*self.get_time(time_used,
+                                                    week_time(start_minute)))
+
+    @staticmethod
+    def transfer_time_at(day, hour, mint):
+        '''
+        transfer_time_at
+        ----------------
+        Average time spent in a transfer at day, hour and mint, as returned
+        by get_time. If the metro is closed at that time, returns -1.'''
         tm_trans = -1
         if hour < 5:
             if hour == 0 and mint < 30:
@@ -380,13 +791,191 @@ class MetAtenas:
             tm_trans = 10
         return round(tm_trans, 1)
 
+    def start_minute(self):
+        '''
+        start_minute
+        ------------
+        Returns the start_travel_time as minutes since Monday 0:00.'''
+        day, hour, minute = self.start_travel_time
+        return (day*24 + hour)*60 + minute
+
+    def max_transfer_time(self):
+        '''
+        max_transfer_time
+        -----------------
+        Returns the longest transfer time of the week, evaluated every
+        minute.'''
+        if self._max_transfer_time is None:
+            self._max_transfer_time = max(
+                self.transfer_time_at(*week_time(week_minute))
+                for week_minute in range(WEEK_MINUTES))
+        return self._max_transfer_time
+
+    def min_transfer_time(self):
+        '''
+        min_transfer_time
+        -----------------
+        Returns the shortest transfer time of the week, evaluated every
+        minute or read from the transfer profile if it has been compiled.
+        Used as the lower bound of the transfers by bidirectional_search.'''
+        if self._min_transfer_time is None:
+            times = self.transfer_profile.times \
+                if self.transfer_profile is not None \
+                else (self.transfer_time_at(*week_time(week_minute))
+                      for week_minute in range(WEEK_MINUTES))
+            self._min_transfer_time = min(
+                (tm_trans for tm_trans in times if tm_trans > 0), default=0)
+        return self._min_transfer_time
+
+    def compile_transfer_profile(self, resolution=10):
+        '''
+        compile_transfer_profile
+        ------------------------
+        Precompiles transfer_time_at for the whole week, resolution values
+        per minute, so transfer_line_time becomes a lookup. Times are rounded
+        to 1/resolution minutes, min_cam already rounds them to 0.1.'''
+        self.transfer_profile = TransferProfile(self.transfer_time_at,
+                                                resolution)
+        self._min_transfer_time = None
+        self.clear_results()
+        return self.transfer_profile
+
+    def time_bucket(self, bucket_minutes):
+        '''
+        time_bucket
+        -----------
+        Returns the number of the bucket of bucket_minutes of the week the
+        start_travel_time belongs to.'''
+        return int(self.start_minute())//bucket_minutes
+
     def set_hour(self, day, hour, minute):
         self.start_travel_time = (self.day_val[day], hour, minute)
 
     def set_speed(self, speed):
-        self.train_speed = round(speed*1000/60, 2)
+        train_speed = round(speed*1000/60, 2)
+        if train_speed != self.train_speed:
+            self.clear_heuristics()
+            self.clear_results()
+        self.train_speed = train_speed
+
+    def use_route_table(self, table):
+        '''
+        use_route_table
+        ---------------
+        Makes min_cam answer from table (route_table.RouteTable) when the
+        train speed and the departure time match it. A table with the same
+        speed and bucket is replaced.'''
+        if table.fingerprint != self.graph.fingerprint():
+            raise ValueError("The route table was built for another network")
+        self.route_tables = [
+            old for old in self.route_tables
+            if (old.speed, old.bucket, old.bucket_minutes)
+            != (table.speed, table.bucket, table.bucket_minutes)]
+        self.route_tables.append(table)
+        self.clear_results()
+
+    def use_hierarchy(self, hierarchy):
+        '''
+        use_hierarchy
+        -------------
+        Makes min_cam answer from hierarchy (hierarchy.ContractionHierarchy)
+        when the train speed and the departure time match it, and the
+        network has not been changed by break_line. A hierarchy with the same
+        speed and bucket is replaced.'''
+        if hierarchy.fingerprint != self.graph.fingerprint():
+            raise ValueError("The hierarchy was built for another network")
+        self.hierarchies = [
+            old for old in self.hierarchies
+            if (old.speed, old.bucket, old.bucket_minutes)
+            != (hierarchy.speed, hierarchy.bucket, hierarchy.bucket_minutes)]
+        self.hierarchies.append(hierarchy)
+        self.clear_results()
+
+    def use_result_cache(self, cache):
+        '''
+        use_result_cache
+        ----------------
+        Makes min_cam store its results at cache (result_cache.ResultCache)
+        and answer from it when it is asked the same route again. None stops
+        using it. Returns cache.'''
+        self.result_cache = cache
+        self.clear_results()
+        return cache
 
-    def heuristic_costs(self, st_name, st_lin=0):
+    def use_instrumentation(self, instrumentation):
+        '''
+        use_instrumentation
+        -------------------
+        Collects the stats of every min_cam query at instrumentation
+        (instrumentation.Instrumentation), None stops collecting them. The
+        frontier, transfer_line_time and transfer_at of the instance are
+        replaced by ones that count their calls while it is used. Returns
+        instrumentation.'''
+        if self.instrumentation is not None:
+            self.instrumentation.detach(self)
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            instrumentation.attach(self)
+        return instrumentation
+
+    def clear_results(self):
+        '''
+        clear_results
+        -------------
+        Empties the result cache, if any. Called when the adyacencies, the
+        faults, the train speed or the tables used by min_cam change.'''
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
+    def clear_heuristics(self):
+        '''
+        clear_heuristics
+        ----------------
+        Empties the heuristic tables stored by heuristic_table. Called when
+        the adyacencies or the train speed change.'''
+        self.h_cache.clear()
+
+    def heuristic_table(self, st_name, st_lin=0, frontier=None):
+        '''
+        heuristic_table
+        ---------------
+        Returns heuristic_ids(st_name, st_lin), reusing the table if it has
+        already been calculated. Only the h_cache_size most recently used
+        tables are kept.'''
+        key = (st_name, st_lin)
+        h_vals = self.h_cache.get(key)
+        stats = self.instrumentation
+        if h_vals is not None:
+            self.h_cache.move_to_end(key)
+            if stats is not None:
+                stats.heuristic(True)
+            return h_vals
+        if stats is not None:
+            start = stats.clock()
+        h_vals = self.heuristic_ids(self.graph.ids[st_name], st_lin,
+                                    frontier=frontier)
+        if stats is not None:
+            stats.heuristic(False, stats.clock() - start)
+        self.h_cache[key] = h_vals
+        if len(self.h_cache) > self.h_cache_size:
+            self.h_cache.popitem(last=False)
+        return h_vals
+
+    def precompute_heuristics(self):
+        '''
+        precompute_heuristics
+        ---------------------
+        Calculates the heuristic tables of every node, reached from any of its
+        lines or from none (st_lin = 0). The cache is enlarged if it can not
+        hold all of them.'''
+        keys = [(st_name, 0) for st_name in self.st_nodes]
+        for st_name in self.st_nodes:
+            keys += [(st_name, lin) for lin in self.st_lin[st_name][::2]]
+        self.h_cache_size = max(self.h_cache_size, len(keys))
+        for st_name, st_lin in keys:
+            self.heuristic_table(st_name, st_lin)
+
+    def heuristic_costs(self, st_name, st_lin=0, frontier=None):
         '''
         heuristic_costs
         ---------------
@@ -395,45 +984,215 @@ class MetAtenas:
         Traveling between nodes of the same line accrues the travelCost (1).
         In a transfer station if you change lines, you accrue the exchangeCost
         (2).
+        Returns a dictionary stNode -> cost, calculated at heuristic_ids.
+        frontier is the open set class used, by default self.frontier.'''
+        graph = self.graph
+        h_vals = self.heuristic_ids(graph.ids[st_name], st_lin, frontier)
+        return defaultdict(None, {graph.names[st_id]: cost
+                                  for st_id, cost in enumerate(h_vals)
+                                  if cost is not None})
+
+    def heuristic_ids(self, st_id, st_lin=0, frontier=None):
+        '''
+        heuristic_ids
+        -------------
+        heuristic_costs over the ids of the CompiledGraph. Returns a list
+        id -> cost, None if the node can not be reached.
         We find the min_cost to all the nodes using a modified Dijkstra
         algorithm.'''
+        graph = self.graph
+        offsets, neighbors, lines = graph.offsets, graph.neighbors, graph.lines
         travel_cost = self.min_node_dist/self.train_speed
         exch_cost = travel_cost*3
         # visited where we store the permanent labels and stack_nodes were we
         # store the temporary ones
-        visited = defaultdict(None)
-        # node_in_stack = (stNode_Nm, node_cost, node_at_Ln)
-        stack_nodes = [(st_name, 0, st_lin)]
-
-        def comp(st_1, st_2):
-            return st_1[1] - st_2[1]  # st_1 >= st_2
+        visited = [None]*len(graph)
+        # node_in_stack = (stNode_id, node_cost, node_at_Ln)
+        stack_nodes = (frontier or self.frontier)()
+        stack_nodes.push(0, (st_id, 0, st_lin))
+        expanded = 0
         # We don't modify the temp labels, we only check if it already has a
         # permanent one.
         while len(stack_nodes) != 0:
-            # 0 -> stNodeNm / 1 -> node_cost / 2 -> node_at_Ln
-            node_top = stack_nodes.pop()
-            val_visited = visited.get(node_top[0])
+            st_at, st_cost, at_ln = stack_nodes.pop()
+            val_visited = visited[st_at]
             # Node already visited
-            if val_visited is not None and val_visited != node_top[1]:
+            if val_visited is not None and val_visited != st_cost:
                 continue
             # Add permanent label
-            visited[node_top[0]] = node_top[1]
-            # Get all adyacents
-            adyacencies = self.st_nodes[node_top[0]]
-            for ady_values in adyacencies:
-                # ady = (nxt_st_name, through_line, nxt_st_dixt)
+            visited[st_at] = st_cost
+            expanded += 1
+            # Get all adyacents, edge -> (nxt_st_id, through_line)
+            for edge in range(offsets[st_at], offsets[st_at + 1]):
+                nxt_st = neighbors[edge]
                 # Adyacent already visited
-                if visited.get(ady_values[0]) is not None:
+                if visited[nxt_st] is not None:
                     continue
-                node_in_ln = node_top[2] in {0, ady_values[1]}
-                n_cost = travel_cost if node_in_ln else exch_cost
-                insert_sorted(stack_nodes, (ady_values[0],
-                                            node_top[1] + n_cost,
-                                            ady_values[1]), comp)
+                through_ln = lines[edge]
+                node_in_ln = at_ln == 0 or at_ln == through_ln
+                n_cost = st_cost + (travel_cost if node_in_ln else exch_cost)
+                stack_nodes.push(n_cost, (nxt_st, n_cost, through_ln))
+        self.count_search('heuristic', expanded)
         return visited
 
+    def node_tree(self, st_id, lin_from=0, tm_used=0, starts=None,
+                  labels=None):
+        '''
+        node_tree
+        ---------
+        Dijkstra from the node st_id of the CompiledGraph to all the nodes,
+        with the costs used at min_cam. lin_from and tm_used as in min_cam.
+        Nodes are labelled once per line, as the line they are reached
+        through changes the transfers that follow, and a path doesn't go
+        through a node twice (see state_search).
+        Returns (pred_nodes, pred_lines, dists, tms_trans, arrivals), lists
+        id -> value of the first label of every node (pred -1 and dist None
+        if not reached), where arrivals are the best ways of reaching every
+        node through each line:
+        arrivals = [id -> {through_ln -> (cost, st_prev, dist, tm_trans,
+                                          edge_trans, tt_tm, ln_prev)}]
+        ln_prev being the line the search was at st_prev, so the arrival
+        follows the label (st_prev, ln_prev).
+        starts, if given, replaces st_id and lin_from by several sources
+        (st_id, dist, lin_from) searched at once with the costs of
+        min_cam_exits: dists include the dist of the source, the sources are
+        also arrivals (st_prev -1) through their line and edge_trans is the
+        whole tm_trans, as the transfer to the line of a target is timed
+        there.
+        labels, if given, is filled with the labels expanded,
+        (id, line) -> (st_prev, ln_prev).'''
+        graph = self.graph
+        offsets, neighbors = graph.offsets, graph.neighbors
+        lines, distances = graph.lines, graph.distances
+        pred_nodes, pred_lines = [-1]*len(graph), [0]*len(graph)
+        dists, tms_trans = [None]*len(graph), [None]*len(graph)
+        arrivals = [{} for _ in range(len(graph))]
+        # stNodeVals=(st_at, st_prev, dist_trav, ln_at, tm_trans, ln_prev)
+        open_stck = self.frontier()
+        if labels is None:
+            labels = {}
+        if starts is None:
+            open_stck.push(0, (st_id, -1, 0, lin_from, 0, 0))
+        else:
+            for src_id, src_dist, src_ln in starts:
+                tt_tm = round(src_dist/self.train_speed, 1)
+                best = arrivals[src_id].get(src_ln)
+                if best is None or tt_tm < best[0]:
+                    arrivals[src_id][src_ln] = (tt_tm, -1, src_dist, 0, 0,
+                                                tt_tm, 0)
+                open_stck.push(tt_tm, (src_id, -1, src_dist, src_ln, 0, 0))
+        while len(open_stck) != 0:
+            st_at, st_prev, st_dist, at_ln, tm_trans, ln_prev = \
+                open_stck.pop()
+            if (st_at, at_ln) in labels:
+                continue
+            labels[(st_at, at_ln)] = (st_prev, ln_prev)
+            if dists[st_at] is None:
+                dists[st_at], tms_trans[st_at] = st_dist, tm_trans
+                pred_nodes[st_at], pred_lines[st_at] = st_prev, at_ln
+            # Nodes of the path to the label, they are not visited again
+            on_path, prev = {st_at}, (st_prev, ln_prev)
+            while prev[0] != -1:
+                on_path.add(prev[0])
+                prev = labels[prev]
+            for edge in range(offsets[st_at], offsets[st_at + 1]):
+                nxt_st, through_ln = neighbors[edge], lines[edge]
+                if nxt_st in on_path or (nxt_st, through_ln) in labels:
+                    continue
+                nxt_dist = st_dist + distances[edge]
+                tt_tm = round(nxt_dist/self.train_speed, 1)
+                edge_trans = 0
+                if at_ln != 0 and at_ln != through_ln:
+                    edge_trans = self.transfer_line_time(
+                        round(tt_tm + tm_trans + tm_used, 1))
+                    if edge_trans <= 0:
+                        continue
+                cost = tt_tm + tm_trans + edge_trans
+                best = arrivals[nxt_st].get(through_ln)
+                if best is None or cost < best[0]:
+                    arrivals[nxt_st][through_ln] = (
+                        cost, st_at, nxt_dist, tm_trans + edge_trans,
+                        edge_trans if starts is None
+                        else tm_trans + edge_trans, tt_tm, at_ln)
+                open_stck.push(cost, (nxt_st, st_at, nxt_dist, through_ln,
+                                      tm_trans + edge_trans, at_ln))
+        return pred_nodes, pred_lines, dists, tms_trans, arrivals
+
+    def node_arrival(self, arrivals, lin_to=0, tm_used=0):
+        '''
+        node_arrival
+        ------------
+        Returns the best (cost, st_prev, through_ln, dist, tm_trans, ln_prev)
+        of the arrivals to a node given by node_tree, if the trip has to
+        continue at lin_to (transfer at the node as in min_cam). None if there
+        is none.'''
+        best = None
+        for through_ln, (cost, st_prev, st_dist, tm_trans, edge_trans,
+                         tt_tm, ln_prev) in arrivals.items():
+            # If we are at the st_to, and we are not in lin_to
+            if through_ln != 0 and lin_to not in {0, through_ln}:
+                time = self.transfer_line_time(round(tt_tm + edge_trans
+                                                     + tm_used, 1))
+                if time <= 0:
+                    continue
+                cost, tm_trans = cost + time, tm_trans + time
+            if best is None or cost < best[0]:
+                best = (cost, st_prev, through_ln, st_dist, tm_trans, ln_prev)
+        return best
+
+    def route_costs(self, path, path_lines, lin_from=0, lin_to=0, tm_used=0):
+        '''
+        route_costs
+        -----------
+        Returns (dist, tm_trans) of travelling through the node path, where
+        path_lines[i] is the line used between path[i] and path[i + 1], with
+        the costs used at min_cam. Returns None if the path can't be followed
+        or the metro is closed at one of the transfers.'''
+        st_dist, tm_trans, at_ln = 0, 0, lin_from
+        for pos, through_ln in enumerate(path_lines):
+            st_at, nxt_st_nm = path[pos], path[pos + 1]
+            nxt_st_dist = next((ady_dist for ady_nm, ady_ln, ady_dist
+                                in self.st_nodes[st_at]
+                                if ady_nm == nxt_st_nm
+                                and ady_ln == through_ln), None)
+            if nxt_st_dist is None:
+                return None
+            tt_tm = round((st_dist + nxt_st_dist)/self.train_speed, 1)
+            nxt_trans_tm = 0
+            if at_ln not in {0, through_ln}:
+                time = self.transfer_line_time(round(tt_tm + tm_trans
+                                                     + tm_used, 1))
+                if time <= 0:
+                    return None
+                nxt_trans_tm += time
+            if pos == len(path_lines) - 1 and lin_to not in {0, through_ln}:
+                time = self.transfer_line_time(round(tt_tm + nxt_trans_tm
+                                                     + tm_used, 1))
+                if time <= 0:
+                    return None
+                nxt_trans_tm += time
+            st_dist += nxt_st_dist
+            tm_trans += nxt_trans_tm
+            at_ln = through_ln
+        return (st_dist, tm_trans)
+
+    def count_search(self, mode, expanded, goal_pops=0):
+        '''
+        count_search
+        ------------
+        Adds a search of mode that expanded the given number of nodes to
+        search_stats and to the instrumentation, if any. goal_pops are the
+        pops of the goal that ended the search without expanding it.'''
+        stats = self.search_stats.setdefault(mode, {'searches': 0,
+                                                    'expanded': 0})
+        stats['searches'] += 1
+        stats['expanded'] += expanded
+        if self.instrumentation is not None:
+            self.instrumentation.search(mode, expanded, goal_pops)
+
     @move_to_graph
-    def min_cam(self, st_from, st_to, lin_from=0, lin_to=0, tm_used=0):
+    def min_cam(self, st_from, st_to, lin_from=0, lin_to=0, tm_used=0,
+                frontier=None, mode=None):
         '''
         min_cam
         -------
@@ -446,36 +1205,69 @@ class MetAtenas:
             (chosen at move_to_graph)
         tm_used is the time that has already passed (example, moving from
             st_from to the nearest station node)
+        frontier is the open set class used, by default self.frontier.
+        mode is the search used, by default self.search_mode, 'astar',
+            'bidirectional' (see bidirectional_search) or 'states' (see
+            state_search).
+        If a route table matches the speed and departure time, the path is
+        taken from it instead. If a contraction hierarchy matches them, the
+        path is searched in it, and if it can't be followed at the departure
+        time the search is done as usual.
         Returns a dictionary with 'path', 'dist' and 'tm_trans'
         '''
-        h_vals = self.heuristic_costs(st_to, st_lin=lin_to)
+        for table in self.route_tables:
+            if table.matches(self):
+                return table.route(self, st_from, st_to, lin_from, lin_to,
+                                   tm_used)
+        for hierarchy in self.hierarchies:
+            if hierarchy.matches(self):
+                route = hierarchy.route(self, st_from, st_to, lin_from, lin_to,
+                                        tm_used)
+                if route is not None:
+                    return route
+        mode = mode or self.search_mode
+        if mode == 'bidirectional':
+            return self.bidirectional_search(st_from, st_to, lin_from, lin_to,
+                                             tm_used, frontier)
+        if mode == 'states':
+            return self.state_search(st_from, st_to, lin_from, lin_to,
+                                     tm_used, frontier)
+        if mode != 'astar':
+            raise ValueError(f"Unknown search mode {mode}")
+        frontier = frontier or self.frontier
+        graph = self.graph
+        offsets, neighbors = graph.offsets, graph.neighbors
+        lines, distances = graph.lines, graph.distances
+        h_vals = self.heuristic_table(st_to, st_lin=lin_to, frontier=frontier)
+        id_from, id_to = graph.ids[st_from], graph.ids[st_to]
         # stNodeVals=(  st_at, st_from,dist_trav,    ln_at,tm_trans, nd_cost)
-        open_stck = [(st_from, st_from,        0, lin_from,       0,       0)]
-        visited = defaultdict(None)
-
-        def comp(node_vals_1, node_vals_2):
-            # f_cost_1 >=  f_cost_2
-            return node_vals_1[-1] - node_vals_2[-1]
+        open_stck = frontier()
+        open_stck.push(0, (id_from, id_from, 0, lin_from, 0, 0))
+        # visited = [id -> id of the node it was reached from]
+        visited = [None]*len(graph)
+        expanded = 0
 
         # In open_stck there can be two instances of the same node. Of these
         # instances we only count the lowest one, that is the first to be
         # extracted from open_stck. After we have added one of these to visited
         # we ignore the other ones.
-        while len(open_stck) != 0 and open_stck[-1][0] != st_to:
-            st_at, st_from, st_dist, at_ln, tm_trans, cost = open_stck.pop()
-            if visited.get(st_at) is not None:
+        while len(open_stck) != 0 and open_stck.peek()[0] != id_to:
+            st_at, st_prev, st_dist, at_ln, tm_trans, cost = open_stck.pop()
+            if visited[st_at] is not None:
                 continue
-            visited[st_at] = st_from
-            adyacencies = self.st_nodes[st_at]
-            for nxt_st_nm, through_ln, nxt_st_dist in adyacencies:
-                # Node has already been visited
-                if visited.get(nxt_st_nm) is not None:
+            visited[st_at] = st_prev
+            expanded += 1
+            for edge in range(offsets[st_at], offsets[st_at + 1]):
+                nxt_st = neighbors[edge]
+                # Node has already been visited or can't reach st_to
+                if visited[nxt_st] is not None or h_vals[nxt_st] is None:
                     continue
+                through_ln, nxt_st_dist = lines[edge], distances[edge]
                 # Total time used travelling the total distance (g1(x))
                 tt_tm = round((st_dist + nxt_st_dist)/self.train_speed, 1)
                 # Next transfer time
                 nxt_trans_tm = 0
-                if at_ln not in {0, through_ln}:
+                if at_ln != 0 and at_ln != through_ln:
                     time = self.transfer_line_time(round(tt_tm + tm_trans
                                                          + tm_used, 1))
                     if time > 0:
@@ -483,7 +1275,7 @@ class MetAtenas:
                     else:
                         continue
                 # If we are at the st_to, and we are not in lin_to
-                if nxt_st_nm == st_to and lin_to not in {0, through_ln}:
+                if nxt_st == id_to and lin_to not in {0, through_ln}:
                     time = self.transfer_line_time(round(tt_tm + nxt_trans_tm + tm_used, 1))
                     if time > 0:
                         nxt_trans_tm += time
@@ -491,21 +1283,843 @@ class MetAtenas:
                         continue
                 # f(x) = g(x) + h(x) (g(x) = g1(x) + g2(x))
                 # g2(x) = nxt_trans_tm + tm_trans
-                node_cost = nxt_trans_tm + tm_trans + tt_tm + h_vals[nxt_st_nm]
-                insert_sorted(open_stck, (nxt_st_nm, st_at, st_dist + nxt_st_dist,
-                                          through_ln, nxt_trans_tm + tm_trans,
-                                          node_cost), comp)
+                node_cost = nxt_trans_tm + tm_trans + tt_tm + h_vals[nxt_st]
+                open_stck.push(node_cost, (nxt_st, st_at,
+                                           st_dist + nxt_st_dist, through_ln,
+                                           nxt_trans_tm + tm_trans, node_cost))
+        self.count_search('astar', expanded, int(len(open_stck) != 0))
         if len(open_stck) == 0:
             return None
         node_info = open_stck.pop()
         path = [node_info[0]]
         st_prev = node_info[1]
         while visited[st_prev] != st_prev:
-            path.insert(0, st_prev)
+            path.append(st_prev)
             st_prev = visited[st_prev]
-        path.insert(0, st_prev)
-        return {'path': tuple(path), 'dist': node_info[2],
-                'tmTrans': node_info[4]}
+        path.append(st_prev)
+        return {'path': tuple(graph.names[st_id] for st_id in reversed(path)),
+                'dist': node_info[2], 'tmTrans': node_info[4]}
+
+    def state_search(self, st_from, st_to, lin_from=0, lin_to=0, tm_used=0,
+                     frontier=None):
+        '''
+        state_search
+        ------------
+        A* over the state_graph between the nodes st_from and st_to, the
+        'states' mode of min_cam. Each line of a node is labelled on its own,
+        so a node reached first through a line that needs a transfer later
+        doesn't block the other lines. h(x) is the one of min_cam.
+        The transfers are the edges between the states of a node. As in
+        min_cam, transfer_line_time is taken when the next node is reached,
+        so the state after a transfer keeps it pending (min_transfer_time
+        is its lower bound) until its travel edge is followed. The transfer
+        to lin_to at st_to is the one of min_cam too, taken when st_to is
+        reached with the transfers of the last edge.
+        A path doesn't go through a node twice. As the transfers are timed
+        when the next node is reached, going to a node and back could
+        otherwise change the time of a transfer and make it cheaper.
+        Returns a dictionary with 'path', 'dist' and 'tmTrans', as min_cam.'''
+        frontier = frontier or self.frontier
+        states, speed = self.state_graph, self.train_speed
+        graph = states.graph
+        travel_targets = states.travel_targets
+        travel_distances = states.travel_distances
+        min_trans = self.min_transfer_time()
+        h_vals = self.heuristic_table(st_to, st_lin=lin_to, frontier=frontier)
+        id_from, id_to = graph.ids[st_from], graph.ids[st_to]
+        # Labels are 2*state + 1 if the transfer to state is pending
+        # label_vals=(label, label_prev, dist_trav, tm_trans, last_trans)
+        open_stck = frontier()
+        for state in states.states(id_from):
+            if lin_from in {0, states.lines[state]}:
+                open_stck.push(0, (2*state, 2*state, 0, 0, 0))
+        # visited = [label -> label it was reached from]
+        visited = [None]*(2*len(states))
+        expanded, goal = 0, None
+        while len(open_stck) != 0:
+            label, label_prev, st_dist, tm_trans, last_trans = \
+                open_stck.pop()
+            if visited[label] is not None:
+                continue
+            visited[label] = label_prev
+            expanded += 1
+            state, pending = divmod(label, 2)
+            st_at = states.nodes[state]
+            if not pending and st_at == id_to and \
+                    lin_to in {0, states.lines[state]}:
+                goal = label
+                break
+            # Nodes of the path to the label, they are not visited again
+            on_path, prev = {st_at}, label
+            while visited[prev] != prev:
+                prev = visited[prev]
+                on_path.add(states.nodes[prev//2])
+            for edge in states.travels(state):
+                nxt = travel_targets[edge]
+                h_val = h_vals[states.nodes[nxt]]
+                if visited[2*nxt] is not None or h_val is None or \
+                        states.nodes[nxt] in on_path:
+                    continue
+                nxt_dist = st_dist + travel_distances[edge]
+                tt_tm = round(nxt_dist/speed, 1)
+                nxt_trans_tm = 0
+                if pending:
+                    nxt_trans_tm = self.transfer_line_time(
+                        round(tt_tm + tm_trans + tm_used, 1))
+                    if nxt_trans_tm <= 0:
+                        continue
+                open_stck.push(tt_tm + tm_trans + nxt_trans_tm + h_val,
+                               (2*nxt, label, nxt_dist,
+                                tm_trans + nxt_trans_tm, nxt_trans_tm))
+            # A transfer can't be followed by another one at the same node
+            if pending or (label_prev != label and
+                           states.nodes[label_prev//2] == st_at):
+                continue
+            tt_tm = round(st_dist/speed, 1)
+            for nxt in states.transfers(state):
+                if st_at == id_to and states.lines[nxt] == lin_to:
+                    time = self.transfer_line_time(round(tt_tm + last_trans
+                                                         + tm_used, 1))
+                    if time > 0 and visited[2*nxt] is None:
+                        open_stck.push(tt_tm + tm_trans + time, (
+                            2*nxt, label, st_dist, tm_trans + time, 0))
+                # The start node can't reach st_to
+                elif visited[2*nxt + 1] is None and h_vals[st_at] is not None:
+                    open_stck.push(tt_tm + tm_trans + min_trans
+                                   + h_vals[st_at], (2*nxt + 1, label,
+                                                     st_dist, tm_trans, 0))
+        self.count_search('states', expanded)
+        if goal is None:
+            return None
+        path, path_lines, label = [], [], goal
+        while True:
+            # The states of a transfer are the same node, kept once
+            st_name = graph.names[states.nodes[label//2]]
+            if not path or st_name != path[-1]:
+                path.append(st_name)
+                path_lines.append(states.lines[label//2])
+            if visited[label] == label:
+                break
+            label = visited[label]
+        path.reverse()
+        # The line a node is left through is the one of the next node
+        path_lines = path_lines[:0:-1]
+        costs = self.route_costs(tuple(path), tuple(path_lines), lin_from,
+                                 lin_to, tm_used)
+        if costs is None:
+            return None
+        return {'path': tuple(path), 'dist': costs[0], 'tmTrans': costs[1]}
+
+    def bidirectional_search(self, st_from, st_to, lin_from=0, lin_to=0,
+                             tm_used=0, frontier=None):
+        '''
+        bidirectional_search
+        --------------------
+        Bidirectional Dijkstra between the nodes st_from and st_to, the
+        'bidirectional' mode of min_cam. It does not need the heuristic
+        tables.
+        The states are (node, line), the line used to reach the node forwards
+        and the one used to leave it backwards. The forward search uses the
+        costs of min_cam. The backward search doesn't know when the transfers
+        happen, so it uses min_transfer_time as a lower bound of them.
+        Every time a state is settled or an edge reaches a state settled by
+        the other search, the exact cost of the path through them is
+        calculated with route_costs. The search stops when the lowest costs
+        of both open sets add up to more than the best path found.
+        The stopping rule is a heuristic, not a proof that no path left is
+        faster: the transfer times change with the time of the day, so
+        reaching a transfer later can make it shorter, and the backward
+        costs don't see that.
+        Returns a dictionary with 'path', 'dist' and 'tmTrans', as min_cam.'''
+        frontier = frontier or self.frontier
+        graph, speed = self.graph, self.train_speed
+        offsets, neighbors = graph.offsets, graph.neighbors
+        lines, distances = graph.lines, graph.distances
+        min_trans = self.min_transfer_time()
+        # labels = {(id, ln) -> (cost, state_prev)} and settled = [id -> {ln}]
+        # of the forward (0) and backward (1) searches
+        labels = ({}, {})
+        settled = ([set() for _ in range(len(graph))],
+                   [set() for _ in range(len(graph))])
+        # state_vals=(state, cost, dist_trav, tm_trans, state_prev)
+        open_stcks = (frontier(), frontier())
+        open_stcks[0].push(0, ((graph.ids[st_from], lin_from), 0, 0, 0, None))
+        open_stcks[1].push(0, ((graph.ids[st_to], lin_to), 0, 0, 0, None))
+        best = [None, float('inf')]  # [(path, dist, tm_trans), time]
+        expanded = 0
+
+        def meet(state_fwd, cost_fwd, state_bwd, cost_bwd, ln_in, ln_out,
+                 hop_ln=None):
+            # Path through the states, ln_in and ln_out are the lines used
+            # to reach and leave the node where both searches join
+            lower = cost_fwd + cost_bwd
+            if ln_in != 0 and ln_out not in {0, ln_in}:
+                lower += min_trans
+            # Rounding the distance of the path can save up to 0.05
+            if lower - 0.1 >= best[1]:
+                return
+            path, path_lines = self.meeting_path(labels, state_fwd, state_bwd,
+                                                 hop_ln)
+            route = self.route_costs(path, path_lines, lin_from, lin_to,
+                                     tm_used)
+            if route is not None and \
+                    round(route[0]/speed, 1) + route[1] < best[1]:
+                best[:] = [(path, ) + route, round(route[0]/speed, 1)
+                           + route[1]]
+
+        # Both start states are settled first, so a search that runs out of
+        # states has already met the other one at all its states
+        sides = [0, 1]
+        while True:
+            if len(sides) == 0:
+                tops = [open_stck.peek()[1] if len(open_stck) != 0
+                        else float('inf') for open_stck in open_stcks]
+                if tops[0] + tops[1] - 0.1 >= best[1]:
+                    break
+                sides.append(0 if tops[0] <= tops[1] else 1)
+            side = sides.pop(0)
+            state, cost, st_dist, tm_trans, state_prev = open_stcks[side].pop()
+            if state in labels[side]:
+                continue
+            labels[side][state] = (cost, state_prev)
+            st_at, at_ln = state
+            settled[side][st_at].add(at_ln)
+            expanded += 1
+            other = 1 - side
+            for other_ln in settled[other][st_at]:
+                other_cost = labels[other][(st_at, other_ln)][0]
+                if side == 0:
+                    meet(state, cost, (st_at, other_ln), other_cost, at_ln,
+                         other_ln)
+                else:
+                    meet((st_at, other_ln), other_cost, state, cost, other_ln,
+                         at_ln)
+            for edge in range(offsets[st_at], offsets[st_at + 1]):
+                nxt_st, through_ln = neighbors[edge], lines[edge]
+                if (nxt_st, through_ln) in labels[side]:
+                    continue
+                nxt_dist = st_dist + distances[edge]
+                tt_tm = round(nxt_dist/speed, 1) if side == 0 \
+                    else nxt_dist/speed
+                nxt_trans_tm = 0
+                if at_ln != 0 and at_ln != through_ln:
+                    nxt_trans_tm = min_trans
+                    if side == 0:
+                        nxt_trans_tm = self.transfer_line_time(
+                            round(tt_tm + tm_trans + tm_used, 1))
+                        if nxt_trans_tm <= 0:
+                            continue
+                nxt_cost = tt_tm + tm_trans + nxt_trans_tm
+                # The edge reaches states settled by the other search
+                for other_ln in settled[other][nxt_st]:
+                    other_cost = labels[other][(nxt_st, other_ln)][0]
+                    if side == 0:
+                        meet(state, nxt_cost, (nxt_st, other_ln), other_cost,
+                             through_ln, other_ln, through_ln)
+                    else:
+                        meet((nxt_st, other_ln), other_cost, state, nxt_cost,
+                             other_ln, through_ln, through_ln)
+                open_stcks[side].push(nxt_cost, (
+                    (nxt_st, through_ln), nxt_cost, nxt_dist,
+                    tm_trans + nxt_trans_tm, state))
+        self.count_search('bidirectional', expanded)
+        if best[0] is None:
+            return None
+        return {'path': best[0][0], 'dist': best[0][1], 'tmTrans': best[0][2]}
+
+    def meeting_path(self, labels, state_fwd, state_bwd, hop_ln=None):
+        '''
+        meeting_path
+        ------------
+        Returns the node names and lines of the path of bidirectional_search
+        through the forward state state_fwd and the backward state state_bwd,
+        at the same node or, if hop_ln is given, at adyacent nodes joined by
+        the line hop_ln.'''
+        names = self.graph.names
+        path, path_lines, state = [], [], state_fwd
+        while state is not None:
+            path.append(names[state[0]])
+            path_lines.append(state[1])
+            state = labels[0][state][1]
+        # The first line is lin_from, not used to reach a node
+        path, path_lines = path[::-1], path_lines[-2::-1]
+        if hop_ln is not None:
+            path.append(names[state_bwd[0]])
+            path_lines.append(hop_ln)
+        ln_bwd, state = state_bwd[1], labels[1][state_bwd][1]
+        while state is not None:
+            path.append(names[state[0]])
+            path_lines.append(ln_bwd)
+            ln_bwd = state[1]
+            state = labels[1][state][1]
+        return tuple(path), tuple(path_lines)
+
+    def min_cam_exits(self, exits_from, exits_to, frontier=None):
+        '''
+        min_cam_exits
+        -------------
+        Multi-source and multi-target version of min_cam, used by
+        route_through_nodes when a station can move to several nodes.
+        exits_from and exits_to are lists of (line, walk, st_node_nm), walk
+        being (st_nm_path, dist_travelled, st_node_nm) as in move_to_node.
+        All the exits are added to a single A* search, the sources with the
+        distance of their walk and the targets as arrival labels with the
+        distance of theirs. The heuristic is the lowest one of the targets.
+        As in state_search, a path doesn't go through a node twice.
+        Returns the full route, as the min_cam wrapper, or None.'''
+        frontier = frontier or self.frontier
+        graph, speed = self.graph, self.train_speed
+        offsets, neighbors = graph.offsets, graph.neighbors
+        lines, distances = graph.lines, graph.distances
+        # ends = [id -> [pos in exits_to]]
+        ends = defaultdict(list)
+        for end_pos, (_, _, st_node) in enumerate(exits_to):
+            ends[graph.ids[st_node]].append(end_pos)
+        h_vals = [None]*len(graph)
+        for ln_to, _, st_node in exits_to:
+            for st_id, h_val in enumerate(self.heuristic_table(
+                    st_node, st_lin=ln_to, frontier=frontier)):
+                if h_val is not None and (h_vals[st_id] is None
+                                          or h_val < h_vals[st_id]):
+                    h_vals[st_id] = h_val
+        # stNodeVals=(st_at, label_prev, dist_trav, ln_at, tm_trans,
+        #             pos in exits_from, pos in exits_to or -1)
+        open_stck = frontier()
+        for src, (ln_from, walk, st_node) in enumerate(exits_from):
+            st_id = graph.ids[st_node]
+            if h_vals[st_id] is not None:
+                open_stck.push(round(walk[1]/speed, 1) + h_vals[st_id],
+                               (st_id, -1, walk[1], ln_from, 0, src, -1))
+        # labels = [(st_at, label_prev, ln_at)], visited = {(id, ln) -> label}
+        # Nodes are labelled once per line, as the line changes the transfers
+        labels, visited = [], {}
+        while len(open_stck) != 0:
+            st_at, prev, st_dist, at_ln, tm_trans, src, end_pos = \
+                open_stck.pop()
+            if end_pos != -1:  # Arrived at one of the exits of st_to
+                self.count_search('exits', len(labels), 1)
+                return self.exits_route(labels, prev, exits_from[src],
+                                        exits_to[end_pos], st_dist, tm_trans)
+            if (st_at, at_ln) in visited:
+                continue
+            label = visited[(st_at, at_ln)] = len(labels)
+            labels.append((st_at, prev, at_ln))
+            # Nodes of the path to the label, they are not visited again
+            on_path = {st_at}
+            while prev != -1:
+                on_path.add(labels[prev][0])
+                prev = labels[prev][1]
+            tt_tm = round(st_dist/speed, 1)
+            for end_pos in ends.get(st_at, ()):
+                ln_to, walk = exits_to[end_pos][:2]
+                end_trans = tm_trans
+                # If we are at the st_to, and we are not in ln_to
+                if ln_to != 0 and at_ln not in {0, ln_to}:
+                    time = self.transfer_line_time(round(tt_tm + tm_trans, 1))
+                    if time <= 0:
+                        continue
+                    end_trans += time
+                end_dist = st_dist + walk[1]
+                open_stck.push(round(end_dist/speed, 1) + end_trans,
+                               (st_at, label, end_dist, at_ln, end_trans, src,
+                                end_pos))
+            for edge in range(offsets[st_at], offsets[st_at + 1]):
+                nxt_st, through_ln = neighbors[edge], lines[edge]
+                if (nxt_st, through_ln) in visited or nxt_st in on_path or \
+                        h_vals[nxt_st] is None:
+                    continue
+                nxt_dist = st_dist + distances[edge]
+                nxt_tt_tm = round(nxt_dist/speed, 1)
+                nxt_trans_tm = 0
+                if at_ln != 0 and at_ln != through_ln:
+                    nxt_trans_tm = self.transfer_line_time(
+                        round(nxt_tt_tm + tm_trans, 1))
+                    if nxt_trans_tm <= 0:
+                        continue
+                node_cost = nxt_tt_tm + tm_trans + nxt_trans_tm + h_vals[nxt_st]
+                open_stck.push(node_cost, (nxt_st, label, nxt_dist, through_ln,
+                                           tm_trans + nxt_trans_tm, src, -1))
+        self.count_search('exits', len(labels))
+        return None
+
+    def exits_route(self, labels, label, exit_from, exit_to, st_dist,
+                    tm_trans):
+        '''
+        exits_route
+        -----------
+        Builds the route of min_cam_exits from the label of the last node,
+        with the stations of the walks and of the middle intervals crossed.'''
+        names, path = self.graph.names, []
+        while label != -1:
+            st_at, label_prev, at_ln = labels[label]
+            path.append(names[st_at])
+            if label_prev != -1:
+                path += self.st_between.get(
+                    (names[st_at], names[labels[label_prev][0]], at_ln), ())
+            label = label_prev
+        return {'path': exit_from[1][0] + tuple(reversed(path))
+                + exit_to[1][0][::-1],
+                'dist': st_dist,
+                'time': round(st_dist/self.train_speed, 1) + tm_trans,
+                'tmTrans': tm_trans}
+
+    def profile_search(self, st_from, st_to, lin_from, lin_to, tm_used,
+                       starts):
+        '''
+        profile_search
+        --------------
+        Searches the path between the nodes st_from and st_to (arguments as
+        in min_cam) for every departure in starts, minutes of the week, in a
+        single search. Each label keeps the cost of its path for all the
+        departures, and a label is only discarded when another one at the
+        same node and line is as good for every departure. As in
+        state_search, a path doesn't go through a node twice.
+        Returns a list with the min_cam result of each departure.'''
+        graph, speed = self.graph, self.train_speed
+        offsets, neighbors = graph.offsets, graph.neighbors
+        lines, distances = graph.lines, graph.distances
+        id_from, id_to = graph.ids[st_from], graph.ids[st_to]
+        no_path = float('inf')
+        # labels = [(st_at, ln_at, dist_trav, costs, tms_trans, parent)]
+        labels = [(id_from, lin_from, 0, (0,)*len(starts), (0,)*len(starts),
+                   -1)]
+        # bags = {(st_id, ln_at) -> [costs]} of the labels not dominated
+        bags = defaultdict(list)
+        # best = [start -> (cost, dist_trav, tm_trans, parent)]
+        best = [None]*len(starts)
+        bound = no_path
+        open_stck = self.frontier()
+        open_stck.push(0, 0)
+        while len(open_stck) != 0:
+            label = open_stck.pop()
+            st_at, at_ln, st_dist, costs, tms_trans, parent = labels[label]
+            if min(costs) >= bound:
+                break
+            # Nodes of the path to the label, they are not visited again
+            on_path = {st_at}
+            while parent != -1:
+                on_path.add(labels[parent][0])
+                parent = labels[parent][5]
+            for edge in range(offsets[st_at], offsets[st_at + 1]):
+                nxt_st, through_ln = neighbors[edge], lines[edge]
+                if nxt_st in on_path:
+                    continue
+                nxt_dist = st_dist + distances[edge]
+                tt_tm = round(nxt_dist/speed, 1)
+                nxt_costs, nxt_trans = [], []
+                for start, cost, tm_trans in zip(starts, costs, tms_trans):
+                    nxt_trans_tm = 0
+                    if cost != no_path and at_ln not in {0, through_ln}:
+                        nxt_trans_tm = self.transfer_at(
+                            start, round(tt_tm + tm_trans + tm_used, 1))
+                        if nxt_trans_tm <= 0:
+                            cost = no_path
+                    # If we are at the st_to, and we are not in lin_to
+                    if cost != no_path and nxt_st == id_to \
+                            and lin_to not in {0, through_ln}:
+                        time = self.transfer_at(
+                            start, round(tt_tm + nxt_trans_tm + tm_used, 1))
+                        if time <= 0:
+                            cost = no_path
+                        nxt_trans_tm += time
+                    if cost != no_path:
+                        cost = tt_tm + tm_trans + nxt_trans_tm
+                    nxt_costs.append(cost)
+                    nxt_trans.append(tm_trans + nxt_trans_tm)
+                if nxt_st == id_to:
+                    for pos, cost in enumerate(nxt_costs):
+                        if cost != no_path and (best[pos] is None
+                                                or cost < best[pos][0]):
+                            best[pos] = (cost, nxt_dist, nxt_trans[pos], label)
+                    if all(best_val is not None for best_val in best):
+                        bound = max(best_val[0] for best_val in best)
+                    continue
+                if all(cost == no_path or (best_val is not None
+                                           and cost >= best_val[0])
+                       for cost, best_val in zip(nxt_costs, best)):
+                    continue
+                bag = bags[(nxt_st, through_ln)]
+                if any(all(old <= cost for old, cost in zip(old_costs,
+                                                            nxt_costs))
+                       for old_costs in bag):
+                    continue
+                bag[:] = [old_costs for old_costs in bag
+                          if not all(cost <= old for old, cost
+                                     in zip(old_costs, nxt_costs))]
+                bag.append(nxt_costs)
+                labels.append((nxt_st, through_ln, nxt_dist, nxt_costs,
+                               nxt_trans, label))
+                open_stck.push(min(nxt_costs), len(labels) - 1)
+        results = []
+        for best_val in best:
+            if best_val is None:
+                results.append(None)
+                continue
+            path, label = [id_to], best_val[3]
+            while label != -1:
+                path.append(labels[label][0])
+                label = labels[label][5]
+            results.append({'path': tuple(graph.names[st_id]
+                                          for st_id in reversed(path)),
+                            'dist': best_val[1], 'tmTrans': best_val[2]})
+        return results
+
+    def earliest_arrivals(self, st_from, st_to, departures):
+        '''
+        earliest_arrivals
+        -----------------
+        Returns the route from st_from to st_to for every departure (day,
+        hour, minute) of departures, as in set_hour, with a single
+        profile_search between the nodes for all of them, as min_cam
+        dictionaries (None if there is no route).
+        The routes are not always the ones of min_cam: profile_search keeps
+        every label that is the best one for some departure, not one per
+        node, so a route is never later than the one of min_cam, in any
+        mode, and one can be found when the default A* search finds none.'''
+        departures = list(departures)
+        starts = [(self.day_val[day]*24 + hour)*60 + minute
+                  for day, hour, minute in departures]
+        profile, results = [], []
+
+        def window_search(metro, nd_from, nd_to, ln_from, ln_to, tm_used):
+            if len(profile) == 0:
+                profile.extend(self.profile_search(nd_from, nd_to, ln_from,
+                                                   ln_to, tm_used, starts))
+            return profile[len(results)]
+        start_travel_time = self.start_travel_time
+        try:
+            for departure in departures:
+                self.set_hour(*departure)
+                if self.transfer_line_time(0) < 0:  # Metro is closed
+                    results.append(None)
+                    continue
+                results.append(route_through_nodes(self, st_from, st_to,
+                                                   window_search))
+        finally:
+            self.start_travel_time = start_travel_time
+        return results
+
+    def min_cam_window(self, st_from, st_to, departure, window, step=1):
+        '''
+        min_cam_window
+        --------------
+        Compares leaving at departure (day, hour, minute), as in set_hour,
+        or at any of the next window minutes, every step minutes. All the
+        departures are solved with a single earliest_arrivals search.
+        Returns the Pareto-optimal trips sorted by departure, those that no
+        later departure reaches as early, as min_cam dictionaries with the
+        'departure' (day, hour, minute) and the 'arrival' as in get_time.'''
+        day_names = sorted(self.day_val, key=self.day_val.get)
+        day, hour, minute = departure
+        start = (self.day_val[day]*24 + hour)*60 + minute
+        departures = []
+        for dep_minute in range(start, start + window + 1, step):
+            dep_day, dep_hour, dep_min = week_time(dep_minute)
+            departures.append((day_names[dep_day], dep_hour, dep_min))
+        results = self.earliest_arrivals(st_from, st_to, departures)
+        trips, first_arrival = [], None
+        # From the last departure to the first, only keep the trips that
+        # arrive before all the later ones
+        for dep_minute, departure, result in zip(
+                reversed(range(start, start + window + 1, step)),
+                reversed(departures), reversed(results)):
+            if result is None:
+                continue
+            arrival = dep_minute + result['time']
+            if first_arrival is not None and arrival >= first_arrival:
+                continue
+            first_arrival = arrival
+            trips.append(dict(result, departure=departure,
+                              arrival=self.get_time(result['time'],
+                                                    week_time(dep_minute))))
+        return trips[::-1]
+
+    def min_cam_tree(self, st_from):
+        '''
+        min_cam_tree
+        ------------
+        Shortest path tree from st_from to every station, node or not, in a
+        single search. Returns a dictionary stName -> {'dist', 'time',
+        'tmTrans', 'prev', 'via'}, with the costs min_cam uses, or None if
+        the metro is closed. Unreachable stations are not included.
+        The nodes are labelled once per line (see node_tree), so the routes
+        are the ones of min_cam(..., mode='states'). They are never later
+        than the ones of the default mode, whose A* labels every node once.
+        prev is the station before stName on its path (None at st_from).
+        via is only set when the path to stName doesn't follow the entry of
+        its prev: it has the stations before prev, nearest first, until one
+        whose entry it follows (see tree_path).
+        The stations that min_cam routes with min_cam_exits (st_from or
+        stName can leave their interval through several nodes) are reached
+        with a second search from all the exits of st_from, with its costs.
+        The stations of a middle interval are reached through the cheaper of
+        its two nodes.'''
+        if self.transfer_line_time(0) < 0:  # Metro is closed
+            return None
+        graph, speed = self.graph, self.train_speed
+        tree = {st_from: {'dist': 0, 'time': 0, 'tmTrans': 0, 'prev': None,
+                          'via': None}}
+
+        def add(st_name, entry):
+            old = tree.get(st_name)
+            if old is None or old['time'] > entry['time']:
+                tree[st_name] = entry
+        entries = self.st_index.get(st_from, NODE_ENTRY)
+        # Stations of the intervals of st_from are reached directly
+        # chains = [(names, entries, tail)], stations reached along an
+        # interval from names[0] and their entries, tail is the via of
+        # names[0]. Their via are set at the end, when the tree is complete
+        own_intervals, chains = set(), []
+        for ln_from, pos_from, int_from, _ in entries:
+            if ln_from == 0:
+                continue
+            own_intervals.add((ln_from, int_from))
+            line_names = self.st_names[ln_from]
+            start, last = self.st_intervals[ln_from][int_from][:2]
+            for step in (1, -1):
+                pos, chain = pos_from + step, ([st_from], [None], None)
+                while start <= pos <= last:
+                    distance = dist(self.st_dist[ln_from], pos_from, pos)
+                    entry = {'dist': distance,
+                             'time': round(distance/speed, 1), 'tmTrans': 0,
+                             'prev': chain[0][-1], 'via': None}
+                    add(line_names[pos], entry)
+                    chain[0].append(line_names[pos])
+                    chain[1].append(entry)
+                    pos += step
+                chains.append(chain)
+        # exits = [(line, walk)], walk = (st_nm_path, dist_travelled,
+        #                                 st_node_nm)
+        exits = [(entry[0], walk) for entry in entries for walk in entry[3]]
+        if len(exits) == 0:  # No station nodes in the lines
+            return tree
+        # roots = {(id, line) -> station before the node when it is reached
+        # by the walk of an exit, None if it is st_from}
+        roots = {}
+        # node_tree of the searches, searches[by_exits] = (node_data, labels)
+        # where by_exits is True for the search of min_cam_exits, from all
+        # the exits of st_from. The nodes of the tree come from
+        # searches[tree_search]
+        searches, tree_search = {}, len(exits) > 1
+        if not tree_search:
+            ln_from, begin = exits[0]
+            st_node, tm_used = st_from, 0
+            if begin[2] is not None:  # If it has moved
+                st_node, tm_used = begin[2], round(begin[1]/speed, 1)
+                tree[st_node] = {'dist': begin[1],
+                                 'time': round(begin[1]/speed, 1),
+                                 'tmTrans': 0, 'prev': begin[0][-1],
+                                 'via': None}
+            st_id, offset, labels = graph.ids[st_node], begin[1], {}
+            searches[False] = (self.node_tree(st_id, ln_from, tm_used,
+                                              labels=labels), labels)
+        else:
+            st_id, tm_used, offset = -1, 0, 0
+
+        def search(by_exits):
+            if by_exits not in searches:
+                starts, labels = [], {}
+                for ln_exit, walk in exits:
+                    nd_id = graph.ids[walk[2] or st_from]
+                    starts.append((nd_id, walk[1], ln_exit))
+                    roots[(nd_id, ln_exit)] = walk[0][-1] if walk[0] else None
+                searches[by_exits] = (self.node_tree(-1, starts=starts,
+                                                     labels=labels), labels)
+            return searches[by_exits]
+
+        def hop(st_prev, st_at, at_ln):
+            # Stations from st_at back to st_prev, reached through at_ln,
+            # nearest first and without st_at (a middle interval between)
+            return tuple(reversed(self.st_between.get(
+                (graph.names[st_prev], graph.names[st_at], at_ln), ()))) + \
+                (graph.names[st_prev], )
+
+        def via_path(by_exits, st_at, at_ln):
+            # Stations before st_at in the path of its label (st_at, at_ln),
+            # nearest first, until one whose entry of the tree follows it.
+            # None if the entry of st_at already does
+            labels, path = search(by_exits)[1], []
+            while not (by_exits == tree_search and pred_lines[st_at] == at_ln):
+                st_prev, ln_prev = labels[(st_at, at_ln)]
+                if st_prev == -1:  # The node of an exit
+                    if roots[(st_at, at_ln)] is not None:
+                        path.append(roots[(st_at, at_ln)])
+                    break
+                path += hop(st_prev, st_at, at_ln)
+                st_at, at_ln = st_prev, ln_prev
+            return tuple(path) or None
+
+        def arrival(nd_name, ln_to, by_exits):
+            # (nd_dist, tm_trans, via) of the best arrival to nd_name to
+            # continue at ln_to, None if there is none. via are the stations
+            # before nd_name if its entry doesn't follow the arrival
+            nd_id = graph.ids[nd_name]
+            if nd_id == st_id and not by_exits:  # The node of st_from
+                tm_trans = 0
+                if ln_from != 0 and ln_from != ln_to:
+                    tm_trans = self.transfer_line_time(tm_used)
+                return (offset, tm_trans, None) if tm_trans >= 0 else None
+            best = self.node_arrival(search(by_exits)[0][4][nd_id], ln_to,
+                                     0 if by_exits else tm_used)
+            if best is None:
+                return None
+            _, st_prev, through_ln, nd_dist, tm_trans, ln_prev = best
+            via = None
+            if by_exits != tree_search or dists[nd_id] is None or \
+                    pred_lines[nd_id] != through_ln or \
+                    labels[(nd_id, through_ln)] != (st_prev, ln_prev):
+                if st_prev == -1:  # Reached by the walk of an exit
+                    via = (roots[(nd_id, through_ln)], )
+                    if via[0] is None:
+                        via = None
+                else:
+                    via = hop(st_prev, nd_id, through_ln) + \
+                        (via_path(by_exits, st_prev, ln_prev) or ())
+            return (nd_dist if by_exits else offset + nd_dist, tm_trans, via)
+        (pred_nodes, pred_lines, dists, tms_trans, _), labels = \
+            search(tree_search)
+        for nd_id, nd_dist in enumerate(dists):
+            if nd_dist is None or nd_id == st_id:
+                continue
+            tm_trans = tms_trans[nd_id]
+            st_prev, ln_prev = labels[(nd_id, pred_lines[nd_id])]
+            if st_prev == -1:  # Reached by the walk of an exit
+                prev, via = roots[(nd_id, pred_lines[nd_id])], None
+            else:
+                path = hop(st_prev, nd_id, pred_lines[nd_id]) + \
+                    (via_path(tree_search, st_prev, ln_prev) or ())
+                prev, via = path[0], path[1:] or None
+            tree[graph.names[nd_id]] = {
+                'dist': offset + nd_dist,
+                'time': round((offset + nd_dist)/speed, 1) + tm_trans,
+                'tmTrans': tm_trans, 'prev': prev, 'via': via}
+        # Stations that are not nodes leave their interval through a node,
+        # the ones of middle intervals through any of the two. min_cam routes
+        # them with min_cam_exits if st_from or them have several exits
+        for ln_to, intervals in self.st_intervals.items():
+            line_names = self.st_names[ln_to]
+            for int_to, (start, last, step) in enumerate(intervals):
+                if (ln_to, int_to) in own_intervals:
+                    continue
+                for pos_nd, nd_step in ((last + 1, 1), (start - 1, -1)):
+                    if step not in {0, nd_step} or \
+                            not 0 <= pos_nd < len(line_names):
+                        continue
+                    nd_name, nd_arrivals = line_names[pos_nd], {}
+                    prev, nd_chains, passed = nd_name, {}, []
+                    for pos in range(pos_nd - nd_step,
+                                     pos_nd - nd_step*(last - start + 2),
+                                     -nd_step):
+                        st_name = line_names[pos]
+                        by_exits = tree_search or sum(
+                            len(entry[3])
+                            for entry in self.st_index[st_name]) > 1
+                        if by_exits not in nd_arrivals:
+                            nd_arrivals[by_exits] = arrival(nd_name, ln_to,
+                                                            by_exits)
+                        if nd_arrivals[by_exits] is not None:
+                            nd_dist, tm_trans, via = nd_arrivals[by_exits]
+                            distance = nd_dist + dist(self.st_dist[ln_to],
+                                                      pos, pos_nd)
+                            time = round(distance/speed, 1) + tm_trans
+                            if graph.ids[nd_name] == st_id and not by_exits:
+                                time = round(distance/speed + tm_trans, 1)
+                            if by_exits not in nd_chains:
+                                nd_chains[by_exits] = (
+                                    [nd_name] + passed,
+                                    [None]*(len(passed) + 1), via)
+                                chains.append(nd_chains[by_exits])
+                            entry = {'dist': distance, 'time': time,
+                                     'tmTrans': tm_trans, 'prev': prev,
+                                     'via': None}
+                            add(st_name, entry)
+                        for kind, (names, chain_entries, _) in \
+                                nd_chains.items():
+                            names.append(st_name)
+                            chain_entries.append(
+                                entry if kind == by_exits and
+                                nd_arrivals[by_exits] is not None else None)
+                        prev = st_name
+                        passed.append(st_name)
+        # A station before another of its chain can have a better entry, the
+        # path then goes back along the chain until one that keeps it
+        for names, chain_entries, tail in chains:
+            for i in range(1, len(names)):
+                if tree.get(names[i]) is not chain_entries[i]:
+                    continue
+                via = []
+                for k in range(i - 1, 0, -1):
+                    if tree.get(names[k]) is chain_entries[k]:
+                        break
+                    via.append(names[k - 1])
+                else:
+                    via += tail or ()
+                chain_entries[i]['via'] = tuple(via) or None
+        return tree
+
+    def tree_path(self, tree, st_to):
+        '''
+        tree_path
+        ---------
+        Returns the path from the root of a min_cam_tree tree to st_to, None
+        if st_to was not reached.'''
+        if st_to not in tree:
+            return None
+        path, st_at = [st_to], st_to
+        while tree[st_at]['prev'] is not None:
+            path.append(tree[st_at]['prev'])
+            path += tree[st_at]['via'] or ()
+            st_at = path[-1]
+        return tuple(reversed(path))
+
+    def min_cam_many(self, pairs, departure_times=None, chunk_size=1024):
+        '''
+        min_cam_many
+        ------------
+        Generator that yields min_cam(st_from, st_to) for every (st_from,
+        st_to) in pairs, in the same order.
+        departure_times gives the (day, hour, minute) of each pair, as in
+        set_hour. If it is None, start_travel_time is used for all of them.
+        Pairs are read in chunks of chunk_size and grouped by departure time
+        and destination, so set_hour is done once per group, the heuristic
+        table of the destination is reused from the h_cache by the whole
+        group and identical searches between nodes (stations that move to
+        the same nodes) are only done once per group. Every pair is still a
+        query of its own, that goes through the result cache and the
+        instrumentation as in min_cam (see routed_query).
+        The pairs of a group don't share a search tree: the transfer times
+        depend on the time elapsed since the departure, so a search from the
+        destination can't be reused by the origins.'''
+        pairs = iter(pairs)
+        departures = repeat(None) if departure_times is None \
+            else iter(departure_times)
+        search = MetAtenas.min_cam.__wrapped__
+        start_travel_time = self.start_travel_time
+        while True:
+            chunk = list(islice(zip(pairs, departures), chunk_size))
+            if len(chunk) == 0:
+                return
+            results = [None]*len(chunk)
+            groups = defaultdict(list)
+            for pos, ((st_from, st_to), departure) in enumerate(chunk):
+                groups[(departure, st_to)].append((pos, st_from))
+            try:
+                for (departure, st_to), queries in groups.items():
+                    self.start_travel_time = start_travel_time
+                    if departure is not None:
+                        self.set_hour(*departure)
+                    found = {}
+
+                    def group_search(*node_args):
+                        if node_args not in found:
+                            found[node_args] = search(*node_args)
+                        return found[node_args]
+                    for pos, st_from in queries:
+                        results[pos] = routed_query(self, st_from, st_to, (),
+                                                    {}, group_search)
+            finally:
+                self.start_travel_time = start_travel_time
+            yield from results
 
 
 if __name__ == '__main__':
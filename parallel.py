@@ -0,0 +1,138 @@
+'''Process pool that solves batches of min_cam queries in parallel.
+The network of the MetAtenas (MetAtenas.network_state) is pickled once into a
+block file, in /dev/shm when it exists so it is kept in shared memory, that
+the workers map with mmap:
+    [8 bytes: len(state)][pickle(state)]
+Every task only carries the path of the block and a chunk of queries, the
+workers load the network the first time they see a block and keep it.
+'''
+
+import mmap
+import multiprocessing
+import os
+import pickle
+import tempfile
+
+from min_route import MetAtenas
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Network loaded by the worker process and the block it was loaded from
+_worker_metro = None
+_worker_block = None
+
+
+def _worker_solve(task):
+    '''
+    _worker_solve
+    -------------
+    Solves a chunk of queries in a worker process. The task is
+    (block_name, pairs, departure_times).'''
+    global _worker_metro
+    global _worker_block
+    block_name, pairs, departure_times = task
+    if block_name != _worker_block:
+        with open(block_name, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as block:
+            size = int.from_bytes(block[:8], 'little')
+            state = pickle.loads(block[8:8 + size])
+        _worker_metro = MetAtenas.from_state(state)
+        _worker_block = block_name
+    return list(_worker_metro.min_cam_many(pairs, departure_times))
+
+
+class ParallelRouter:
+    '''
+    ParallelRouter
+    --------------
+    Fans out min_cam queries of metro to a pool of workers processes and
+    collects the results in order.
+    Each call to min_cam_many works on the network metro has when it is
+    called. If break_line, set_speed or set_hour are called while the
+    results are being read, that batch keeps using the old network and the
+    next one ships the new one.'''
+    def __init__(self, metro, workers=None, chunk_size=256, mp_context=None):
+        self.metro = metro
+        self.chunk_size = chunk_size
+        context = mp_context or multiprocessing.get_context()
+        self.pool = context.Pool(processes=workers)
+        # Block files, path -> batches still reading it
+        self.blocks = {}
+        self.block_name = None
+        self.block_state = None
+
+    def publish(self):
+        '''
+        publish
+        -------
+        Writes the current network of metro into a block file if it has
+        changed since the last one, and returns the path of the block.'''
+        state = self.metro.network_state()
+        if state != self.block_state:
+            data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+            fd, block_name = tempfile.mkstemp(prefix='metro_', dir=SHM_DIR)
+            with os.fdopen(fd, 'wb') as file:
+                file.write(len(data).to_bytes(8, 'little'))
+                file.write(data)
+            self.blocks[block_name] = 0
+            self.block_name, self.block_state = block_name, state
+        return self.block_name
+
+    def min_cam_many(self, pairs, departure_times=None):
+        '''
+        min_cam_many
+        ------------
+        Parallel version of MetAtenas.min_cam_many. The queries are sent to
+        the workers in chunks of chunk_size and the results are yielded in
+        the same order as pairs.'''
+        pairs = list(pairs)
+        if departure_times is not None:
+            departure_times = list(departure_times)
+        results = self._results(self.publish(), pairs, departure_times)
+        # Takes the block, it is released when the results are closed
+        next(results)
+        return results
+
+    def _results(self, block_name, pairs, departure_times):
+        tasks = ((block_name, pairs[pos:pos + self.chunk_size],
+                  None if departure_times is None
+                  else departure_times[pos:pos + self.chunk_size])
+                 for pos in range(0, len(pairs), self.chunk_size))
+        self.blocks[block_name] += 1
+        try:
+            # Started by min_cam_many, so the finally also runs if the
+            # results are closed or collected before being read
+            yield
+            for results in self.pool.imap(_worker_solve, tasks):
+                yield from results
+        finally:
+            self.blocks[block_name] -= 1
+            self.release(keep=self.block_name)
+
+    def release(self, keep=None):
+        '''
+        release
+        -------
+        Removes the block files no batch is reading, except the one named
+        keep. If keep is None all of them are removed.'''
+        for name, users in list(self.blocks.items()):
+            if keep is None or (name != keep and users == 0):
+                del self.blocks[name]
+                os.remove(name)
+        if keep is None:
+            self.block_name, self.block_state = None, None
+
+    def close(self):
+        '''
+        close
+        -----
+        Stops the workers and removes the block files.'''
+        self.pool.close()
+        self.pool.join()
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,109 @@
+'''Cache of the routes returned by MetAtenas.min_cam, checked before the
+stations are moved to the graph (see min_route.move_to_graph).
+Key Format:
+(st_from, st_to, args, kwargs, train_speed, search_mode, frontier,
+ departure bucket)
+    args and kwargs are the other arguments of min_cam, search_mode and
+frontier the ones of the MetAtenas used when they are not given, and the
+departure bucket is start_travel_time quantized to bucket_minutes
+(MetAtenas.time_bucket). With bucket_minutes=1 the results are the same as
+without the cache, with longer buckets every departure of a bucket gets the
+route of the first one asked.
+    The faults of the network are not part of the key, MetAtenas empties the
+cache when a line is broken or restored (see MetAtenas.edge_changed).
+'''
+
+import time
+from collections import OrderedDict
+
+# Stored for the routes that don't exist, as None is a valid result
+NO_ROUTE = object()
+
+
+class ResultCache:
+    '''
+    ResultCache
+    -----------
+    Least recently used cache of min_cam results with at most max_size
+    entries. If ttl is given, entries older than ttl seconds (measured with
+    clock) are dropped when they are read. MetAtenas empties it when the
+    network, the speed or the tables used by min_cam change.'''
+    def __init__(self, max_size=1024, ttl=None, bucket_minutes=1,
+                 clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.bucket_minutes = bucket_minutes
+        self.clock = clock
+        # key -> (route, time it was stored), least recently used first
+        self.entries = OrderedDict()
+        self.hits, self.misses = 0, 0
+        self.evictions, self.expirations, self.invalidations = 0, 0, 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, metro, st_from, st_to, args=(), kwargs=None):
+        '''
+        key
+        ---
+        Returns the key of min_cam(st_from, st_to, *args, **kwargs) for the
+        current state of metro.'''
+        # The frontier that counts its calls (see instrumentation) finds the
+        # same routes as the one it replaces
+        frontier = getattr(metro.frontier, 'base', metro.frontier)
+        return (st_from, st_to, tuple(args),
+                tuple(sorted((kwargs or {}).items())), metro.train_speed,
+                metro.search_mode, frontier,
+                metro.time_bucket(self.bucket_minutes))
+
+    def get(self, key):
+        '''
+        get
+        ---
+        Returns a copy of the route stored at key, None if there is no route
+        between the stations, or NO_ROUTE if the key is not stored.'''
+        entry = self.entries.get(key)
+        if entry is not None and self.ttl is not None and \
+                self.clock() - entry[1] > self.ttl:
+            del self.entries[key]
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return NO_ROUTE
+        self.hits += 1
+        self.entries.move_to_end(key)
+        # A copy, so the caller can't modify the stored route
+        return None if entry[0] is None else dict(entry[0])
+
+    def put(self, key, route):
+        '''
+        put
+        ---
+        Stores route at key, removing the least recently used entries if
+        there are more than max_size.'''
+        self.entries[key] = (None if route is None else dict(route),
+                             self.clock())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        '''
+        clear
+        -----
+        Removes all the entries, called when they are no longer valid.'''
+        if self.entries:
+            self.invalidations += 1
+        self.entries.clear()
+
+    def stats(self):
+        '''
+        stats
+        -----
+        Returns the counters of the cache as a dictionary.'''
+        return {'size': len(self.entries), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations}
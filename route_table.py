@@ -0,0 +1,248 @@
+'''All-pairs route table of the station nodes for a train speed and a time
+bucket of the week.
+RouteTable JSON Format: {
+    "__routeTable__": true,
+    "names": [stNode1, stNode2, ...],
+    "states": [[st_id, st_lin], ...],
+    "speed": train_speed, "bucket": bucket, "bucketMinutes": bucket_minutes,
+    "fingerprint": CompiledGraph.fingerprint(),
+    "rows": [[pred_states, final_states, costs], ...]
+}
+    There is a row for every state (st_id, st_lin), st_lin being one of the
+lines of the node or 0. The search of a row labels every node once per line
+it is reached through (see MetAtenas.node_tree), the labels being the states
+of the table. pred_states stores the shortest path tree from the row state,
+the state each label was reached from (-1 if not reached or if it is the row
+state), final_states the label used to reach every state of the table (-1
+if not reached) and costs the cost of reaching each node (-1 if not
+reached).
+'''
+
+import json
+from array import array
+from collections import defaultdict
+
+from metro_graph import week_time
+
+
+class RouteTable:
+    '''
+    RouteTable
+    ----------
+    Shortest paths between every pair of station node states, with predecessor
+    matrices to rebuild the full paths. The transfer times used are the ones
+    of the start of the time bucket, the costs of the paths returned by route
+    are calculated again for the actual departure time.'''
+    def __init__(self, names, states, speed, bucket, bucket_minutes,
+                 fingerprint):
+        self.names = tuple(names)
+        self.ids = {st_name: st_id for st_id, st_name in enumerate(self.names)}
+        self.states = tuple(tuple(state) for state in states)
+        self.state_ids = {state: row for row, state in enumerate(self.states)}
+        self.speed = speed
+        self.bucket = bucket
+        self.bucket_minutes = bucket_minutes
+        self.fingerprint = fingerprint
+        self.rows = [None]*len(self.states)
+        # Lines used by the rows, {frozenset((st_id_1, st_id_2)) -> {row}}
+        self.edge_rows = defaultdict(set)
+
+    @classmethod
+    def build(cls, metro, bucket_minutes=30):
+        '''
+        build
+        -----
+        Builds the table of metro for its current train speed and the time
+        bucket of bucket_minutes its start_travel_time belongs to.'''
+        graph = metro.graph
+        states = []
+        for st_id, st_name in enumerate(graph.names):
+            states.append((st_id, 0))
+            states += [(st_id, lin) for lin in metro.st_lin[st_name][::2]]
+        table = cls(graph.names, states, metro.train_speed,
+                    metro.time_bucket(bucket_minutes), bucket_minutes,
+                    graph.fingerprint())
+        for row in range(len(states)):
+            table.build_row(metro, row)
+        return table
+
+    def matches(self, metro):
+        '''
+        matches
+        -------
+        Returns True if the table can answer the queries of metro with its
+        current speed and departure time.'''
+        return (self.speed == metro.train_speed
+                and self.bucket == metro.time_bucket(self.bucket_minutes))
+
+    def build_row(self, metro, row):
+        '''
+        build_row
+        ---------
+        Calculates the shortest path tree from the state of the row, with the
+        same costs used by min_cam, departing at the start of the bucket.'''
+        st_src, lin_from = self.states[row]
+        start_travel_time = metro.start_travel_time
+        metro.start_travel_time = self.bucket_start()
+        try:
+            labels = {}
+            _, _, dists, tms_trans, arrivals = metro.node_tree(
+                st_src, lin_from, labels=labels)
+            final_states = array('q', [-1])*len(self.states)
+            for col, (st_to, lin_to) in enumerate(self.states):
+                best = metro.node_arrival(arrivals[st_to], lin_to)
+                if best is not None:
+                    final_states[col] = self.state_ids[(st_to, best[2])]
+        finally:
+            metro.start_travel_time = start_travel_time
+        pred_states = array('q', [-1])*len(self.states)
+        for state, label_prev in labels.items():
+            if label_prev[0] != -1:
+                pred_states[self.state_ids[state]] = \
+                    self.state_ids[label_prev]
+        costs = array('d', (-1 if st_dist is None
+                            else round(st_dist/self.speed, 1) + tm_trans
+                            for st_dist, tm_trans in zip(dists, tms_trans)))
+        self.set_row(row, (pred_states, final_states, costs))
+
+    def set_row(self, row, values):
+        '''
+        set_row
+        -------
+        Stores the arrays of the row and indexes the lines its paths use.'''
+        if self.rows[row] is not None:
+            for edge in self.row_edges(row):
+                self.edge_rows[edge].discard(row)
+        self.rows[row] = values
+        for edge in self.row_edges(row):
+            self.edge_rows[edge].add(row)
+
+    def row_edges(self, row):
+        '''
+        row_edges
+        ---------
+        Returns the lines, frozenset((st_id_1, st_id_2)), used by the paths
+        of the row.'''
+        return {frozenset((self.states[state_prev][0], self.states[col][0]))
+                for col, state_prev in enumerate(self.rows[row][0])
+                if state_prev != -1}
+
+    def bucket_start(self):
+        '''
+        bucket_start
+        ------------
+        Returns the (day, hour, minute) the time bucket starts at.'''
+        return week_time(self.bucket*self.bucket_minutes)
+
+    def path(self, st_from, st_to, lin_from=0, lin_to=0):
+        '''
+        path
+        ----
+        Returns the node names of the shortest path between st_from and st_to
+        and the lines used to reach each of them after st_from. Returns None
+        if st_to can't be reached.'''
+        row = self.state_ids[(self.ids[st_from], lin_from)]
+        col = self.state_ids[(self.ids[st_to], lin_to)]
+        pred_states, final_states = self.rows[row][:2]
+        state = final_states[col]
+        if state == -1:
+            return None
+        path, path_lines = [], []
+        # The labels are reached through their line, up to the row state
+        while state != row:
+            st_id, through_ln = self.states[state]
+            path.append(st_id)
+            path_lines.append(through_ln)
+            state = pred_states[state]
+        path.append(self.ids[st_from])
+        return (tuple(self.names[st_id] for st_id in reversed(path)),
+                tuple(reversed(path_lines)))
+
+    def route(self, metro, st_from, st_to, lin_from=0, lin_to=0, tm_used=0):
+        '''
+        route
+        -----
+        Answers min_cam from the table. The costs of the path are the ones
+        obtained at metro.route_costs for its departure time.'''
+        found = self.path(st_from, st_to, lin_from, lin_to)
+        if found is None:
+            return None
+        path, path_lines = found
+        costs = metro.route_costs(path, path_lines, lin_from, lin_to, tm_used)
+        if costs is None:
+            return None
+        return {'path': path, 'dist': costs[0], 'tmTrans': costs[1]}
+
+    def remove_edge(self, metro, st_1, st_2):
+        '''
+        remove_edge
+        -----------
+        Updates the table after the line between st_1 and st_2 has been
+        removed from metro. Only the rows whose paths used it are calculated
+        again. Returns the number of rows recalculated.'''
+        rows = sorted(self.edge_rows.get(frozenset((self.ids[st_1],
+                                                    self.ids[st_2])), ()))
+        for row in rows:
+            self.build_row(metro, row)
+        self.fingerprint = metro.graph.fingerprint()
+        return len(rows)
+
+    def restore_edge(self, metro, st_1, st_2):
+        '''
+        restore_edge
+        ------------
+        Updates the table after the line between st_1 and st_2 has been
+        restored in metro. A row is calculated again if travelling through
+        the line could reach one of its ends, or continue from it on the line,
+        sooner than now, allowing for the longest transfer time.
+        Returns the number of rows recalculated.'''
+        id_1, id_2 = self.ids[st_1], self.ids[st_2]
+        min_time = min(distance for st_name, _, distance
+                       in metro.st_nodes[st_1] if st_name == st_2)/self.speed
+        max_trans = metro.max_transfer_time()
+        rebuilt = 0
+        for row in range(len(self.rows)):
+            costs = self.rows[row][2]
+            if any(costs[id_at] != -1 and (
+                    costs[id_nxt] == -1
+                    or costs[id_at] + min_time - 0.1 < costs[id_nxt] + max_trans)
+                   for id_at, id_nxt in ((id_1, id_2), (id_2, id_1))):
+                self.build_row(metro, row)
+                rebuilt += 1
+        self.fingerprint = metro.graph.fingerprint()
+        return rebuilt
+
+    def save(self, file_name):
+        '''
+        save
+        ----
+        Stores the table at file_name in the RouteTable JSON format.'''
+        data = {'__routeTable__': True, 'names': self.names,
+                'states': self.states, 'speed': self.speed,
+                'bucket': self.bucket, 'bucketMinutes': self.bucket_minutes,
+                'fingerprint': self.fingerprint,
+                'rows': [[values.tolist() for values in row]
+                         for row in self.rows]}
+        with open(file_name, 'w', encoding="utf-8") as file:
+            json.dump(data, file)
+
+    @classmethod
+    def load(cls, file_name):
+        '''
+        load
+        ----
+        Loads a table stored with save.'''
+        with open(file_name, 'r', encoding="utf-8") as file:
+            data = json.load(file)
+        if '__routeTable__' not in data:
+            raise ValueError(f"{file_name} is not a route table")
+        if any(len(values) != 3 for values in data['rows']):
+            raise ValueError(f"{file_name} was saved with an older format")
+        table = cls(data['names'], data['states'], data['speed'],
+                    data['bucket'], data['bucketMinutes'],
+                    data['fingerprint'])
+        for row, values in enumerate(data['rows']):
+            table.set_row(row, tuple(array(typecode, row_values)
+                                     for typecode, row_values
+                                     in zip('qqd', values)))
+        return table
@@ -0,0 +1,196 @@
+'''Compiled binary snapshot of a lineasMetro network, loaded with mmap.
+Snapshot Format (little endian):
+    header: magic b'METSNAP\0', version (u32), n_sections (u32),
+            sha1 of the source json (20 bytes), sha1 of the sections data
+            (20 bytes)
+    n_sections entries: name (8 bytes), typecode (1 byte), offset (u64),
+                        length in bytes (u64)
+    sections data, each one aligned to 8 bytes:
+        'names'    B  station names in utf-8, separated by '\n'
+        'lnoffs'   q  [ln - 1 -> first position of the line, ..., total]
+        'lnst'     q  [position -> station id]
+        'lndist'   q/d [position -> distance]
+        'nodes'    q  [node id -> station id], in the stNodes order
+        'adyoffs'  q  CompiledGraph.offsets of the nodes
+        'adyids'   q  CompiledGraph.neighbors
+        'adylin'   q  CompiledGraph.lines
+        'adydist'  q/d CompiledGraph.distances
+        'ints'     q  [(ln, start, last, step), ...] flattened
+        'mindist'  d  [min_node_dist]
+    The graph arrays are used straight from the mapped pages, so all the
+processes that load the same snapshot share them. The lines and the
+adyacencies are still rebuilt as dictionaries by each process (see
+load_snapshot).
+'''
+
+import hashlib
+import mmap
+import struct
+import sys
+from array import array
+
+from metro_graph import CompiledGraph
+from min_route import MetAtenas
+
+SNAPSHOT_MAGIC = b'METSNAP\0'
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct('<8sII20s20s')
+SECTION = struct.Struct('<8scQQ')
+
+
+def file_checksum(file_name):
+    '''
+    file_checksum
+    -------------
+    Returns the sha1 digest of the file at file_name.'''
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def typed_array(values):
+    '''
+    typed_array
+    -----------
+    Returns values as an int array ('q') if all of them are integers and as
+    a float one ('d') if not.'''
+    values = list(values)
+    is_int = all(isinstance(value, int) for value in values)
+    return array('q' if is_int else 'd', values)
+
+
+def write_snapshot(json_file, snapshot_file):
+    '''
+    write_snapshot
+    --------------
+    Converts the lineasMetro json file json_file into a snapshot stored at
+    snapshot_file.'''
+    metro = MetAtenas(json_file)
+    names = list(metro.st_lin.keys())
+    ids = {st_name: st_id for st_id, st_name in enumerate(names)}
+    ln_offs, ln_st, ln_dist = array('q', [0]), array('q'), []
+    for num_ln in sorted(metro.st_names):
+        ln_st.extend(ids[st_name] for st_name in metro.st_names[num_ln])
+        ln_dist += metro.st_dist[num_ln]
+        ln_offs.append(len(ln_st))
+    graph = metro.graph
+    intervals = array('q')
+    for num_ln, line_intervals in metro.st_intervals.items():
+        for interval in line_intervals:
+            intervals.extend((num_ln, ) + tuple(interval))
+    sections = [
+        (b'names', array('B', '\n'.join(names).encode('utf-8'))),
+        (b'lnoffs', ln_offs), (b'lnst', ln_st),
+        (b'lndist', typed_array(ln_dist)),
+        (b'nodes', array('q', (ids[st_name] for st_name in graph.names))),
+        (b'adyoffs', graph.offsets), (b'adyids', graph.neighbors),
+        (b'adylin', graph.lines), (b'adydist', graph.distances),
+        (b'ints', intervals),
+        (b'mindist', array('d', [metro.min_node_dist]))]
+    offset = HEADER.size + SECTION.size*len(sections)
+    entries, data = [], bytearray()
+    for name, values in sections:
+        data += bytes(-(offset + len(data)) % 8)
+        entries.append(SECTION.pack(name, values.typecode.encode('ascii'),
+                                    offset + len(data),
+                                    len(values)*values.itemsize))
+        data += values.tobytes()
+    with open(snapshot_file, 'wb') as file:
+        file.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(sections),
+                               file_checksum(json_file),
+                               hashlib.sha1(data).digest()))
+        file.write(b''.join(entries))
+        file.write(data)
+
+
+def read_sections(snapshot_file, verify=False):
+    '''
+    read_sections
+    -------------
+    Maps snapshot_file and returns (header values, sections), sections being
+    a dictionary name -> memoryview of the mapped pages. If verify is True,
+    the checksum of the data is checked (all the pages are read).'''
+    with open(snapshot_file, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, n_sections, source_sum, data_sum = \
+        HEADER.unpack_from(mapped)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"{snapshot_file} is not a metro snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"{snapshot_file} is a version {version} snapshot, "
+                         f"version {SNAPSHOT_VERSION} is needed")
+    buffer, sections = memoryview(mapped), {}
+    data_start = HEADER.size + SECTION.size*n_sections
+    for pos in range(n_sections):
+        name, typecode, offset, length = SECTION.unpack_from(
+            mapped, HEADER.size + SECTION.size*pos)
+        sections[name.rstrip(b'\0').decode('ascii')] = \
+            buffer[offset:offset + length].cast(typecode.decode('ascii'))
+    if verify and hashlib.sha1(buffer[data_start:]).digest() != data_sum:
+        raise ValueError(f"{snapshot_file} is corrupted")
+    return (magic, version, source_sum, data_sum), sections
+
+
+def is_stale(snapshot_file, json_file):
+    '''
+    is_stale
+    --------
+    Returns True if snapshot_file was not built from the current contents
+    of json_file.'''
+    return read_sections(snapshot_file)[0][2] != file_checksum(json_file)
+
+
+def load_snapshot(snapshot_file, verify=False):
+    '''
+    load_snapshot
+    -------------
+    Returns the data of the snapshot in the lineasMetro format, with the
+    'adyacencies', 'minNodeDist', 'intervals' and 'graph' that MetAtenas
+    uses instead of calculating them. Only the graph arrays are the mapped
+    pages: 'lin', 'stNm', 'stDist' and 'adyacencies' are built as
+    dictionaries from them, because MetAtenas looks them up on every search
+    and break_line and remove_edge change the adyacencies. Those are not
+    shared between processes, the snapshot only saves calculating them.'''
+    sections = read_sections(snapshot_file, verify)[1]
+    names = bytes(sections['names']).decode('utf-8').split('\n')
+    ln_offs, ln_st, ln_dist = (sections['lnoffs'], sections['lnst'],
+                               sections['lndist'])
+    dict_lin, dict_st_nm, dict_st_dist = {}, {}, {}
+    for n_lin in range(1, len(ln_offs)):
+        start, end = ln_offs[n_lin - 1], ln_offs[n_lin]
+        dict_st_nm[n_lin] = tuple(names[st_id] for st_id in ln_st[start:end])
+        dict_st_dist[n_lin] = tuple(ln_dist[start:end])
+        for st_pos, st_name in enumerate(dict_st_nm[n_lin]):
+            dict_lin[st_name] = dict_lin.get(st_name, ()) + (n_lin, st_pos)
+    node_names = [names[st_id] for st_id in sections['nodes']]
+    graph = CompiledGraph.from_arrays(node_names, sections['adyoffs'],
+                                      sections['adyids'], sections['adylin'],
+                                      sections['adydist'])
+    adyacencies = {st_name: tuple(
+        (node_names[graph.neighbors[edge]], graph.lines[edge],
+         graph.distances[edge]) for edge in graph.edges(st_id))
+        for st_id, st_name in enumerate(node_names)}
+    intervals = {n_lin: () for n_lin in dict_st_nm}
+    flat = sections['ints']
+    for pos in range(0, len(flat), 4):
+        intervals[flat[pos]] += (tuple(flat[pos + 1:pos + 4]), )
+    return {'lin': dict_lin, 'stNm': dict_st_nm, 'stDist': dict_st_dist,
+            'stNodes': {st_name: () for st_name in node_names},
+            'adyacencies': adyacencies,
+            'minNodeDist': sections['mindist'][0],
+            'intervals': intervals, 'graph': graph}
+
+
+def load_metro(snapshot_file, verify=False, **kwargs):
+    '''
+    load_metro
+    ----------
+    Creates a MetAtenas from a snapshot, kwargs are passed to MetAtenas.'''
+    return MetAtenas(load_snapshot(snapshot_file, verify), **kwargs)
+
+
+if __name__ == '__main__':
+    # python snapshot.py lineasMetro.json lineasMetro.snap
+    write_snapshot(sys.argv[1], sys.argv[2])
@@ -0,0 +1,67 @@
+'''Uniform grid index of points of the canvas, used by main.py to find the
+station or the fault point under the mouse without checking all of them.
+Grid Format: {(col, row) -> [(key, x, y), ...]}
+    A point (x, y) is stored at the cell (x//cell_size, y//cell_size). A
+query of radius r only reads the cells that overlap the square of side 2*r
+around it, so with cell_size >= 2*r it reads at most 4 cells.
+'''
+
+from collections import defaultdict
+
+
+class GridIndex:
+    '''
+    GridIndex
+    ---------
+    Points with a key, stored in square cells of cell_size pixels. Distances
+    are measured as in main.py, a point is within radius of (x, y) if both
+    abs(x - point_x) and abs(y - point_y) are at most radius.'''
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.size = 0
+
+    @classmethod
+    def from_points(cls, points, cell_size):
+        '''
+        from_points
+        -----------
+        Returns the index of points, an iterable of (key, x, y).'''
+        index = cls(cell_size)
+        for key, x, y in points:
+            index.insert(key, x, y)
+        return index
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, key, x, y):
+        '''
+        insert
+        ------
+        Adds the point (x, y) with key.'''
+        self.cells[(x//self.cell_size, y//self.cell_size)].append((key, x, y))
+        self.size += 1
+
+    def within(self, x, y, radius):
+        '''
+        within
+        ------
+        Yields (key, distance) of the points within radius of (x, y).'''
+        size = self.cell_size
+        for col in range(int((x - radius)//size), int((x + radius)//size) + 1):
+            for row in range(int((y - radius)//size),
+                             int((y + radius)//size) + 1):
+                for key, point_x, point_y in self.cells.get((col, row), ()):
+                    distance = max(abs(x - point_x), abs(y - point_y))
+                    if distance <= radius:
+                        yield key, distance
+
+    def nearest(self, x, y, radius):
+        '''
+        nearest
+        -------
+        Returns the key of the nearest point within radius of (x, y), None if
+        there is none.'''
+        return min(self.within(x, y, radius), key=lambda found: found[1],
+                   default=(None, ))[0]
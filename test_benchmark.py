@@ -0,0 +1,39 @@
+import json
+
+from benchmark import main, synthetic_network
+from conftest import LINEAS_METRO
+from min_route import MetAtenas, lineas_metro_hook
+
+
+def run_main(tmp_path, *argv):
+    output = tmp_path / 'results.json'
+    main(list(argv) + ['--queries', '5', '--faults', '1', '--repeat', '1',
+                       '--output', str(output)])
+    with open(output) as file:
+        return json.load(file)
+
+
+def test_synthetic_network():
+    data = synthetic_network(3, 8, seed=1)
+    assert data == synthetic_network(3, 8, seed=1)
+    metro = MetAtenas(lineas_metro_hook(data))
+    assert len(metro.st_names) == 3
+    assert all(len(names) == 8 for names in metro.st_names.values())
+
+
+def test_benchmark_synthetic(tmp_path):
+    results = run_main(tmp_path, '--lines', '3', '--stations', '8')
+    network = results['network']
+    assert network['lines'] == 3
+    assert network['stations'] == 8
+    assert network['totalStations'] >= 8
+    for name, stats in results['benchmarks'].items():
+        assert stats['calls'] > 0, name
+        assert stats['min'] <= stats['median'] <= stats['max']
+
+
+def test_benchmark_network(tmp_path):
+    results = run_main(tmp_path, '--network', LINEAS_METRO)
+    metro = MetAtenas(LINEAS_METRO)
+    assert results['network']['totalStations'] == len(metro.st_lin)
+    assert results['network']['nodes'] == len(metro.st_nodes)
@@ -0,0 +1,68 @@
+import pytest
+
+from conftest import metro_with_nodes
+from hierarchy import ContractionHierarchy
+
+
+def route_time(metro, route):
+    return round(route['dist']/metro.train_speed, 1) + route['tmTrans']
+
+
+def hierarchy_routes(metro, hierarchy):
+    # min_cam between all the stations with and without the hierarchy
+    stations = list(metro.st_lin)
+    for st_from in stations:
+        for st_to in stations:
+            if st_to != st_from:
+                metro.hierarchies = [hierarchy]
+                with_hierarchy = metro.min_cam(st_from, st_to)
+                metro.hierarchies = []
+                yield (with_hierarchy, metro.min_cam(st_from, st_to),
+                       metro.min_cam(st_from, st_to, mode='states'))
+
+
+@pytest.mark.parametrize('network', ['athens_metro', 'middle_metro',
+                                     'extended_metro'])
+@pytest.mark.parametrize('day, hour, minute', [('Wednesday', 10, 0),
+                                               ('Wednesday', 10, 17),
+                                               ('Sunday', 23, 30)])
+def test_hierarchy_as_states(request, network, day, hour, minute):
+    metro = request.getfixturevalue(network)
+    metro.set_hour(day, hour, minute)
+    hierarchy = ContractionHierarchy.build(metro)
+    assert hierarchy.matches(metro)
+    for with_hierarchy, astar, route in hierarchy_routes(metro, hierarchy):
+        assert (with_hierarchy is None) == (route is None)
+        if route is not None:
+            assert route_time(metro, with_hierarchy) == \
+                pytest.approx(route_time(metro, route))
+            assert astar is None or route_time(metro, with_hierarchy) <= \
+                route_time(metro, astar) + 1e-9
+
+
+def test_hierarchy_matches(tmp_path):
+    metro = metro_with_nodes('Eleonas')
+    metro.set_hour('Wednesday', 10, 0)
+    hierarchy = ContractionHierarchy.build(metro)
+    metro.use_hierarchy(hierarchy)
+    route = metro.min_cam('Piraeus', 'Egaleo')
+    hierarchy.save(tmp_path / 'hierarchy.json')
+    loaded = ContractionHierarchy.load(tmp_path / 'hierarchy.json')
+    assert (loaded.rank, loaded.up) == (hierarchy.rank, hierarchy.up)
+    metro.use_hierarchy(loaded)
+    assert metro.hierarchies == [loaded]
+    assert metro.min_cam('Piraeus', 'Egaleo') == route
+    # Other buckets and speeds aren't answered from it
+    metro.set_hour('Wednesday', 10, 30)
+    assert not loaded.matches(metro)
+    metro.set_hour('Wednesday', 10, 0)
+    metro.set_speed(40)
+    assert not loaded.matches(metro)
+    metro.set_speed(80)
+    # Nor the network with a broken line, until it is restored
+    metro.break_line('Syntagma', 'Monastiraki')
+    assert not loaded.matches(metro)
+    metro.restore_line('Syntagma', 'Monastiraki')
+    assert loaded.matches(metro)
+    with pytest.raises(ValueError):
+        metro_with_nodes().use_hierarchy(loaded)
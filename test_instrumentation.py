@@ -0,0 +1,87 @@
+import pytest
+
+from conftest import LINEAS_METRO
+from instrumentation import Instrumentation
+from min_route import MetAtenas
+
+PAIRS = [('Piraeus', 'Kifissia'), ('Syntagma', 'Thissio'),
+         ('Egaleo', 'Doukissis Plakentias'), ('Sepolia', 'Koropi')]
+
+
+def test_instrumentation_routes():
+    metro, counted = MetAtenas(LINEAS_METRO), MetAtenas(LINEAS_METRO)
+    stats = counted.use_instrumentation(Instrumentation(keep=2))
+    for departure in (('Wednesday', 10, 5), ('Monday', 5, 0)):
+        metro.set_hour(*departure)
+        counted.set_hour(*departure)
+        for st_from, st_to in PAIRS:
+            for mode in ('astar', 'states', 'bidirectional'):
+                assert counted.min_cam(st_from, st_to, mode=mode) == \
+                    metro.min_cam(st_from, st_to, mode=mode)
+    assert stats.totals['queries'] == 2*3*len(PAIRS)
+    assert len(stats.queries) == 2
+    # Every search, heuristic tables included, is done in a query
+    assert stats.totals['expanded'] == sum(
+        mode_stats['expanded'] for mode_stats in counted.search_stats.values())
+
+
+def test_instrumentation_query_stats():
+    metro = MetAtenas(LINEAS_METRO)
+    metro.set_hour('Wednesday', 10, 5)
+    stats = metro.use_instrumentation(Instrumentation())
+    metro.min_cam('Monastiraki', 'Syntagma')
+    first = stats.last()
+    assert first['from'] == 'Monastiraki' and first['to'] == 'Syntagma'
+    assert first['found'] and not first['cacheHit']
+    assert first['searches'] == {'heuristic': 1, 'astar': 1}
+    assert first['heuristicMisses'] == 1 and first['heuristicHits'] == 0
+    assert first['expanded']['astar'] > 0
+    assert first['pushes'] >= first['pops'] > 0
+    assert first['stalePops'] >= 0
+    assert first['transferCalls'] > 0
+    assert first['searchTime'] == pytest.approx(first['time']
+                                                - first['heuristicTime'])
+    metro.min_cam('Monastiraki', 'Syntagma')
+    assert stats.last()['heuristicHits'] == 1
+    assert stats.last()['heuristicMisses'] == 0
+    assert stats.totals['pushes'] == first['pushes'] + stats.last()['pushes']
+    # Closed metro
+    metro.set_hour('Monday', 5, 0)
+    metro.min_cam('Monastiraki', 'Syntagma')
+    assert not stats.last()['found']
+
+
+def test_instrumentation_hooks():
+    metro = MetAtenas(LINEAS_METRO)
+    metro.set_hour('Wednesday', 10, 5)
+    stats = metro.use_instrumentation(Instrumentation())
+    events = []
+
+    def hook(event, data):
+        events.append((event, data))
+    for event in ('query_start', 'search', 'query_end'):
+        stats.add_hook(event, hook)
+    with pytest.raises(ValueError):
+        stats.add_hook('query', hook)
+    metro.min_cam('Monastiraki', 'Syntagma')
+    assert [event for event, _ in events] == ['query_start', 'search',
+                                             'search', 'query_end']
+    assert events[0][1] == ('Monastiraki', 'Syntagma')
+    assert events[1][1][0] == 'heuristic' and events[2][1][0] == 'astar'
+    assert events[-1][1] is stats.last()
+    stats.remove_hook('search', hook)
+    metro.min_cam('Monastiraki', 'Syntagma')
+    assert [event for event, _ in events[4:]] == ['query_start', 'query_end']
+
+
+def test_instrumentation_detach():
+    metro = MetAtenas(LINEAS_METRO)
+    frontier = metro.frontier
+    stats = metro.use_instrumentation(Instrumentation())
+    assert metro.frontier.base is frontier
+    metro.use_instrumentation(None)
+    assert metro.frontier is frontier
+    assert 'transfer_line_time' not in metro.__dict__
+    metro.set_hour('Wednesday', 10, 5)
+    metro.min_cam('Piraeus', 'Kifissia')
+    assert stats.totals['queries'] == 0
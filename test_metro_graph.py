@@ -0,0 +1,40 @@
+import pytest
+
+from metro_graph import CompiledGraph, week_time, WEEK_MINUTES
+
+
+@pytest.mark.parametrize('network', ['athens_metro', 'extended_metro'])
+def test_compiled_graph(request, network):
+    metro = request.getfixturevalue(network)
+    graph = metro.graph
+    assert graph.names == tuple(metro.st_nodes)
+    for st_name, adyacencies in metro.st_nodes.items():
+        st_id = graph.ids[st_name]
+        assert graph.names[st_id] == st_name
+        assert tuple((graph.names[graph.neighbors[edge]], graph.lines[edge],
+                      graph.distances[edge])
+                     for edge in graph.edges(st_id)) == tuple(adyacencies)
+    copy = CompiledGraph.from_arrays(
+        graph.names, memoryview(graph.offsets), memoryview(graph.neighbors),
+        memoryview(graph.lines), memoryview(graph.distances))
+    assert copy.fingerprint() == graph.fingerprint()
+
+
+def test_compiled_graph_break_line(athens_metro):
+    graph = athens_metro.graph
+    athens_metro.break_line('Syntagma', 'Monastiraki')
+    try:
+        broken = athens_metro.graph
+        assert broken is not graph
+        assert broken.fingerprint() != graph.fingerprint()
+        assert len(broken.neighbors) == len(graph.neighbors) - 2
+    finally:
+        athens_metro.restore_line('Syntagma', 'Monastiraki')
+    assert athens_metro.graph.fingerprint() == graph.fingerprint()
+
+
+def test_week_time():
+    assert week_time(0) == (0, 0, 0)
+    assert week_time(2*24*60 + 10*60 + 5) == (2, 10, 5)
+    assert week_time(WEEK_MINUTES + 61) == (0, 1, 1)
+    assert week_time(-1) == (6, 23, 59)
@@ -0,0 +1,69 @@
+import io
+import json
+import os
+
+import pytest
+
+from metro_loader import stream_data, stream_lineas, stream_ndjson
+from min_route import MetAtenas, lineas_metro_hook
+
+LINEAS_METRO = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'lineasMetro.json')
+
+
+@pytest.fixture(scope='module')
+def lineas_metro():
+    with open(LINEAS_METRO) as file:
+        return json.load(file)
+
+
+def stream(data, chunk_size=1 << 16):
+    return stream_lineas(io.StringIO(json.dumps(data)), chunk_size=chunk_size)
+
+
+def test_stream_lineas(lineas_metro):
+    assert stream(lineas_metro) == lineas_metro_hook(lineas_metro)
+
+
+@pytest.mark.parametrize('chunk_size', [7, 1 << 16])
+def test_stream_lineas_extra_keys(lineas_metro, chunk_size):
+    data = {'comment': 'x', **lineas_metro,
+            'extra': {'lineas': [1, 2], 'stNodes': None}}
+    assert stream(data, chunk_size) == lineas_metro_hook(lineas_metro)
+
+
+def test_stream_lineas_not_metro(lineas_metro):
+    data = dict(lineas_metro, __lineasMetro__=False)
+    with pytest.raises(ValueError):
+        stream(data)
+
+
+def ndjson_rows(data):
+    yield json.dumps({'__lineasMetro__': True})
+    for line in data['lineas']:
+        yield json.dumps(line)
+    # The nodes can be split in several rows
+    half = len(data['stNodes'])//2
+    yield ''
+    yield json.dumps({'stNodes': data['stNodes'][:half]})
+    yield json.dumps({'stNodes': data['stNodes'][half:]})
+
+
+def test_stream_ndjson(lineas_metro, tmp_path):
+    text = '\n'.join(ndjson_rows(lineas_metro)) + '\n'
+    expected = lineas_metro_hook(lineas_metro)
+    metro = MetAtenas(LINEAS_METRO)
+    metro.set_hour('Wednesday', 10, 5)
+    route = metro.min_cam('Piraeus', 'Kifissia')
+    assert stream_ndjson(io.StringIO(text)) == expected
+    for suffix in ('.ndjson', '.jsonl'):
+        file_name = tmp_path / ('lineasMetro' + suffix)
+        file_name.write_text(text)
+        assert stream_data(str(file_name)) == expected
+        metro = MetAtenas(str(file_name))
+        metro.set_hour('Wednesday', 10, 5)
+        assert metro.min_cam('Piraeus', 'Kifissia') == route
+    # Other suffixes are read as JSON unless ndjson is given
+    file_name = tmp_path / 'lineasMetro.txt'
+    file_name.write_text(text)
+    assert stream_data(str(file_name), ndjson=True) == expected
@@ -0,0 +1,342 @@
+import random
+
+import pytest
+
+from conftest import LINEAS_METRO, metro_with_nodes
+from instrumentation import Instrumentation
+from metro_graph import week_time
+from min_route import (HeapFrontier, MetAtenas, SortedFrontier, belongs_to,
+                       dist)
+from result_cache import ResultCache
+
+
+def test_frontiers_pop_order():
+    rng = random.Random(0)
+    heap, ordered = HeapFrontier(), SortedFrontier()
+    costs, popped = {}, ([], [])
+    for step in range(2000):
+        if rng.random() < 0.6:
+            # Few different costs, so there are ties
+            costs[step] = rng.randrange(20)
+            heap.push(costs[step], step)
+            ordered.push(costs[step], step)
+        elif len(heap):
+            assert costs[heap.peek()] == costs[ordered.peek()]
+            popped[0].append(heap.pop())
+            popped[1].append(ordered.pop())
+        assert len(heap) == len(ordered)
+    assert [costs[step] for step in popped[0]] == \
+        [costs[step] for step in popped[1]]
+    # The heap extracts the ties in insertion order
+    assert all(step_1 < step_2 for step_1, step_2
+               in zip(popped[0], popped[0][1:])
+               if costs[step_1] == costs[step_2])
+
+
+@pytest.mark.parametrize('network', ['athens_metro', 'extended_metro'])
+def test_frontiers_routes(request, network):
+    metro = request.getfixturevalue(network)
+    metro.set_hour('Wednesday', 10, 5)
+    stations = list(metro.st_lin)
+    for st_name in metro.st_nodes:
+        assert metro.heuristic_costs(st_name, frontier=HeapFrontier) == \
+            metro.heuristic_costs(st_name, frontier=SortedFrontier)
+    for st_from in stations[::2]:
+        for st_to in stations[1::2]:
+            if st_to != st_from:
+                assert metro.min_cam(st_from, st_to,
+                                     frontier=HeapFrontier) == \
+                    metro.min_cam(st_from, st_to, frontier=SortedFrontier)
+
+
+def test_heuristic_table_cache():
+    metro = MetAtenas(LINEAS_METRO)
+    nodes = list(metro.st_nodes)
+    metro.h_cache_size = 3
+    table = metro.heuristic_table(nodes[0])
+    assert metro.heuristic_table(nodes[0]) is table
+    assert table == metro.heuristic_ids(metro.graph.ids[nodes[0]])
+    assert {metro.graph.names[st_id]: cost for st_id, cost in enumerate(table)
+            if cost is not None} == metro.heuristic_costs(nodes[0])
+    for st_name in nodes[1:4]:
+        metro.heuristic_table(st_name)
+    # The least recently used table is dropped
+    assert list(metro.h_cache) == [(st_name, 0) for st_name in nodes[1:4]]
+    metro.set_speed(40)
+    assert not metro.h_cache
+    metro.precompute_heuristics()
+    assert len(metro.h_cache) == metro.h_cache_size > 3
+    for (st_name, st_lin), table in metro.h_cache.items():
+        assert table == metro.heuristic_ids(metro.graph.ids[st_name], st_lin)
+
+
+def test_middle_intervals(middle_metro):
+    assert any(step == 0 for intervals in middle_metro.st_intervals.values()
+               for _, _, step in intervals)
+
+
+def test_move_to_node(athens_metro):
+    # The walks of the index are the ones move_to_node calculated from the
+    # intervals
+    metro = athens_metro
+    for num_ln, st_nm in metro.st_names.items():
+        st_dist, intervals = metro.st_dist[num_ln], metro.st_intervals[num_ln]
+        for st_pos, st_name in enumerate(st_nm):
+            if st_name in metro.st_nodes:
+                assert st_name not in metro.st_index
+                continue
+            start, last, step = intervals[belongs_to(intervals, st_pos)]
+            pos_nd = last + 1 if step == 1 else start - 1
+            assert metro.move_to_node(num_ln, st_pos) == (
+                st_nm[st_pos:pos_nd:step], dist(st_dist, st_pos, pos_nd),
+                st_nm[pos_nd])
+    assert metro.move_to_node(0, 0) == ((), 0, None)
+
+
+def test_station_index(middle_metro):
+    metro = middle_metro
+    for st_name, st_lin in metro.st_lin.items():
+        if st_name in metro.st_nodes:
+            continue
+        entries = metro.st_index[st_name]
+        assert [entry[:2] for entry in entries] == \
+            list(zip(st_lin[::2], st_lin[1::2]))
+        for num_ln, st_pos, int_id, walks in entries:
+            st_nm, st_dist = metro.st_names[num_ln], metro.st_dist[num_ln]
+            start, last, step = metro.st_intervals[num_ln][int_id]
+            assert start <= st_pos <= last
+            assert len(walks) == (2 if step == 0 else 1)
+            for path, walk_dist, st_node in walks:
+                pos_nd = st_nm.index(st_node)
+                assert st_node in metro.st_nodes
+                assert path[0] == st_name and st_node not in path
+                assert walk_dist == dist(st_dist, st_pos, pos_nd)
+            if step == 0:
+                between = metro.st_between[(st_nm[start - 1], st_nm[last + 1],
+                                            num_ln)]
+                assert tuple(between) == tuple(st_nm[start:last + 1])
+                assert st_name in between
+
+
+def test_min_cam_exits_visits_nodes_once():
+    # Iraklio is in a middle interval, its route to Egaleo could go to
+    # Syntagma and back to Monastiraki to transfer later
+    metro = metro_with_nodes('Kato Patissia', 'Neratziotissa', 'Evangelismos',
+                             'Holargos', 'Thissio', 'Eleonas', 'Katehaki')
+    metro.set_hour('Sunday', 23, 50)
+    route = metro.min_cam('Iraklio', 'Egaleo')
+    assert 'Syntagma' not in route['path']
+    stations = list(metro.st_lin)
+    for st_from in stations:
+        for st_to in stations:
+            if st_to != st_from:
+                route = metro.min_cam(st_from, st_to)
+                if route is not None:
+                    assert len(set(route['path'])) == len(route['path'])
+
+
+@pytest.mark.parametrize('network', ['middle_metro', 'extended_metro'])
+@pytest.mark.parametrize('day, hour, minute', [('Wednesday', 10, 5),
+                                               ('Sunday', 23, 50),
+                                               ('Monday', 5, 31)])
+def test_min_cam_tree_as_min_cam(request, network, day, hour, minute):
+    metro = request.getfixturevalue(network)
+    metro.set_hour(day, hour, minute)
+    stations = list(metro.st_lin)
+    for st_from in stations:
+        tree = metro.min_cam_tree(st_from)
+        for st_to in stations:
+            if st_to == st_from:
+                continue
+            route = metro.min_cam(st_from, st_to, mode='states')
+            if route is None:
+                assert tree is None or st_to not in tree
+                continue
+            assert tree[st_to]['time'] == pytest.approx(route['time'])
+            assert tree[st_to]['dist'] == route['dist']
+            assert metro.tree_path(tree, st_to) == route['path']
+            astar = metro.min_cam(st_from, st_to)
+            assert astar is None or \
+                tree[st_to]['time'] <= astar['time'] + 1e-9
+
+
+def test_min_cam_tree_transfers(extended_metro):
+    # Monastiraki is reached first through line 1, but Egaleo is reached
+    # through line 3 from Syntagma without a second transfer
+    extended_metro.set_hour('Wednesday', 10, 5)
+    tree = extended_metro.min_cam_tree('Panepistimio')
+    assert tree['Egaleo']['time'] == pytest.approx(7.6)
+    assert tree['Eleonas']['time'] == pytest.approx(6.6)
+    assert extended_metro.tree_path(tree, 'Egaleo')[:3] == (
+        'Panepistimio', 'Syntagma', 'Monastiraki')
+
+
+def test_state_search_visits_nodes_once(extended_metro):
+    extended_metro.set_hour('Sunday', 23, 50)
+    route = extended_metro.min_cam('Iraklio', 'Egaleo', mode='states')
+    assert len(set(route['path'])) == len(route['path'])
+    stations = list(extended_metro.st_lin)
+    for st_from in stations:
+        for st_to in stations:
+            if st_to == st_from:
+                continue
+            route = extended_metro.min_cam(st_from, st_to, mode='states')
+            astar = extended_metro.min_cam(st_from, st_to)
+            assert (route is None) == (astar is None)
+            if route is not None:
+                assert len(set(route['path'])) == len(route['path'])
+                assert route['time'] <= astar['time'] + 1e-9
+
+
+def test_state_search_disconnected():
+    # The faults leave Syntagma apart from Monastiraki and Omonia
+    metro = MetAtenas(LINEAS_METRO)
+    metro.set_hour('Wednesday', 10, 0)
+    for fault in (('Syntagma', 'Monastiraki'), ('Omonia', 'Victoria'),
+                  ('Syntagma', 'Panepistimio')):
+        metro.break_line(*fault)
+    assert metro.min_cam('Syntagma', 'Monastiraki', mode='states') is None
+    stations = list(metro.st_lin)
+    for st_from in stations:
+        for st_to in stations:
+            if st_to != st_from:
+                route = metro.min_cam(st_from, st_to, mode='states')
+                astar = metro.min_cam(st_from, st_to)
+                assert (route is None) == (astar is None)
+
+
+def test_min_cam_many(middle_metro):
+    middle_metro.set_hour('Wednesday', 10, 5)
+    start_travel_time = middle_metro.start_travel_time
+    stations = list(middle_metro.st_lin)
+    pairs = [(st_from, st_to) for st_from in stations[::3]
+             for st_to in stations[1::4] if st_from != st_to]
+    departures = [('Sunday', 23, 50), ('Monday', 5, 0), ('Friday', 18, 0)]
+    departures = [departures[pos % 3] for pos in range(len(pairs))]
+    routes = list(middle_metro.min_cam_many(pairs, departures,
+                                            chunk_size=50))
+    assert middle_metro.start_travel_time == start_travel_time
+    assert len(routes) == len(pairs)
+    for (st_from, st_to), departure, route in zip(pairs, departures, routes):
+        middle_metro.set_hour(*departure)
+        assert route == middle_metro.min_cam(st_from, st_to)
+    # Monday 5:00 the metro is closed
+    assert all(route is None for route in routes[1::3])
+
+
+def test_min_cam_many_hooks():
+    metro = MetAtenas(LINEAS_METRO)
+    metro.set_hour('Wednesday', 10, 5)
+    cache = metro.use_result_cache(ResultCache())
+    stats = metro.use_instrumentation(Instrumentation())
+    pairs = [('Piraeus', 'Kifissia'), ('Sepolia', 'Koropi'),
+             ('Piraeus', 'Kifissia')]
+    routes = list(metro.min_cam_many(pairs))
+    assert routes[0] == routes[2] == metro.min_cam('Piraeus', 'Kifissia')
+    assert stats.totals['queries'] == 4
+    assert stats.totals['cacheHits'] == 2
+    assert cache.stats()['size'] == 2
+
+
+@pytest.mark.parametrize('network', ['middle_metro', 'extended_metro'])
+@pytest.mark.parametrize('day, hour, minute', [('Wednesday', 10, 5),
+                                               ('Sunday', 23, 50)])
+def test_bidirectional_search(request, network, day, hour, minute):
+    metro = request.getfixturevalue(network)
+    metro.set_hour(day, hour, minute)
+    stations = list(metro.st_lin)
+    for st_from in stations:
+        for st_to in stations:
+            if st_to == st_from:
+                continue
+            route = metro.min_cam(st_from, st_to, mode='bidirectional')
+            astar = metro.min_cam(st_from, st_to)
+            if astar is not None:
+                assert route['time'] <= astar['time'] + 1e-9
+            if route is not None:
+                assert route['time'] == pytest.approx(
+                    round(route['dist']/metro.train_speed, 1)
+                    + route['tmTrans'])
+
+
+@pytest.mark.parametrize('network', ['athens_metro', 'extended_metro'])
+def test_earliest_arrivals(request, network):
+    metro = request.getfixturevalue(network)
+    departures = [('Sunday', 23, 40), ('Monday', 0, 20), ('Monday', 5, 35),
+                  ('Wednesday', 10, 5)]
+    stations = list(metro.st_lin)
+    for st_from in stations[::2]:
+        for st_to in stations[1::3]:
+            if st_to == st_from:
+                continue
+            results = metro.earliest_arrivals(st_from, st_to, departures)
+            for departure, result in zip(departures, results):
+                metro.set_hour(*departure)
+                for mode in (None, 'states'):
+                    route = metro.min_cam(st_from, st_to, mode=mode)
+                    if route is None:
+                        continue
+                    assert result['time'] <= route['time'] + 1e-9
+                if result is not None:
+                    assert len(set(result['path'])) == len(result['path'])
+
+
+def test_min_cam_window(extended_metro):
+    trips = extended_metro.min_cam_window('Piraeus', 'Egaleo',
+                                          ('Wednesday', 10, 0), 60, step=5)
+    assert trips
+    # Pareto-optimal: a later departure always arrives later
+    departures = [trip['departure'] for trip in trips]
+    arrivals = [trip['arrival'] for trip in trips]
+    assert departures == sorted(set(departures))
+    assert arrivals == sorted(set(arrivals))
+    for trip in trips:
+        extended_metro.set_hour(*trip['departure'])
+        route = extended_metro.min_cam('Piraeus', 'Egaleo', mode='states')
+        assert trip['time'] <= route['time'] + 1e-9
+
+
+def test_transfer_profile():
+    metro = MetAtenas(LINEAS_METRO)
+    rng = random.Random(0)
+    metro.set_hour('Sunday', 23, 30)
+    times = [rng.randrange(0, 600)/10 for _ in range(300)]
+    direct = [metro.transfer_line_time(tm_used) for tm_used in times]
+    stations = list(metro.st_lin)
+    routes = [metro.min_cam(st_from, st_to) for st_from in stations[::3]
+              for st_to in stations[1::4] if st_from != st_to]
+    metro.compile_transfer_profile()
+    assert [metro.transfer_line_time(tm_used) for tm_used in times] == direct
+    assert [metro.transfer_at(metro.start_minute(), tm_used)
+            for tm_used in times] == direct
+    assert [metro.min_cam(st_from, st_to) for st_from in stations[::3]
+            for st_to in stations[1::4] if st_from != st_to] == routes
+
+
+@pytest.mark.parametrize('st_from, st_to', [('Piraeus', 'Egaleo'),
+                                            ('Kifissia', 'Koropi')])
+@pytest.mark.parametrize('departure', [('Sunday', 23, 20),
+                                       ('Monday', 5, 10)])
+def test_min_cam_window_pareto(extended_metro, st_from, st_to, departure):
+    trips = extended_metro.min_cam_window(st_from, st_to, departure, 45,
+                                          step=3)
+    # Same trips as with a search for every departure
+    day_names = sorted(extended_metro.day_val, key=extended_metro.day_val.get)
+    day, hour, minute = departure
+    start = (extended_metro.day_val[day]*24 + hour)*60 + minute
+    expected, first_arrival = [], None
+    for dep_minute in reversed(range(start, start + 46, 3)):
+        dep_day, dep_hour, dep_min = week_time(dep_minute)
+        extended_metro.set_hour(day_names[dep_day], dep_hour, dep_min)
+        route = extended_metro.min_cam(st_from, st_to, mode='states')
+        if route is None:
+            continue
+        if first_arrival is None or dep_minute + route['time'] < first_arrival:
+            first_arrival = dep_minute + route['time']
+            expected.append((day_names[dep_day], dep_hour, dep_min,
+                             route['time']))
+    assert [trip['departure'] + (pytest.approx(trip['time']), )
+            for trip in trips] == expected[::-1]
+    for trip in trips:
+        extended_metro.set_hour(*trip['departure'])
+        assert trip['arrival'] == extended_metro.get_time(trip['time'])
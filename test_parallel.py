@@ -0,0 +1,59 @@
+import gc
+import os
+
+import pytest
+
+from conftest import LINEAS_METRO
+from min_route import MetAtenas
+from parallel import ParallelRouter
+
+
+@pytest.fixture
+def router():
+    metro = MetAtenas(LINEAS_METRO)
+    metro.set_hour('Wednesday', 10, 5)
+    with ParallelRouter(metro, workers=2, chunk_size=16) as router:
+        yield router
+
+
+def test_parallel_as_sequential(router):
+    metro = router.metro
+    stations = list(metro.st_lin)
+    pairs = [(st_from, st_to) for st_from in stations[::4]
+             for st_to in stations[1::5] if st_from != st_to]
+    departures = [('Sunday', 23, 50), ('Monday', 5, 0), ('Friday', 18, 0)]
+    departures = [departures[pos % 3] for pos in range(len(pairs))]
+    assert list(router.min_cam_many(pairs)) == \
+        list(metro.min_cam_many(pairs))
+    assert list(router.min_cam_many(pairs, departures)) == \
+        list(metro.min_cam_many(pairs, departures))
+
+
+def test_parallel_network_changes(router):
+    metro = router.metro
+    first = router.min_cam_many([('Syntagma', 'Thissio')])
+    block_name = router.block_name
+    metro.break_line('Syntagma', 'Monastiraki')
+    second = router.min_cam_many([('Syntagma', 'Thissio')])
+    assert router.block_name != block_name
+    assert next(first)['path'] == ('Syntagma', 'Monastiraki', 'Thissio')
+    assert next(second)['path'][1] == 'Panepistimio'
+    first.close()
+    second.close()
+    assert list(router.blocks) == [router.block_name]
+    assert not os.path.exists(block_name)
+
+
+def test_parallel_results_not_read(router):
+    results = router.min_cam_many([('Piraeus', 'Kifissia')])
+    block_name = router.block_name
+    assert router.blocks[block_name] == 1
+    del results
+    gc.collect()
+    assert router.blocks[block_name] == 0
+    router.metro.break_line('Syntagma', 'Monastiraki')
+    list(router.min_cam_many([('Piraeus', 'Kifissia')]))
+    assert block_name not in router.blocks
+    assert not os.path.exists(block_name)
+    router.close()
+    assert not router.blocks
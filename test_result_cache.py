@@ -0,0 +1,82 @@
+from conftest import LINEAS_METRO
+from instrumentation import Instrumentation
+from min_route import MetAtenas
+from result_cache import NO_ROUTE, ResultCache
+
+PAIRS = [('Piraeus', 'Kifissia'), ('Syntagma', 'Thissio'),
+         ('Egaleo', 'Doukissis Plakentias'), ('Sepolia', 'Koropi')]
+
+
+def test_result_cache_routes():
+    metro, cached = MetAtenas(LINEAS_METRO), MetAtenas(LINEAS_METRO)
+    cache = cached.use_result_cache(ResultCache())
+    for departure in (('Wednesday', 10, 5), ('Monday', 5, 0),
+                      ('Sunday', 23, 50)):
+        metro.set_hour(*departure)
+        cached.set_hour(*departure)
+        for _ in range(2):
+            for st_from, st_to in PAIRS:
+                assert cached.min_cam(st_from, st_to) == \
+                    metro.min_cam(st_from, st_to)
+    assert cache.stats()['size'] == 3*len(PAIRS)
+    assert cache.hits == cache.misses == 3*len(PAIRS)
+    # The stored route is a copy
+    cached.min_cam('Piraeus', 'Kifissia')['dist'] = -1
+    assert cached.min_cam('Piraeus', 'Kifissia') == \
+        metro.min_cam('Piraeus', 'Kifissia')
+
+
+def test_result_cache_invalidation():
+    metro = MetAtenas(LINEAS_METRO)
+    metro.set_hour('Wednesday', 10, 5)
+    cache = metro.use_result_cache(ResultCache())
+    route = metro.min_cam('Syntagma', 'Thissio')
+    metro.break_line('Syntagma', 'Monastiraki')
+    assert len(cache) == 0
+    assert metro.min_cam('Syntagma', 'Thissio') != route
+    metro.restore_line('Syntagma', 'Monastiraki')
+    assert metro.min_cam('Syntagma', 'Thissio') == route
+    metro.set_speed(40)
+    assert len(cache) == 0
+    assert metro.min_cam('Syntagma', 'Thissio')['path'] == route['path']
+    metro.set_speed(40)
+    assert len(cache) == 1
+    # Other arguments of min_cam are other keys
+    assert metro.min_cam('Syntagma', 'Thissio', mode='states') == \
+        metro.min_cam('Syntagma', 'Thissio')
+    assert len(cache) == 2
+    assert cache.stats()['invalidations'] == 3
+
+
+def test_result_cache_buckets():
+    metro = MetAtenas(LINEAS_METRO)
+    cache = metro.use_result_cache(ResultCache(bucket_minutes=30))
+    metro.set_hour('Wednesday', 10, 0)
+    metro.min_cam('Piraeus', 'Kifissia')
+    metro.set_hour('Wednesday', 10, 29)
+    metro.min_cam('Piraeus', 'Kifissia')
+    assert (cache.hits, cache.misses) == (1, 1)
+    metro.set_hour('Wednesday', 10, 30)
+    metro.min_cam('Piraeus', 'Kifissia')
+    assert (cache.hits, cache.misses) == (1, 2)
+    # The counting frontier of the instrumentation uses the same keys
+    metro.use_instrumentation(Instrumentation())
+    metro.min_cam('Piraeus', 'Kifissia')
+    assert cache.hits == 2
+
+
+def test_result_cache_size_and_ttl():
+    now = [0]
+    cache = ResultCache(max_size=2, ttl=10, clock=lambda: now[0])
+    cache.put('a', {'path': ()})
+    cache.put('b', None)
+    assert cache.get('a') == {'path': ()}
+    cache.put('c', None)
+    # 'b' was the least recently used
+    assert cache.get('b') is NO_ROUTE
+    assert cache.get('c') is None
+    now[0] = 11
+    assert cache.get('a') is NO_ROUTE
+    assert cache.stats() == {'size': 1, 'hits': 2, 'misses': 2,
+                             'evictions': 1, 'expirations': 1,
+                             'invalidations': 0}
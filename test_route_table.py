@@ -0,0 +1,85 @@
+import pytest
+
+from conftest import metro_with_nodes
+from route_table import RouteTable
+
+
+def table_routes(metro, table):
+    # min_cam between all the stations with and without the table
+    stations = list(metro.st_lin)
+    for st_from in stations:
+        for st_to in stations:
+            if st_to != st_from:
+                metro.route_tables = [table]
+                with_table = metro.min_cam(st_from, st_to)
+                metro.route_tables = []
+                yield with_table, metro.min_cam(st_from, st_to, mode='states')
+
+
+@pytest.mark.parametrize('network', ['athens_metro', 'middle_metro',
+                                     'extended_metro'])
+@pytest.mark.parametrize('day, hour, minute', [('Wednesday', 10, 0),
+                                               ('Wednesday', 10, 17),
+                                               ('Sunday', 23, 30)])
+def test_route_table_as_states(request, network, day, hour, minute):
+    metro = request.getfixturevalue(network)
+    metro.set_hour(day, hour, minute)
+    table = RouteTable.build(metro)
+    assert table.matches(metro)
+    for with_table, route in table_routes(metro, table):
+        assert with_table == route
+
+
+def test_route_table_transfers(extended_metro):
+    # Monastiraki is reached first through line 1, but the table has to
+    # keep its label of line 3 to reach Eleonas without a second transfer
+    extended_metro.set_hour('Wednesday', 10, 0)
+    table = RouteTable.build(extended_metro)
+    path, path_lines = table.path('Panepistimio', 'Eleonas')
+    assert path == ('Panepistimio', 'Syntagma', 'Monastiraki', 'Eleonas')
+    assert path_lines[-1] == 3
+    route = table.route(extended_metro, 'Panepistimio', 'Eleonas')
+    assert route['tmTrans'] == 3
+
+
+def test_route_table_save_load(extended_metro, tmp_path):
+    extended_metro.set_hour('Friday', 18, 0)
+    table = RouteTable.build(extended_metro)
+    table.save(tmp_path / 'table.json')
+    loaded = RouteTable.load(tmp_path / 'table.json')
+    assert loaded.rows == table.rows
+    assert loaded.edge_rows == table.edge_rows
+    assert loaded.states == table.states
+
+
+def check_faults(metro, table):
+    # The cached heuristic tables and the incremental table are the same as
+    # the ones calculated again on the current network
+    for (st_name, st_lin), h_vals in metro.h_cache.items():
+        assert h_vals == metro.heuristic_ids(metro.graph.ids[st_name],
+                                             st_lin)
+    rebuilt = RouteTable.build(metro)
+    assert table.fingerprint == rebuilt.fingerprint
+    for with_table, route in table_routes(metro, table):
+        assert with_table == route
+    for with_table, route in table_routes(metro, rebuilt):
+        assert with_table == route
+    metro.route_tables = [table]
+
+
+@pytest.mark.parametrize('nodes', [(), ('Faliro', 'Thissio', 'Akropoli',
+                                        'Dafni', 'Eleonas', 'Katehaki')])
+def test_faults_incremental(nodes):
+    metro = metro_with_nodes(*nodes)
+    metro.set_hour('Wednesday', 10, 0)
+    table = RouteTable.build(metro)
+    metro.use_route_table(table)
+    metro.precompute_heuristics()
+    faults = [('Syntagma', 'Monastiraki'), ('Omonia', 'Victoria'),
+              ('Syntagma', 'Panepistimio')]
+    for fault in faults:
+        metro.break_line(*fault)
+        check_faults(metro, table)
+    for fault in faults:
+        metro.restore_line(*fault)
+        check_faults(metro, table)
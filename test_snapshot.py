@@ -0,0 +1,70 @@
+import shutil
+
+import pytest
+
+from conftest import LINEAS_METRO
+from min_route import MetAtenas
+from snapshot import is_stale, load_metro, load_snapshot, write_snapshot
+
+
+@pytest.fixture(scope='module')
+def snapshot_file(tmp_path_factory):
+    snapshot_file = tmp_path_factory.mktemp('snapshot') / 'lineasMetro.snap'
+    write_snapshot(LINEAS_METRO, str(snapshot_file))
+    return str(snapshot_file)
+
+
+def test_snapshot_round_trip(snapshot_file):
+    metro, loaded = MetAtenas(LINEAS_METRO), load_metro(snapshot_file, True)
+    assert loaded.st_lin == metro.st_lin
+    assert loaded.st_names == {num_ln: tuple(names) for num_ln, names
+                               in metro.st_names.items()}
+    assert loaded.st_dist == {num_ln: tuple(dists) for num_ln, dists
+                              in metro.st_dist.items()}
+    assert loaded.st_nodes == metro.st_nodes
+    assert loaded.min_node_dist == metro.min_node_dist
+    assert {num_ln: tuple(map(tuple, intervals)) for num_ln, intervals
+            in loaded.st_intervals.items()} == \
+        {num_ln: tuple(map(tuple, intervals)) for num_ln, intervals
+         in metro.st_intervals.items()}
+    for day, hour, minute in (('Wednesday', 10, 5), ('Sunday', 23, 50)):
+        metro.set_hour(day, hour, minute)
+        loaded.set_hour(day, hour, minute)
+        for st_from, st_to in (('Piraeus', 'Kifissia'),
+                               ('Egaleo', 'Doukissis Plakentias'),
+                               ('Sepolia', 'Koropi')):
+            assert loaded.min_cam(st_from, st_to) == \
+                metro.min_cam(st_from, st_to)
+
+
+def test_snapshot_break_line(snapshot_file):
+    metro, loaded = MetAtenas(LINEAS_METRO), load_metro(snapshot_file)
+    metro.set_hour('Wednesday', 10, 5)
+    loaded.set_hour('Wednesday', 10, 5)
+    metro.break_line('Syntagma', 'Monastiraki')
+    loaded.break_line('Syntagma', 'Monastiraki')
+    route = loaded.min_cam('Syntagma', 'Thissio')
+    assert route == metro.min_cam('Syntagma', 'Thissio')
+    assert route['path'][1] == 'Panepistimio'
+
+
+def test_snapshot_stale(snapshot_file, tmp_path):
+    assert not is_stale(snapshot_file, LINEAS_METRO)
+    json_file = tmp_path / 'lineasMetro.json'
+    shutil.copy(LINEAS_METRO, json_file)
+    with open(json_file, 'a') as file:
+        file.write('\n')
+    assert is_stale(snapshot_file, str(json_file))
+
+
+def test_snapshot_corrupted(snapshot_file, tmp_path):
+    corrupted = tmp_path / 'corrupted.snap'
+    data = bytearray(open(snapshot_file, 'rb').read())
+    data[-1] ^= 0xff
+    corrupted.write_bytes(bytes(data))
+    load_snapshot(str(corrupted))
+    with pytest.raises(ValueError):
+        load_snapshot(str(corrupted), verify=True)
+    corrupted.write_bytes(b'NOTASNAP' + bytes(data[8:]))
+    with pytest.raises(ValueError):
+        load_snapshot(str(corrupted))